@@ -4,8 +4,21 @@ import os
 import shutil
 import subprocess
 
+from preprocessing.download_dataset.cache import ArtifactCache, open_cache
+
+# 出力が変わる変更をした場合は上げて, キャッシュされた変換結果を作り直させる
+CONVERTER_VERSION = "1"
+
+
+def __execute_download(download_file: str, output_path: str, dataset_root: str, cache: ArtifactCache) -> None:
+    # git lfs のポインタに記録された SHA-256 が前回と同じ場合はダウンロードもコピーもしない
+    output_file_path = os.path.join(output_path, download_file)
+    inputs = {download_file: cache.lfs_digest(os.path.join(dataset_root, download_file))}
+    cache.save()
+    if cache.is_fresh(output_file_path, "dolly", CONVERTER_VERSION, inputs):
+        logging.info(f"{output_file_path} is up to date")
+        return
 
-def __execute_download(download_file: str, output_path: str, dataset_root: str) -> None:
     logging.info(f"Downloading {download_file} to {dataset_root}")
     current_dir = os.getcwd()
 
@@ -16,7 +29,11 @@ def __execute_download(download_file: str, output_path: str, dataset_root: str)
     os.chdir(current_dir)
 
     logging.info(f"Copying {download_file} to {output_path}")
-    shutil.copy(os.path.join(dataset_root, download_file), os.path.join(output_path, download_file))
+    if os.path.exists(output_path):
+        shutil.rmtree(output_path)
+    os.makedirs(output_path, exist_ok=True)
+    shutil.copy(os.path.join(dataset_root, download_file), output_file_path)
+    cache.record(output_file_path, "dolly", CONVERTER_VERSION, inputs, [output_file_path])
 
 
 def download_dataset(output_base: str = "output") -> None:
@@ -42,13 +59,9 @@ def download_dataset(output_base: str = "output") -> None:
     os.chdir(current_dir)
 
     output_path = os.path.join(output_base, "datasets/databricks-dolly-15k-ja")
-    if os.path.exists(output_path):
-        shutil.rmtree(output_path)
-    os.makedirs(output_path, exist_ok=True)
-
     filename = "databricks_dolly_15k_ja_for_dolly_training.jsonl"
     __execute_download(download_file=filename,
-                       output_path=output_path, dataset_root=dataset_root)
+                       output_path=output_path, dataset_root=dataset_root, cache=open_cache(output_base))
 
 
 def parse_args():
@@ -0,0 +1,26 @@
+"""
+書き込み途中で中断しても壊れないように, 一時ファイルに書いてから置き換えるためのユーティリティです.
+"""
+import contextlib
+import os
+from typing import IO, Iterator, Optional
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "w", encoding: Optional[str] = "utf8") -> Iterator[IO]:
+    """
+    `path` の一時ファイルを開き, with 文を抜けた時にディスクまで書き込んでから `path` に置き換えます.
+    例外が発生した場合は一時ファイルを削除し, `path` は変更しません.
+    """
+    # 複数のプロセスが同じファイルを書いても一時ファイルが衝突しないように, プロセス ID を付ける
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, mode, encoding=None if "b" in mode else encoding) as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
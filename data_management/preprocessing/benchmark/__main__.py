@@ -0,0 +1,154 @@
+"""
+filtering と dedup のベンチマークです.
+
+疑似的に生成した日本語 Web コーパスに対して, 文書数とワーカー数を変えて各ステージを実行し,
+docs/sec, MB/sec, ピークメモリ(RSS), フィルタごとの処理時間を JSON で出力します.
+各ケースは独立したプロセスで実行するため, ピークメモリはケースごとの値になります.
+
+$ python -m preprocessing.benchmark --preset smoke --output benchmark.json
+$ python -m preprocessing.benchmark --preset smoke --output new.json --compare benchmark.json
+"""
+import argparse
+import dataclasses
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from typing import Optional
+
+from preprocessing.benchmark.corpus import CorpusConfig, write_corpus
+from preprocessing.benchmark.runner import BenchmarkCase, run_case
+
+REPORT_VERSION = 1
+PRESETS = {
+    # ノートPCでも1分程度で終わる規模
+    "smoke": {"sizes": [2000], "num_workers": [1, 2], "dedup_sizes": [2000]},
+    "full": {"sizes": [10000, 100000], "num_workers": [1, 4, 8], "dedup_sizes": [10000]},
+}
+
+
+def __get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes: list[int], num_workers: list[int], corpus_config: CorpusConfig, work_dir: str,
+                  dedup_sizes: Optional[list[int]] = None) -> dict:
+    """
+    文書数ごとにコーパスを生成し, filtering は `sizes` の文書数, dedup は `dedup_sizes` (省略時は `sizes`) の文書数で,
+    それぞれ `num_workers` のワーカー数ごとに実行します.
+    """
+    dedup_sizes = sizes if dedup_sizes is None else dedup_sizes
+    results = []
+    for num_docs in sorted(set(sizes) | set(dedup_sizes)):
+        corpus_dir = os.path.join(work_dir, f"corpus-{num_docs}")
+        os.makedirs(corpus_dir, exist_ok=True)
+        input_bytes = write_corpus(dataclasses.replace(corpus_config, num_docs=num_docs),
+                                   os.path.join(corpus_dir, "corpus.jsonl"))
+
+        cases = []
+        if num_docs in sizes:
+            cases += [BenchmarkCase("filtering", num_docs, workers) for workers in num_workers]
+        if num_docs in dedup_sizes:
+            cases += [BenchmarkCase("dedup", num_docs, workers) for workers in num_workers]
+        for case in cases:
+            result = run_case(case, corpus_dir, input_bytes, work_dir)
+            print(f"{case.key}: {result['docs_per_sec']:.1f} docs/sec, {result['MB_per_sec']:.2f} MB/sec, "
+                  f"peak RSS {result['peak_rss_MB']:.1f} MB", file=sys.stderr)
+            results.append(result)
+
+    return {
+        "version": REPORT_VERSION,
+        "created_at": datetime.now().isoformat(),
+        "git_commit": __get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": {key: value for key, value in dataclasses.asdict(corpus_config).items() if key != "num_docs"},
+        "results": results,
+    }
+
+
+def compare_reports(baseline: dict, report: dict, max_regression: float) -> list[dict]:
+    """共通するケースの docs/sec を比較します. `max_regression` の割合より遅くなったケースを regression とします."""
+    baseline_results = {result["key"]: result for result in baseline["results"]}
+    comparisons = []
+    for result in report["results"]:
+        if result["key"] not in baseline_results:
+            continue
+        before, after = baseline_results[result["key"]]["docs_per_sec"], result["docs_per_sec"]
+        change = after / before - 1
+        comparisons.append({
+            "key": result["key"],
+            "baseline_docs_per_sec": before,
+            "docs_per_sec": after,
+            "change": change,
+            "regression": change < -max_regression,
+        })
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the filtering and dedup pipelines.')
+    parser.add_argument('--preset', type=str, choices=list(PRESETS), default="smoke",
+                        help='The sizes and worker counts to run')
+    parser.add_argument('--sizes', type=int, nargs='+', default=None,
+                        help='The numbers of documents (overrides the preset)')
+    parser.add_argument('--dedup_sizes', type=int, nargs='+', default=None,
+                        help='The numbers of documents for dedup (overrides the preset)')
+    parser.add_argument('--num_workers', type=int, nargs='+', default=None,
+                        help='The worker counts (overrides the preset)')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the synthetic corpus')
+    parser.add_argument('--mean_sentences', type=int, default=CorpusConfig.mean_sentences,
+                        help='The mean number of sentences per document')
+    parser.add_argument('--boilerplate_rate', type=float, default=CorpusConfig.boilerplate_rate,
+                        help='The ratio of documents containing boilerplate lines')
+    parser.add_argument('--duplicate_rate', type=float, default=CorpusConfig.duplicate_rate,
+                        help='The ratio of exact or near duplicate documents')
+    parser.add_argument('--ng_word_density', type=float, default=CorpusConfig.ng_word_density,
+                        help='The probability that a sentence contains an NG word')
+    parser.add_argument('--ads_rate', type=float, default=CorpusConfig.ads_rate,
+                        help='The ratio of documents containing many advertisement keywords')
+    parser.add_argument('--work_dir', type=str, default=None,
+                        help='The directory for the corpus and outputs (a temporary directory by default)')
+    parser.add_argument('--output', type=str, default=None, help='The JSON report file (stdout by default)')
+    parser.add_argument('--compare', type=str, default=None, help='A previous JSON report to compare against')
+    parser.add_argument('--max_regression', type=float, default=0.1,
+                        help='The allowed slowdown ratio in docs/sec when comparing reports')
+    args = parser.parse_args()
+
+    preset = PRESETS[args.preset]
+    corpus_config = CorpusConfig(
+        seed=args.seed, mean_sentences=args.mean_sentences, boilerplate_rate=args.boilerplate_rate,
+        duplicate_rate=args.duplicate_rate, ng_word_density=args.ng_word_density, ads_rate=args.ads_rate,
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = run_benchmark(args.sizes or preset["sizes"], args.num_workers or preset["num_workers"],
+                               corpus_config, args.work_dir or tmp_dir,
+                               dedup_sizes=args.dedup_sizes or preset["dedup_sizes"])
+
+    if args.output is None:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        with open(args.output, "w", encoding="utf8") as writer:
+            json.dump(report, writer, ensure_ascii=False, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, encoding="utf8") as fp:
+            comparisons = compare_reports(json.load(fp), report, args.max_regression)
+        for comparison in comparisons:
+            print(f"{comparison['key']}: {comparison['baseline_docs_per_sec']:.1f} -> "
+                  f"{comparison['docs_per_sec']:.1f} docs/sec ({comparison['change']:+.1%})"
+                  f"{' REGRESSION' if comparison['regression'] else ''}", file=sys.stderr)
+        if any(comparison["regression"] for comparison in comparisons):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
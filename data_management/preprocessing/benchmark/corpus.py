@@ -0,0 +1,95 @@
+"""
+ベンチマーク用の日本語 Web コーパスを疑似的に生成します.
+
+同じ設定と `seed` からは常に同じコーパスが生成されます.
+定型文(メニューやフッター, 日付, 広告), 重複文書, 文書の長さ, NG ワードの密度を調整できます.
+"""
+import collections
+import dataclasses
+import json
+import random
+from typing import Iterator
+
+from hojichar import document_filters
+
+SUBJECTS = [
+    "東京都", "私たち", "研究チーム", "この町", "新しい技術", "地元の学生", "政府", "多くの企業", "彼女", "担当者",
+    "専門家", "子どもたち", "観光客", "市役所", "大学病院", "開発者", "農家の人々", "図書館", "鉄道会社", "料理人",
+]
+OBJECTS = [
+    "人工知能の研究", "環境問題", "地域の祭り", "新しい商品", "日本語の文章", "朝ごはんの習慣", "春の天気", "古い建物",
+    "子育ての支援", "海外旅行", "再生可能エネルギー", "伝統的な工芸", "プログラミング教育", "医療の現場", "物流の仕組み",
+    "読書の楽しさ", "季節の野菜", "災害への備え", "スポーツの大会", "音楽の歴史",
+]
+PREDICATES = [
+    "について詳しく調べました。", "を紹介したいと思います。", "に大きな関心を持っています。", "の課題を話し合いました。",
+    "を少しずつ改善しています。", "の魅力を伝えています。", "について新しい発見がありました。", "を楽しみにしています。",
+    "の将来について考えています。", "に取り組んでいます。", "を分かりやすく説明しました。", "の変化に驚きました。",
+]
+BOILERPLATE = [
+    "ホーム", "続きを読む", "お問い合わせ", "利用規約", "プライバシーポリシー", "ページの先頭へ", "コメントする",
+    "前の記事", "次の記事", "カテゴリー", "Copyright © 2023 All Rights Reserved.", "この記事をシェアする",
+]
+
+
+@dataclasses.dataclass
+class CorpusConfig:
+    num_docs: int = 1000
+    seed: int = 0
+    # 文書あたりの平均文数
+    mean_sentences: int = 12
+    # 定型文を含む文書の割合
+    boilerplate_rate: float = 0.3
+    # 直近の文書の完全な複製, または1文だけ変えた複製である文書の割合
+    duplicate_rate: float = 0.1
+    # 複製元として保持する直近の文書数
+    duplicate_window: int = 1000
+    # 文ごとに NG ワードを含む確率
+    ng_word_density: float = 0.01
+    # 広告キーワードを多く含む文書の割合
+    ads_rate: float = 0.05
+
+
+def __read_keywords(name: str) -> list[str]:
+    with open(document_filters.BASE_PATH / "dict" / name, encoding="utf-8") as fp:
+        return [word.strip() for word in fp if word.strip()]
+
+
+def generate_documents(config: CorpusConfig) -> Iterator[dict]:
+    rng = random.Random(config.seed)
+    ng_words = __read_keywords("adult_keywords_ja.txt") + __read_keywords("discrimination_keywords_ja.txt")
+    ads_keywords = __read_keywords("advertisement_keywords_ja.txt")
+
+    def sentence() -> str:
+        text = f"{rng.choice(SUBJECTS)}は{rng.choice(OBJECTS)}{rng.choice(PREDICATES)}"
+        if rng.random() < config.ng_word_density:
+            text = text[:-1] + rng.choice(ng_words) + "。"
+        return text
+
+    texts: collections.deque[str] = collections.deque(maxlen=config.duplicate_window)
+    for idx in range(config.num_docs):
+        if texts and rng.random() < config.duplicate_rate:
+            lines = rng.choice(texts).split("\n")
+            if rng.random() < 0.5:
+                lines[rng.randrange(len(lines))] = sentence()
+        else:
+            lines = [sentence() for _ in range(max(1, int(rng.expovariate(1 / config.mean_sentences))))]
+            if rng.random() < config.boilerplate_rate:
+                lines = rng.sample(BOILERPLATE, 3) + lines + [f"{rng.randint(2015, 2023)}年{rng.randint(1, 12)}月"
+                                                              f"{rng.randint(1, 28)}日"] + rng.sample(BOILERPLATE, 2)
+            if rng.random() < config.ads_rate:
+                lines.append(" ".join(rng.choices(ads_keywords, k=20)))
+        text = "\n".join(lines)
+        texts.append(text)
+        yield {"text": text, "url": f"https://example.com/{config.seed}/{idx}"}
+
+
+def write_corpus(config: CorpusConfig, path: str) -> int:
+    """コーパスを JSONL として書き出し, 書き込んだバイト数を返します."""
+    size = 0
+    with open(path, "w", encoding="utf-8") as writer:
+        for document in generate_documents(config):
+            line = json.dumps(document, ensure_ascii=False) + "\n"
+            writer.write(line)
+            size += len(line.encode("utf-8"))
+    return size
@@ -0,0 +1,93 @@
+"""
+ベンチマークの各ケースを実行し, 処理時間とピークメモリを計測します.
+
+spawn で起動したプロセスから呼び出せるように, `__main__` とは別のモジュールに置いています.
+"""
+import dataclasses
+import json
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from preprocessing.chunking import Chunk, ChunkReader
+from preprocessing.dedup.__main__ import exec_hojichar_deduplication
+from preprocessing.filtering.__main__ import filtering
+
+
+@dataclasses.dataclass
+class BenchmarkCase:
+    stage: str
+    num_docs: int
+    num_workers: int = 1
+
+    @property
+    def key(self) -> str:
+        return f"{self.stage}/docs={self.num_docs}/workers={self.num_workers}"
+
+
+def __run_filtering(case: BenchmarkCase, corpus_dir: str, output_base: str) -> dict:
+    # 全てのワーカーに仕事が行き渡るように, ワーカーあたり4チャンク程度に分割する
+    corpus_size = os.path.getsize(os.path.join(corpus_dir, "corpus.jsonl"))
+    chunk_size = max(1, math.ceil(corpus_size / (case.num_workers * 4)))
+    filtering(corpus_dir, output_base, num_workers=case.num_workers, chunk_size=chunk_size)
+    with open(os.path.join(output_base, "stats.filtering.jsonl"), encoding="utf8") as fp:
+        return json.loads(fp.readline())
+
+
+def __run_dedup(case: BenchmarkCase, corpus_dir: str, output_base: str) -> dict:
+    stats: list[dict] = []
+    os.makedirs(output_base, exist_ok=True)
+    reader = ChunkReader(Chunk(os.path.join(corpus_dir, "corpus.jsonl"), 0, None))
+    exec_hojichar_deduplication(reader, output_base, stats, num_workers=case.num_workers)
+    return stats[0]
+
+
+def __run_case(case: BenchmarkCase, corpus_dir: str, output_base: str, connection) -> None:
+    """ケースを実行し, 計測結果を `connection` に送ります. 新しいプロセスで呼び出されます."""
+    start = time.perf_counter()
+    if case.stage == "filtering":
+        stat = __run_filtering(case, corpus_dir, output_base)
+    else:
+        stat = __run_dedup(case, corpus_dir, output_base)
+    elapsed = time.perf_counter() - start
+
+    # Linux では KiB, macOS ではバイト単位
+    unit = 1 if sys.platform == "darwin" else 1024
+    connection.send({
+        "elapsed": elapsed,
+        "peak_rss_MB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1000**2,
+        "peak_rss_workers_MB": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1000**2,
+        "stat": stat,
+    })
+    connection.close()
+
+
+def run_case(case: BenchmarkCase, corpus_dir: str, input_bytes: int, work_dir: str) -> dict:
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    output_base = os.path.join(work_dir, "output", case.key.replace("/", "_"))
+    process = context.Process(target=__run_case, args=(case, corpus_dir, output_base, sender))
+    process.start()
+    sender.close()
+    measured = receiver.recv()
+    process.join()
+
+    stat = measured["stat"]
+    elapsed = measured["elapsed"]
+    return {
+        "key": case.key,
+        **dataclasses.asdict(case),
+        "input_MB": input_bytes / 1000**2,
+        "elapsed_time": elapsed,
+        "docs_per_sec": case.num_docs / elapsed,
+        "MB_per_sec": input_bytes / 1000**2 / elapsed,
+        "peak_rss_MB": measured["peak_rss_MB"],
+        "peak_rss_workers_MB": measured["peak_rss_workers_MB"],
+        "discard_num": stat["total_info"]["discard_num"],
+        "layers_info": [
+            {key: layer[key] for key in ("name", "discard_num", "cumulative_time")} for layer in stat["layers_info"]
+        ],
+    }
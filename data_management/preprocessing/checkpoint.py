@@ -0,0 +1,126 @@
+"""
+filtering, dedup を途中から再開するためのチェックポイントです.
+
+`output_base` 直下の manifest.json に, 入力ファイルごとの処理状況を記録します.
+処理中のファイルは定期的に「入力の何バイト目まで処理したか」と「その時点の出力ファイルのサイズ」,
+統計情報を記録し, 再開時には出力をそのサイズまで切り詰めてから続きを処理します.
+そのため, 中断時に書きかけだった文書が重複したり欠落したりすることはありません.
+"""
+import dataclasses
+import json
+import os
+from typing import Any, Optional
+
+from hojichar import StatsContainer
+from hojichar.core.inspection import DocStatistics, FilterStatistics
+
+from preprocessing.atomic_file import atomic_write
+
+MANIFEST_FILE = "manifest.json"
+DEFAULT_CHECKPOINT_INTERVAL = 10000
+
+
+def serialize_stats(stats_obj: StatsContainer) -> dict:
+    return dataclasses.asdict(stats_obj)
+
+
+def deserialize_stats(data: dict) -> StatsContainer:
+    return StatsContainer(
+        DocStatistics(**data["total_info"]),
+        {name: FilterStatistics(**layer) for name, layer in data["layers_info"].items()},
+    )
+
+
+def subtract_stats(stats_obj: StatsContainer, since: StatsContainer) -> StatsContainer:
+    """`since` の時点から `stats_obj` に加算された分の統計情報を返します. `since` は統計情報の複製を渡してください."""
+    def subtract(value, base):
+        return dataclasses.replace(value, **{field.name: getattr(value, field.name) - getattr(base, field.name)
+                                             for field in dataclasses.fields(value)
+                                             if isinstance(getattr(value, field.name), int)})
+
+    return StatsContainer(
+        subtract(stats_obj.total_info, since.total_info),
+        {name: subtract(layer, since.layers_info[name]) for name, layer in stats_obj.layers_info.items()},
+    )
+
+
+class Manifest:
+    """入力ファイル名をキーとして処理状況を保持します."""
+
+    def __init__(self, output_base: str) -> None:
+        self.path = os.path.join(output_base, MANIFEST_FILE)
+        self.files: dict[str, dict[str, Any]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf8") as fp:
+                self.files = json.load(fp)["files"]
+
+    def get(self, name: str) -> Optional[dict[str, Any]]:
+        return self.files.get(name)
+
+    def is_done(self, name: str) -> bool:
+        state = self.files.get(name)
+        return state is not None and state["done"]
+
+    def update(self, name: str, state: dict[str, Any]) -> None:
+        self.files[name] = state
+        self.save()
+
+    def save(self) -> None:
+        with atomic_write(self.path) as writer:
+            json.dump({"files": self.files}, writer, ensure_ascii=False)
+
+
+class FileCheckpoint:
+    """
+    1つの入力ファイルのチェックポイントです.
+
+    `prepare` で出力ファイルを前回のチェックポイント時点のサイズに切り詰め,
+    処理中は `save` で入力のバイト位置と出力ファイルのサイズを記録します.
+    複数の入力ファイルの出力を追記するファイルは, このファイルの処理を始める前のサイズを `initial_sizes` に指定します.
+    """
+
+    def __init__(self, manifest: Manifest, name: str, output_paths: list[str],
+                 interval: int = DEFAULT_CHECKPOINT_INTERVAL, initial_sizes: Optional[dict[str, int]] = None) -> None:
+        self.manifest = manifest
+        self.name = name
+        self.output_paths = output_paths
+        self.interval = interval
+        self.initial_sizes: dict[str, int] = initial_sizes or {}
+
+        state = manifest.get(name) or {}
+        self.offset: int = state.get("offset", 0)
+        self.output_sizes: dict[str, int] = state.get("output_sizes", {})
+        # 前回の実行までに処理した部分の統計情報. 今回の実行中は更新しない
+        self.restored_stats: Optional[StatsContainer] = (
+            deserialize_stats(state["stats"]) if state.get("stats") else None
+        )
+        self.restored_extra: dict[str, Any] = state.get("extra", {})
+
+    def prepare(self) -> None:
+        """出力ファイルを前回のチェックポイントのサイズに切り詰めます. 存在しない場合は空のファイルを作成します."""
+        for path in self.output_paths:
+            name = os.path.basename(path)
+            size = self.output_sizes.get(name, self.initial_sizes.get(name, 0))
+            with open(path, "ab") as fp:
+                fp.truncate(size)
+
+    def save(self, offset: int, stats_obj: StatsContainer, done: bool = False,
+             extra: Optional[dict[str, Any]] = None) -> None:
+        """
+        `offset` までの入力を処理し終えたことを記録します.
+        `stats_obj` にはファイルの先頭からの統計情報を渡します.
+        出力ファイルは呼び出し前に flush されている必要があります.
+        """
+        self.offset = offset
+        self.output_sizes = {os.path.basename(path): os.path.getsize(path) for path in self.output_paths}
+        self.manifest.update(self.name, {
+            "done": done,
+            "offset": offset,
+            "output_sizes": self.output_sizes,
+            "stats": serialize_stats(stats_obj),
+            "extra": {} if extra is None else extra,
+        })
+
+    def add_restored_stats(self, stats_obj: StatsContainer) -> StatsContainer:
+        """前回の実行までの統計情報を加算して返します."""
+        return stats_obj if self.restored_stats is None else self.restored_stats + stats_obj
@@ -0,0 +1,93 @@
+"""
+JSONL ファイルを行の境界に揃えたバイト範囲(チャンク)に分割するためのユーティリティです.
+チャンクは互いに独立して読み込めるため, プロセスプールで並列に処理できます.
+gzip, zstd で圧縮されたファイルは途中から読み始めることができないため, 全体を1つのチャンクとして扱い,
+バイト位置は展開後のものを用います.
+"""
+import dataclasses
+import os
+from typing import Iterator, Optional
+
+from preprocessing.compression import detect_compression, open_reader
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+@dataclasses.dataclass
+class Chunk:
+    path: str
+    start: int
+    # None の場合はファイルの末尾まで
+    end: Optional[int]
+    index: int = 0
+    # ファイルの最後のチャンクかどうか
+    is_last: bool = True
+
+
+def split_file(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, start: int = 0) -> list[Chunk]:
+    """
+    ファイルの `start` バイト目以降を `chunk_size` バイト程度のチャンクに分割します.
+    `start` は行の先頭でなければなりません.
+    各チャンクの終端は改行の直後に揃えるため, 1行が複数のチャンクにまたがることはありません.
+    空のファイルに対しても空のチャンクを1つ返します.
+    圧縮されたファイルは分割せず, `start` 以降全体を1つのチャンクとして返します.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be greater than 0")
+    if detect_compression(path) != "none":
+        return [Chunk(path=path, start=start, end=None)]
+
+    size = os.path.getsize(path)
+    chunks = []
+    with open(path, "rb") as fp:
+        while start < size:
+            end = start + chunk_size
+            if end < size:
+                fp.seek(end - 1)
+                fp.readline()
+                end = fp.tell()
+            else:
+                end = size
+            chunks.append(Chunk(path=path, start=start, end=end, index=len(chunks), is_last=end == size))
+            start = end
+    if not chunks:
+        chunks.append(Chunk(path=path, start=start, end=start))
+    return chunks
+
+
+class ChunkReader:
+    """
+    チャンクに含まれる行を先頭から順に返すイテレータです.
+    `position` は直前に返した行の直後のバイト位置を表し, チェックポイントに利用できます.
+    """
+
+    def __init__(self, chunk: Chunk, buffer_size: int = -1) -> None:
+        self.chunk = chunk
+        self.buffer_size = buffer_size
+        self.position = chunk.start
+
+    def __iter__(self) -> Iterator[str]:
+        end = self.chunk.end
+        with open_reader(self.chunk.path, self.buffer_size) as fp:
+            if detect_compression(self.chunk.path) == "none":
+                fp.seek(self.chunk.start)
+            else:
+                # 展開後のストリームはシークできないため, 読み飛ばす
+                skipped = 0
+                while skipped < self.chunk.start:
+                    line = fp.readline()
+                    if not line:
+                        break
+                    skipped += len(line)
+            self.position = self.chunk.start
+            while end is None or self.position < end:
+                line = fp.readline()
+                if not line:
+                    break
+                self.position += len(line)
+                yield line.decode("utf-8")
+
+
+def iter_chunk_lines(chunk: Chunk, buffer_size: int = -1) -> Iterator[str]:
+    """チャンクに含まれる行を先頭から順に返します."""
+    return iter(ChunkReader(chunk, buffer_size))
@@ -0,0 +1,128 @@
+"""
+gzip, zstd で圧縮された JSONL を行単位で読み書きするためのユーティリティです.
+
+圧縮形式はファイルの拡張子(.gz, .zst)から判定します.
+書き込み時は, チェックポイントごとに gzip のメンバー(zstd のフレーム)を閉じるため,
+その位置でファイルを切り詰めたり, 複数のファイルをバイト列のまま連結したりしても正しく展開できます.
+zstd を利用するには zstandard パッケージが必要です.
+"""
+import gzip
+import io
+import os
+from typing import BinaryIO, Optional
+
+COMPRESSIONS = ["none", "gzip", "zstd"]
+EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+JSONL_EXTENSIONS = tuple(".jsonl" + extension for extension in EXTENSIONS.values())
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("zstd compression requires the zstandard package. Run `pip install zstandard`.") from e
+    return zstandard
+
+
+def detect_compression(path: str) -> str:
+    """
+    >>> detect_compression("c4-ja.tfrecord-00000-of-01024.jsonl.gz")
+    'gzip'
+    >>> detect_compression("result.filtering.jsonl")
+    'none'
+    """
+    for compression, extension in EXTENSIONS.items():
+        if extension and path.endswith(extension):
+            return compression
+    return "none"
+
+
+def is_jsonl(path: str) -> bool:
+    return path.endswith(JSONL_EXTENSIONS)
+
+
+def strip_extension(filename: str) -> str:
+    """
+    圧縮形式の拡張子と .jsonl を取り除いたファイル名を返します.
+
+    >>> strip_extension("part-00000.jsonl.zst")
+    'part-00000'
+    """
+    extension = EXTENSIONS[detect_compression(filename)]
+    if extension:
+        filename = filename[:-len(extension)]
+    return os.path.splitext(filename)[0]
+
+
+def with_extension(path: str, compression: str) -> str:
+    """
+    >>> with_extension("result.filtering.jsonl", "gzip")
+    'result.filtering.jsonl.gz'
+    """
+    return path + EXTENSIONS[compression]
+
+
+def open_reader(path: str, buffer_size: int = io.DEFAULT_BUFFER_SIZE) -> BinaryIO:
+    """拡張子に応じて展開しながら読み込むバイナリのファイルオブジェクトを返します."""
+    compression = detect_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        reader = _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                               closefd=True)
+        return io.BufferedReader(reader, buffer_size if buffer_size > 0 else io.DEFAULT_BUFFER_SIZE)
+    return open(path, "rb", buffering=buffer_size)
+
+
+def open_writer(path: str, mode: str = "wb", compression: str = "none", buffer_size: int = -1) -> BinaryIO:
+    """圧縮しながら書き込むバイナリのファイルオブジェクトを返します. mode は "wb" か "ab" です."""
+    if compression == "gzip":
+        return gzip.open(path, mode)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor().stream_writer(open(path, mode), closefd=True)
+    return open(path, mode, buffering=buffer_size)
+
+
+class LineWriter:
+    """
+    テキストを書き込むファイルオブジェクトです. `checkpoint` を呼ぶと, その時点までの内容を
+    ファイルを切り詰めても展開できる状態で書き出します.
+    """
+
+    def __init__(self, path: str, mode: str = "w", compression: str = "none", buffer_size: int = -1) -> None:
+        self.path = path
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self._open(mode)
+
+    def _open(self, mode: str) -> None:
+        if self.compression == "none":
+            self._fp = open(self.path, mode, encoding="utf8", buffering=self.buffer_size)
+        else:
+            self._fp = io.TextIOWrapper(open_writer(self.path, mode[0] + "b", self.compression), encoding="utf8")
+
+    def write(self, text: str) -> int:
+        return self._fp.write(text)
+
+    def checkpoint(self) -> None:
+        if self.compression == "none":
+            self._fp.flush()
+        else:
+            # 圧縮ファイルはメンバー(フレーム)を閉じ, 以降は新しいメンバーとして追記する
+            self._fp.close()
+            self._open("a")
+
+    def close(self) -> None:
+        self._fp.close()
+
+    def __enter__(self) -> "LineWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # type: ignore
+        self.close()
+
+
+def open_line_writer(path: str, mode: str = "w", compression: Optional[str] = None,
+                     buffer_size: int = -1) -> LineWriter:
+    """`compression` を省略した場合は拡張子から判定します."""
+    return LineWriter(path, mode, detect_compression(path) if compression is None else compression, buffer_size)
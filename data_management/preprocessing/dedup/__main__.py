@@ -0,0 +1,554 @@
+import argparse
+import collections
+import contextlib
+import copy
+import itertools
+import json
+import multiprocessing
+from hojichar import deduplication, Compose, Document, StatsContainer
+import os
+from datetime import datetime
+from multiprocessing.pool import Pool
+from typing import Iterable, Iterator, Optional
+
+from preprocessing.checkpoint import DEFAULT_CHECKPOINT_INTERVAL, FileCheckpoint, Manifest, subtract_stats
+from preprocessing.chunking import Chunk, ChunkReader
+from preprocessing.compression import COMPRESSIONS, LineWriter, is_jsonl, open_reader, strip_extension, with_extension
+from preprocessing import json_codec
+from preprocessing.dedup import minhash, partitioned
+from preprocessing.dedup.bloom import DEFAULT_ERROR_RATE, BloomFilter, BloomLSHDeduplicator
+from preprocessing.dedup.bloom import DEFAULT_MEMORY_MB as DEFAULT_BLOOM_MEMORY_MB
+from preprocessing.dedup.exact import (DEFAULT_MAX_MEMORY_MB, ExactDeduplicator, FingerprintSet, FingerprintStore,
+                                       fingerprint)
+from preprocessing.dedup.lsh_index import DEFAULT_CACHE_SIZE_MB, IndexedLSHDeduplicator, LSHIndex
+from preprocessing.filtering import custom_document_filters
+from preprocessing.profiling import ProfilingCompose, SamplingProfiler
+
+MINHASH_ENGINES = ["numpy", "hojichar"]
+PARTITIONED_PHASES = ["map", "reduce", "apply", "merge"]
+DEFAULT_BATCH_SIZE = 128
+
+_minhash: Optional[minhash.MinHashLSH] = None
+
+
+def create_cleaner(profile: bool = False, index: Optional[LSHIndex] = None, source: int = 0,
+                   minhash_engine: str = "numpy", exact_store: Optional[FingerprintStore] = None,
+                   bloom: Optional[BloomFilter] = None) -> Compose:
+    """
+    `index` か `bloom` を指定すると, ファイルごとのハッシュテーブルの代わりにそれらを用いて重複判定をします.
+    `minhash_engine` が "numpy" の場合は, hojichar と同じハッシュ値をバイナリ形式で計算します.
+    `exact_store` を指定すると, MinHash を計算する前に完全に一致する文書を破棄します.
+    """
+    if index is not None:
+        deduplicator = IndexedLSHDeduplicator(index, source)
+    elif bloom is not None:
+        deduplicator = BloomLSHDeduplicator(bloom)
+    else:
+        deduplicator = deduplication.LSHDeduplicator(
+            online_dedup=True,
+            store_blacklist=True
+        )
+    compose = ProfilingCompose if profile else Compose
+    return compose([
+        custom_document_filters.JSONLoader(ignore=True),
+        *([] if exact_store is None else [ExactDeduplicator(exact_store, source)]),
+        minhash.GenerateDedupLSH() if minhash_engine == "numpy" else deduplication.GenerateDedupLSH(),
+        deduplicator,
+        custom_document_filters.JSONDumper()
+    ])
+
+
+def __processed_stats(cleaner: Compose, replayed_stats: Optional[StatsContainer]) -> StatsContainer:
+    """読み直した文書の分を除いた `cleaner` の統計情報を返します."""
+    if replayed_stats is None:
+        return cleaner.statistics_obj
+    return subtract_stats(cleaner.statistics_obj, replayed_stats)
+
+
+def __replay(cleaner: Compose, path: str, start: int, end: int) -> None:
+    """処理済みの部分を出力せずに読み直し, 重複判定のためのハッシュ値を登録します."""
+    for line in ChunkReader(Chunk(path, start, end)):
+        cleaner.apply(Document(line))
+
+
+def __calc_band_keys(texts: list[str]) -> list[list[bytes]]:
+    global _minhash
+    if _minhash is None:
+        _minhash = minhash.MinHashLSH()
+    return _minhash.calc_band_keys(texts)
+
+
+def __read_batches(lines: Iterable[str], batch_size: int) -> Iterator[tuple[list[str], list[int]]]:
+    """行と, その行を読み終えた時点の入力のバイト位置をまとめて返します."""
+    batch: list[str] = []
+    positions: list[int] = []
+    for line in lines:
+        batch.append(line)
+        positions.append(getattr(lines, "position", 0))
+        if len(batch) == batch_size:
+            yield batch, positions
+            batch, positions = [], []
+    if batch:
+        yield batch, positions
+
+
+def __prepare_batch(batch: list[str], exact_store: Optional[FingerprintStore]
+                    ) -> tuple[list[Optional[bytes]], list[int], list[str]]:
+    """
+    各行のフィンガープリントと, MinHash を計算する行の番号とその text を返します.
+    JSON として読み込めない行と, 完全一致で破棄されることが確定している行の MinHash は計算しません.
+    """
+    # LSHIndex は別のスレッドから参照できないため, バッチ内の重複だけを除く
+    known = exact_store if isinstance(exact_store, (FingerprintSet, BloomFilter)) else ()
+    seen: set[bytes] = set()
+    fingerprints: list[Optional[bytes]] = [None] * len(batch)
+    indices, texts = [], []
+    for idx, line in enumerate(batch):
+        try:
+            text = str(json_codec.split_text(line)[0])
+        except (ValueError, KeyError):
+            continue
+        if exact_store is not None:
+            fingerprints[idx] = value = fingerprint(text)
+            if value in seen or value in known:
+                continue
+            seen.add(value)
+        indices.append(idx)
+        texts.append(text)
+    return fingerprints, indices, texts
+
+
+def __iter_prepared(lines: Iterable[str], pool: Optional[Pool], batch_size: int,
+                    exact_store: Optional[FingerprintStore]
+                    ) -> Iterator[tuple[str, Optional[list[bytes]], Optional[bytes], int]]:
+    """
+    `batch_size` 行ずつハッシュ値を計算し, (行, ハッシュ値, フィンガープリント, 行を読み終えた時点のバイト位置) を返します.
+    `pool` を指定すると, 複数のバッチを並列に計算します.
+    """
+    pending: collections.deque[tuple[list[str], list[int], list[Optional[bytes]], list[int]]] = collections.deque()
+
+    def batches() -> Iterator[list[str]]:
+        for batch, positions in __read_batches(lines, batch_size):
+            fingerprints, indices, texts = __prepare_batch(batch, exact_store)
+            pending.append((batch, positions, fingerprints, indices))
+            yield texts
+
+    results = map(__calc_band_keys, batches()) if pool is None else pool.imap(__calc_band_keys, batches())
+    for computed in results:
+        batch, positions, fingerprints, indices = pending.popleft()
+        band_keys: list[Optional[list[bytes]]] = [None] * len(batch)
+        for idx, keys in zip(indices, computed):
+            band_keys[idx] = keys
+        yield from zip(batch, band_keys, fingerprints, positions)
+
+
+def exec_hojichar_deduplication(lines: Iterable[str], output_base: str, stats: list[dict], profile: bool = False,
+                                sampling_profile: bool = False, checkpoint: Optional[FileCheckpoint] = None,
+                                compression: str = "none", index: Optional[LSHIndex] = None,
+                                source_name: Optional[str] = None, minhash_engine: str = "numpy",
+                                num_workers: int = 1, batch_size: int = DEFAULT_BATCH_SIZE, exact_dedup: bool = True,
+                                exact_memory_MB: int = DEFAULT_MAX_MEMORY_MB, bloom: Optional[BloomFilter] = None,
+                                merged_path: Optional[str] = None, write_per_file: bool = True,
+                                write_rejected: bool = True):
+    """
+    残した文書は `output_base` の `result.dedup.jsonl` と, `merged_path` を指定した場合はそのファイルの末尾に,
+    除外した文書は `rejected.dedup.jsonl` に処理した順に書き込みます.
+    `write_per_file`, `write_rejected` を指定しない場合はそれぞれ `result.dedup.jsonl`, `rejected.dedup.jsonl` を書き込みません.
+    `compression` には結果と除外した文書のファイルの圧縮形式を指定します.
+    `checkpoint` を指定すると, 前回のチェックポイントの続きから出力を追記し, 定期的に進捗を記録します.
+    その場合 `lines` にはチェックポイントの位置から読み込む `ChunkReader` を渡してください.
+    処理済みの部分は出力せずに読み直し, 重複判定のためのハッシュ値を復元します.
+
+    `index` を指定すると, `index` に登録済みの文書(他のファイルや以前の実行を含む)とも重複判定を行い,
+    この入力の文書のハッシュ値を `source_name` のソースとして登録します.
+    その場合も `lines` には `ChunkReader` を渡してください. 処理済みの部分のうち `index` に登録済みの部分は読み直しません.
+    `bloom` を指定すると, `bloom` に登録済みの文書とも重複判定を行い, この入力の文書のハッシュ値を登録します.
+
+    `minhash_engine` が "numpy" の場合は, `batch_size` 行ずつ `num_workers` のプロセスでハッシュ値を計算します.
+    `exact_dedup` を指定すると, MinHash を計算する前に完全に一致する文書を破棄します.
+    `index` か `bloom` を指定した場合はフィンガープリントもそこに登録します.
+    指定しない場合, フィンガープリントが `exact_memory_MB` を超えると `output_base` に書き出します.
+    """
+    source, indexed_offset = (0, 0) if index is None else index.get_source(source_name or output_base)
+    exact_store: Optional[FingerprintStore] = None
+    if exact_dedup:
+        if index is not None:
+            exact_store = index
+        elif bloom is not None:
+            exact_store = bloom
+        else:
+            exact_store = FingerprintSet(exact_memory_MB, spill_dir=output_base)
+    cleaner = create_cleaner(profile, index, source, minhash_engine, exact_store, bloom)
+    duplicates = {"exact": 0, "near": 0, "within_file": 0, "across_files": 0}
+    replayed_stats: Optional[StatsContainer] = None
+
+    mode = "w"
+    if checkpoint is not None:
+        checkpoint.prepare()
+        mode = "a"
+        duplicates.update(checkpoint.restored_extra.get("duplicates", {}))
+        if indexed_offset > checkpoint.offset:
+            raise ValueError(f"The LSH index has entries of {source_name} beyond the checkpoint. "
+                             "Use a new index or resume the run that created it.")
+        if checkpoint.offset > indexed_offset:
+            __replay(cleaner, lines.chunk.path, indexed_offset, checkpoint.offset)
+            # 読み直した文書は統計情報に含めない
+            replayed_stats = copy.deepcopy(cleaner.statistics_obj)
+            if profile:
+                cleaner.reset_profile()
+
+    profiler = SamplingProfiler() if sampling_profile else None
+    pool = multiprocessing.Pool(num_workers) if minhash_engine == "numpy" and num_workers > 1 else None
+    if minhash_engine == "numpy":
+        documents = __iter_prepared(lines, pool, batch_size, exact_store)
+    else:
+        documents = ((line, None, None, getattr(lines, "position", 0)) for line in lines)
+    with contextlib.ExitStack() as stack:
+        if pool is not None:
+            stack.enter_context(pool)
+        writers = []
+        writer = rejected = merged = None
+        if write_per_file:
+            writer = stack.enter_context(LineWriter(
+                with_extension(os.path.join(output_base, "result.dedup.jsonl"), compression), mode, compression))
+            writers.append(writer)
+        if write_rejected:
+            rejected = stack.enter_context(LineWriter(
+                with_extension(os.path.join(output_base, "rejected.dedup.jsonl"), compression), mode, compression))
+            writers.append(rejected)
+        if merged_path is not None:
+            # 全体の結果には前のファイルの結果が書き込まれているため, 常に追記する
+            merged = stack.enter_context(LineWriter(merged_path, "a", compression))
+            writers.append(merged)
+        if profiler is not None:
+            stack.enter_context(profiler)
+
+        for num_processed, (line, band_keys, value, position) in enumerate(documents, 1):
+            document = Document(line)
+            if band_keys is not None:
+                document.dedup_lsh = band_keys
+            document.dedup_fingerprint = value
+            result = cleaner.apply(document)
+            if result.is_rejected:
+                if rejected is not None:
+                    rejected.write(result.text + "\n")
+                # JSON として読み込めずに破棄した文書は数えない
+                if result.reject_reason.get("name") != "JSONLoader":
+                    duplicates["exact" if getattr(result, "dedup_exact", False) else "near"] += 1
+                    # Bloom フィルタで判定した場合は None になり, ファイル内かどうかは区別しない
+                    within_file = getattr(result, "dedup_within_file", True)
+                    if within_file is not None:
+                        duplicates["within_file" if within_file else "across_files"] += 1
+            else:
+                if writer is not None:
+                    writer.write(result.text + "\n")
+                if merged is not None:
+                    merged.write(result.text + "\n")
+
+            if checkpoint is not None and num_processed % checkpoint.interval == 0:
+                for output in writers:
+                    output.checkpoint()
+                checkpoint.save(position, checkpoint.add_restored_stats(__processed_stats(cleaner, replayed_stats)),
+                                extra={"duplicates": duplicates})
+                # チェックポイントより先の位置を確定しないように, 記録した後に確定する
+                if index is not None:
+                    index.commit(source, position)
+
+    if isinstance(exact_store, FingerprintSet):
+        exact_store.close()
+
+    stats_obj = __processed_stats(cleaner, replayed_stats)
+    if checkpoint is not None:
+        stats_obj = checkpoint.add_restored_stats(stats_obj)
+    stat = stats_obj.get_human_readable_values()
+    stat["duplicates"] = duplicates
+    if bloom is not None:
+        stat["bloom"] = bloom.get_human_readable_values()
+    if profile:
+        stat["profile"] = cleaner.profile.get_human_readable_values()
+    if profiler is not None:
+        profiler.dump(os.path.join(output_base, "profile.dedup.folded"))
+
+    with open(os.path.join(output_base, "stat.dedup.jsonl"), "w") as writer:
+        writer.write(json.dumps(stat, ensure_ascii=False) + "\n")
+    stats.append(stat)
+    if checkpoint is not None:
+        checkpoint.save(lines.position, stats_obj, done=True, extra={"duplicates": duplicates})
+    if index is not None:
+        index.commit(source, lines.position)
+
+
+def __save_bloom(bloom: BloomFilter, source_name: str, bloom_path: Optional[str]) -> None:
+    if source_name not in bloom.sources:
+        bloom.sources.append(source_name)
+    if bloom_path is not None:
+        bloom.save(bloom_path)
+
+
+def dedup_minhashlsh(input_dir: str, output_base: str, profile: bool = False,
+                     sampling_profile_file: Optional[str] = None, resume: bool = False,
+                     checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL, compression: str = "none",
+                     index_path: Optional[str] = None, cache_size_MB: int = DEFAULT_CACHE_SIZE_MB,
+                     minhash_engine: str = "numpy", num_workers: int = 1, exact_dedup: bool = True,
+                     exact_memory_MB: int = DEFAULT_MAX_MEMORY_MB, bloom_path: Optional[str] = None,
+                     bloom_memory_MB: Optional[float] = None, bloom_error_rate: float = DEFAULT_ERROR_RATE,
+                     write_per_file: bool = True, write_rejected: bool = True):
+    """
+    `input_dir` のファイル(.jsonl, .jsonl.gz, .jsonl.zst)ごとに重複除去を行い, `output_base` に出力します.
+    残した文書は処理した順に `results.dedup.jsonl` に書き込むため, 文書をメモリに保持しません.
+    `write_per_file`, `write_rejected` を指定しない場合は, ファイルごとの結果と除外した文書を書き込みません.
+    出力は `compression` で指定した形式で圧縮します.
+    進捗は `output_base` のマニフェストに記録され, `resume` を指定すると処理済みのファイルを飛ばし,
+    途中のファイルはチェックポイントから再開します. 全体の結果もチェックポイントの時点のサイズに切り詰めてから追記します.
+
+    `index_path` を指定すると, その位置の `LSHIndex` を用いて全てのファイルをまとめて重複除去します.
+    インデックスは実行をまたいで引き継がれるため, 新しいスナップショットを以前の実行で処理した文書と重複除去できます.
+    MinHash は `minhash_engine` で計算し, "numpy" の場合は `num_workers` のプロセスで並列に計算します.
+    `exact_dedup` を指定すると, MinHash の前に完全に一致する文書を破棄します.
+
+    `bloom_memory_MB` か `bloom_path` を指定すると, そのメモリ量の Bloom フィルタを用いて全てのファイルをまとめて
+    重複除去します. `bloom_path` にはファイルを処理し終えるごとにフィルタを保存し, 既に存在する場合は読み込んで再利用します.
+    """
+    if index_path is not None and (bloom_path is not None or bloom_memory_MB is not None):
+        raise ValueError("The LSH index and the Bloom filter cannot be used together.")
+    os.makedirs(output_base, exist_ok=True)
+    manifest = Manifest(output_base)
+    index = None if index_path is None else LSHIndex(index_path, cache_size_MB)
+    bloom = None
+    if bloom_path is not None and os.path.exists(bloom_path):
+        bloom = BloomFilter.load(bloom_path)
+    elif bloom_path is not None or bloom_memory_MB is not None:
+        bloom = BloomFilter(DEFAULT_BLOOM_MEMORY_MB if bloom_memory_MB is None else bloom_memory_MB, bloom_error_rate)
+    merged_path = with_extension(os.path.join(output_base, "results.dedup.jsonl"), compression)
+    if not resume:
+        open(merged_path, "w").close()
+    # 全体の結果のうち, 処理し終えたファイルの分のサイズ
+    merged_size = 0
+    stats, output_bases = [], []
+    # 処理中に例外が発生しても, 確定していない書き込みを破棄してインデックスのロックを解放する
+    try:
+        for input_file in sorted(os.listdir(input_dir)):
+            if not is_jsonl(input_file):
+                continue
+
+            input_file_prefix = strip_extension(os.path.basename(input_file))
+            output_base_for_input: str = os.path.join(output_base, input_file_prefix)
+            os.makedirs(output_base_for_input, exist_ok=True)
+            output_bases.append(output_base_for_input)
+            input_path = os.path.join(input_dir, input_file)
+            # 出力先はファイルと実行ごとに異なるため, インデックスのソース名として用いる
+            source_name = os.path.abspath(output_base_for_input)
+            if resume and manifest.is_done(input_file):
+                if index is not None:
+                    # 完了を記録した直後に中断した場合は, インデックスに登録されていない部分が残っている
+                    source, indexed_offset = index.get_source(source_name)
+                    offset = manifest.get(input_file)["offset"]
+                    if indexed_offset < offset:
+                        cleaner = create_cleaner(index=index, source=source, minhash_engine=minhash_engine,
+                                                 exact_store=index if exact_dedup else None)
+                        __replay(cleaner, input_path, indexed_offset, offset)
+                        index.commit(source, offset)
+                if bloom is not None and source_name not in bloom.sources:
+                    # Bloom フィルタはファイルを処理し終えるごとに保存するため, 保存する前に中断したファイルを登録し直す
+                    cleaner = create_cleaner(minhash_engine=minhash_engine, bloom=bloom,
+                                             exact_store=bloom if exact_dedup else None)
+                    __replay(cleaner, input_path, 0, manifest.get(input_file)["offset"])
+                    __save_bloom(bloom, source_name, bloom_path)
+                merged_size = manifest.get(input_file)["output_sizes"].get(os.path.basename(merged_path), merged_size)
+                continue
+
+            output_paths = [merged_path]
+            if write_per_file:
+                output_paths.append(os.path.join(output_base_for_input,
+                                                 with_extension("result.dedup.jsonl", compression)))
+            if write_rejected:
+                output_paths.append(os.path.join(output_base_for_input,
+                                                 with_extension("rejected.dedup.jsonl", compression)))
+            checkpoint = FileCheckpoint(manifest, input_file, output_paths, interval=checkpoint_interval,
+                                        initial_sizes={os.path.basename(merged_path): merged_size})
+            reader = ChunkReader(Chunk(input_path, checkpoint.offset, None))
+
+            exec_hojichar_deduplication(
+                reader, output_base=output_base_for_input, stats=stats, profile=profile,
+                sampling_profile=input_file == sampling_profile_file, checkpoint=checkpoint, compression=compression,
+                index=index, source_name=source_name, minhash_engine=minhash_engine, num_workers=num_workers,
+                exact_dedup=exact_dedup, exact_memory_MB=exact_memory_MB, bloom=bloom, merged_path=merged_path,
+                write_per_file=write_per_file, write_rejected=write_rejected)
+            merged_size = checkpoint.output_sizes[os.path.basename(merged_path)]
+            if bloom is not None:
+                __save_bloom(bloom, source_name, bloom_path)
+    finally:
+        if index is not None:
+            index.close()
+
+    __merge_stats(output_base, output_bases)
+
+
+def __merge_results(output_base: str, output_bases: list[str], compression: str) -> None:
+    """各ファイルの出力を連結して `results.dedup.jsonl` に書き出します."""
+    with LineWriter(with_extension(os.path.join(output_base, "results.dedup.jsonl"), compression), "w",
+                    compression) as writer:
+        for output_base_for_input in output_bases:
+            with open_reader(os.path.join(output_base_for_input,
+                                          with_extension("result.dedup.jsonl", compression))) as fp:
+                for line in fp:
+                    writer.write(line.decode("utf-8"))
+
+
+def __merge_stats(output_base: str, output_bases: list[str]) -> None:
+    with open(os.path.join(output_base, "stats.dedup.jsonl"), "w", encoding="utf8") as writer:
+        for output_base_for_input in output_bases:
+            with open(os.path.join(output_base_for_input, "stat.dedup.jsonl")) as fp:
+                stat = json.loads(fp.readline())
+            writer.write(json.dumps(stat, ensure_ascii=False))
+            writer.write("\n")
+
+
+def __prepare_partition_dir(partition_dir: str, input_files: list[str], num_partitions: int,
+                            exact_dedup: bool) -> None:
+    """全てのノードが同じ設定で実行していることを確認するため, 最初に実行したノードの設定を記録します."""
+    os.makedirs(partition_dir, exist_ok=True)
+    config = {"input_files": input_files, "num_partitions": num_partitions, "exact_dedup": exact_dedup}
+    path = os.path.join(partition_dir, "config.json")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as fp:
+            json.dump(config, fp, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    with open(path) as fp:
+        if json.load(fp) != config:
+            raise ValueError(f"{partition_dir} was created with different input files or options.")
+
+
+def dedup_partitioned(input_dir: str, output_base: str, partition_dir: str, phases: Iterable[str] = PARTITIONED_PHASES,
+                      num_partitions: int = partitioned.DEFAULT_NUM_PARTITIONS, node_id: int = 0, num_nodes: int = 1,
+                      num_workers: int = 1, compression: str = "none", exact_dedup: bool = True):
+    """
+    `input_dir` のファイル全体を, `partition_dir` を介した map, reduce, apply の3つのフェーズで重複除去します.
+    各フェーズの入力ファイルやパーティションは `num_nodes` 台のノードで分担し, このノードは `node_id` 番目のものを
+    `num_workers` のプロセスで処理します. 全てのノードが前のフェーズを終えてから次のフェーズを実行してください.
+    merge フェーズでは, 各ファイルの出力を連結して `output_base` の `results.dedup.jsonl` に書き出します.
+    完了したファイルやパーティションは飛ばすため, 中断した場合は同じフェーズを実行し直してください.
+    """
+    input_files = sorted(input_file for input_file in os.listdir(input_dir) if is_jsonl(input_file))
+    __prepare_partition_dir(partition_dir, input_files, num_partitions, exact_dedup)
+    input_paths = [os.path.join(input_dir, input_file) for input_file in input_files]
+    output_bases = [os.path.join(output_base, strip_extension(input_file)) for input_file in input_files]
+    assigned_files = range(node_id, len(input_files), num_nodes)
+
+    with (multiprocessing.Pool(num_workers) if num_workers > 1 else contextlib.nullcontext()) as pool:
+        if "map" in phases:
+            for file_index in assigned_files:
+                if not os.path.exists(partitioned.map_dir(partition_dir, file_index)):
+                    partitioned.map_file(input_paths[file_index], file_index, partition_dir, num_partitions,
+                                         exact_dedup, pool)
+        if "reduce" in phases:
+            args = [(partition_dir, partition, len(input_files))
+                    for partition in range(node_id, num_partitions, num_nodes)
+                    if not os.path.exists(partitioned.reduce_dir(partition_dir, partition))]
+            list(itertools.starmap(partitioned.reduce_partition, args) if pool is None
+                 else pool.starmap(partitioned.reduce_partition, args))
+        if "apply" in phases:
+            args = [(input_paths[file_index], file_index, partition_dir, num_partitions, output_bases[file_index],
+                     compression)
+                    for file_index in assigned_files
+                    if not os.path.exists(os.path.join(output_bases[file_index], "stat.dedup.jsonl"))]
+            list(itertools.starmap(partitioned.apply_file, args) if pool is None
+                 else pool.starmap(partitioned.apply_file, args))
+    if "merge" in phases:
+        __merge_results(output_base, output_bases, compression)
+        __merge_stats(output_base, output_bases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Process some documents.')
+    parser.add_argument('--input_dir', type=str,
+                        help='The input directory containing documents to process', required=True)
+    parser.add_argument('--output_dir', type=str,
+                        help='The input file containing documents to process', required=False, default="./tmp/output")
+    parser.add_argument('--profile', action='store_true',
+                        help='Record per-filter time, throughput and latency in the stats files')
+    parser.add_argument('--sampling_profile_file', type=str,
+                        help='The input file name to profile with the sampling profiler (folded stacks)',
+                        required=False, default=None)
+    parser.add_argument('--resume', type=str,
+                        help='The output base of an interrupted run to resume', required=False, default=None)
+    parser.add_argument('--checkpoint_interval', type=int,
+                        help='The number of documents between checkpoints', required=False,
+                        default=DEFAULT_CHECKPOINT_INTERVAL)
+    parser.add_argument('--compression', type=str, choices=COMPRESSIONS,
+                        help='The compression format of the result, rejected and merged files',
+                        required=False, default="none")
+    parser.add_argument('--index_path', type=str,
+                        help='The persistent LSH index file shared across input files and runs '
+                             '(deduplicate within each file if omitted)',
+                        required=False, default=None)
+    parser.add_argument('--index_cache_size', type=int,
+                        help='The page cache size of the LSH index in MB', required=False,
+                        default=DEFAULT_CACHE_SIZE_MB)
+    parser.add_argument('--minhash', type=str, choices=MINHASH_ENGINES,
+                        help='The MinHash implementation (both produce the same LSH keys)',
+                        required=False, default="numpy")
+    parser.add_argument('--num_workers', type=int,
+                        help='The number of processes computing MinHash signatures', required=False, default=1)
+    parser.add_argument('--skip_exact_dedup', action='store_true',
+                        help='Skip removing exact (whitespace-insensitive) duplicates before MinHash LSH')
+    parser.add_argument('--exact_dedup_memory', type=int,
+                        help='The memory in MB for exact-duplicate fingerprints of a file before spilling to disk',
+                        required=False, default=DEFAULT_MAX_MEMORY_MB)
+    parser.add_argument('--bloom_memory', type=float,
+                        help='Deduplicate all input files with a Bloom filter of this size in MB', required=False,
+                        default=None)
+    parser.add_argument('--bloom_error_rate', type=float,
+                        help='The target false-positive rate per LSH key of the Bloom filter', required=False,
+                        default=DEFAULT_ERROR_RATE)
+    parser.add_argument('--bloom_path', type=str,
+                        help='The file to save the Bloom filter to (loaded and reused if it exists)',
+                        required=False, default=None)
+    parser.add_argument('--skip_per_file_results', action='store_true',
+                        help='Write the kept documents only to the merged results file')
+    parser.add_argument('--skip_rejected', action='store_true',
+                        help='Do not write the rejected documents')
+    parser.add_argument('--partition_dir', type=str,
+                        help='Deduplicate all input files by map/reduce over band-partitioned files in this directory '
+                             '(the results are written to --output_dir itself)',
+                        required=False, default=None)
+    parser.add_argument('--phase', type=str, choices=PARTITIONED_PHASES + ["all"],
+                        help='The phase of the partitioned dedup to run on this node', required=False, default="all")
+    parser.add_argument('--num_partitions', type=int,
+                        help='The number of partitions of the partitioned dedup', required=False,
+                        default=partitioned.DEFAULT_NUM_PARTITIONS)
+    parser.add_argument('--node_id', type=int,
+                        help='The index of this node in the partitioned dedup', required=False, default=0)
+    parser.add_argument('--num_nodes', type=int,
+                        help='The number of nodes sharing the partitioned dedup', required=False, default=1)
+    args = parser.parse_args()
+
+    if args.partition_dir is not None:
+        # 全てのノードが同じ出力先に書き込むため, 実行日時のディレクトリは作らない
+        dedup_partitioned(input_dir=args.input_dir, output_base=args.output_dir, partition_dir=args.partition_dir,
+                          phases=PARTITIONED_PHASES if args.phase == "all" else [args.phase],
+                          num_partitions=args.num_partitions, node_id=args.node_id, num_nodes=args.num_nodes,
+                          num_workers=args.num_workers, compression=args.compression,
+                          exact_dedup=not args.skip_exact_dedup)
+        return
+
+    if args.resume:
+        output_base = args.resume
+    else:
+        start = datetime.now()
+        output_base = os.path.join(args.output_dir, start.strftime("%Y%m%d%H%M%S"))
+
+    dedup_minhashlsh(input_dir=args.input_dir, output_base=output_base, profile=args.profile,
+                     sampling_profile_file=args.sampling_profile_file, resume=args.resume is not None,
+                     checkpoint_interval=args.checkpoint_interval, compression=args.compression,
+                     index_path=args.index_path, cache_size_MB=args.index_cache_size,
+                     minhash_engine=args.minhash, num_workers=args.num_workers,
+                     exact_dedup=not args.skip_exact_dedup, exact_memory_MB=args.exact_dedup_memory,
+                     bloom_path=args.bloom_path, bloom_memory_MB=args.bloom_memory,
+                     bloom_error_rate=args.bloom_error_rate, write_per_file=not args.skip_per_file_results,
+                     write_rejected=not args.skip_rejected)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+LSH のハッシュ値を登録する Bloom フィルタです.
+
+`hojichar.deduplication.LSHDeduplicator` はハッシュ値を Python の set に保持するため, メモリ使用量がコーパスに比例します.
+Bloom フィルタは指定したメモリ量で固定され, 登録数が容量(`capacity`)以下であれば偽陽性率は `error_rate` 以下に収まります.
+偽陽性の場合, 重複していない文書を重複として破棄します. 重複の見逃し(偽陰性)はありません.
+
+完全一致の判定に用いる文書のフィンガープリントも同じフィルタに登録できます.
+フィルタは `save` でファイルに保存し, `load` で読み込んで以降の実行で再利用できます.
+"""
+import hashlib
+import json
+import math
+from typing import Any, Optional, Union
+
+import numpy as np
+from hojichar import Document, Filter
+
+from preprocessing.atomic_file import atomic_write
+from preprocessing.dedup.exact import UNKNOWN_SOURCE
+from preprocessing.dedup.minhash import key_to_bytes
+
+DEFAULT_MEMORY_MB = 1024
+DEFAULT_ERROR_RATE = 0.001
+
+
+class BloomFilter:
+    def __init__(self, memory_MB: float = DEFAULT_MEMORY_MB, error_rate: float = DEFAULT_ERROR_RATE) -> None:
+        self._init(np.zeros(max(8, int(memory_MB * 1000**2)), dtype=np.uint8), error_rate)
+
+    def _init(self, bits: np.ndarray, error_rate: float) -> None:
+        self.bits = bits
+        self.num_bits = len(bits) * 8
+        self.error_rate = error_rate
+        # 偽陽性率を error_rate にする最適なハッシュ関数の数と, そのときの容量
+        self.num_hashes = max(1, round(-math.log2(error_rate)))
+        self.capacity = int(-self.num_bits * math.log(2) ** 2 / math.log(error_rate))
+        self.count = 0
+        # 登録済みのソース(入力ファイル). 再開時に登録し直すファイルの判定に用いる
+        self.sources: list[str] = []
+
+    def _positions(self, keys: list[bytes]) -> np.ndarray:
+        """キーごとに `num_hashes` 個のビット位置を返します. 128 ビットのハッシュ値から二重ハッシュ法で求めます."""
+        digests = b"".join(hashlib.blake2b(key, digest_size=16).digest() for key in keys)
+        hashes = np.frombuffer(digests, dtype="<u8").reshape(-1, 2)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        return (hashes[:, :1] + steps * hashes[:, 1:]) % np.uint64(self.num_bits)
+
+    def add(self, keys: list[bytes]) -> np.ndarray:
+        """キーを登録し, キーごとに既に登録されていた(可能性がある)かどうかを返します."""
+        positions = self._positions(keys)
+        indices = (positions >> np.uint64(3)).astype(np.intp)
+        masks = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        present = ((self.bits[indices] & masks) != 0).all(axis=1)
+        np.bitwise_or.at(self.bits, indices.ravel(), masks.ravel())
+        self.count += int((~present).sum())
+        return present
+
+    def __contains__(self, key: bytes) -> bool:
+        positions = self._positions([key])
+        indices = (positions >> np.uint64(3)).astype(np.intp)
+        masks = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        return bool(((self.bits[indices] & masks) != 0).all())
+
+    def add_fingerprint(self, fingerprint: bytes, source: int) -> Optional[int]:
+        """`FingerprintStore` として用いる場合のメソッドです. ソースは記録しません."""
+        return UNKNOWN_SOURCE if self.add([fingerprint])[0] else None
+
+    def estimated_false_positive_rate(self) -> float:
+        """現在の登録数で, 未登録のキーを登録済みと判定する確率の推定値です."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def get_human_readable_values(self) -> dict:
+        return {
+            "memory_MB": self.bits.nbytes / 1000**2,
+            "num_hashes": self.num_hashes,
+            "capacity": self.capacity,
+            "count": self.count,
+            "target_false_positive_rate": self.error_rate,
+            "estimated_false_positive_rate": self.estimated_false_positive_rate(),
+        }
+
+    def save(self, path: str) -> None:
+        meta = {"error_rate": self.error_rate, "count": self.count, "sources": self.sources}
+        with atomic_write(path, "wb") as fp:
+            np.savez(fp, bits=self.bits, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path: str) -> "BloomFilter":
+        bloom = cls.__new__(cls)
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            bloom._init(data["bits"], meta["error_rate"])
+        bloom.count = meta["count"]
+        bloom.sources = meta["sources"]
+        return bloom
+
+
+class BloomLSHDeduplicator(Filter):
+    """
+    `hojichar.deduplication.LSHDeduplicator` の代わりに `BloomFilter` を用いて重複判定をします.
+    `online_dedup=True` の場合と同様に, 重複と判定した文書のハッシュ値も登録します.
+    Bloom フィルタはソースを記録しないため, 重複がファイル内で見つかったかどうかは区別しません.
+    """
+
+    def __init__(self, bloom: BloomFilter, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.bloom = bloom
+
+    def apply(self, doc: Document) -> Document:
+        keys: list[Union[str, bytes]] = doc.dedup_lsh
+        if self.bloom.add([key_to_bytes(key) if isinstance(key, str) else key for key in keys]).any():
+            doc.is_rejected = True
+            doc.dedup_within_file = None
+        return doc
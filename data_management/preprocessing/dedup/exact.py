@@ -0,0 +1,135 @@
+"""
+MinHash LSH の前に, 完全に一致する文書を除くための重複除去です.
+
+空白(改行, 全角スペースを含む)の違いを無視するため, 空白の並びを1つのスペースにまとめた text の
+128 ビットのフィンガープリント(BLAKE2b)で判定します.
+フィンガープリントは実行をまたいで `LSHIndex` に保存することがあるため, 追加のパッケージに依存しない
+標準ライブラリのハッシュ関数を用います.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Any, Optional, Protocol
+
+import numpy as np
+from hojichar import Document, Filter
+
+FINGERPRINT_DTYPE = "S16"
+DEFAULT_MAX_MEMORY_MB = 1024
+# 整列した配列に移すまで set に保持するフィンガープリントの数
+DEFAULT_BUFFER_SIZE = 65536
+# ソースを記録しないストアが, 登録済みのフィンガープリントに対して返す値
+UNKNOWN_SOURCE = -1
+
+
+def normalize(text: str) -> str:
+    """
+    >>> normalize(" 吾輩は猫である。\\n名前は　まだ無い。 ")
+    '吾輩は猫である。 名前は まだ無い。'
+    """
+    return " ".join(text.split())
+
+
+def fingerprint(text: str) -> bytes:
+    return hashlib.blake2b(normalize(text).encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class FingerprintStore(Protocol):
+    def add_fingerprint(self, fingerprint: bytes, source: int) -> Optional[int]:
+        """
+        フィンガープリントを登録し, 既に登録されていた場合は最初に登録したソースを返します.
+        ソースを記録しないストアは, 代わりに `UNKNOWN_SOURCE` を返します.
+        """
+        ...
+
+
+class FingerprintSet:
+    """
+    フィンガープリントの集合です. 1つの入力ファイル(ソース)の重複除去に用います.
+
+    追加したフィンガープリントは `buffer_size` 個ごとに整列した配列にまとめ, 同程度の大きさの配列どうしを併合します.
+    そのため, 1件あたり16バイト程度のメモリで保持でき, 判定は配列の数(対数オーダー)回の二分探索で行えます.
+    `spill_dir` を指定すると, 配列の合計が `max_memory_MB` を超えたときにファイルに書き出し, 以降は mmap して判定します.
+    """
+
+    def __init__(self, max_memory_MB: int = DEFAULT_MAX_MEMORY_MB, spill_dir: Optional[str] = None,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE) -> None:
+        self.max_memory_MB = max_memory_MB
+        self.spill_dir = spill_dir
+        self.buffer_size = buffer_size
+        self._buffer: set[bytes] = set()
+        self._levels: list[np.ndarray] = []
+        self._runs: list[np.memmap] = []
+        self._run_dir: Optional[str] = None
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        if fingerprint in self._buffer:
+            return True
+        # 末尾の NUL は numpy のバイト列から取り除かれるため, 比較する側も取り除く
+        stripped = fingerprint.rstrip(b"\0")
+        for array in self._levels + self._runs:
+            idx = np.searchsorted(array, fingerprint)
+            if idx < len(array) and array[idx] == stripped:
+                return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._buffer) + sum(len(array) for array in self._levels + self._runs)
+
+    def add_fingerprint(self, fingerprint: bytes, source: int) -> Optional[int]:
+        if fingerprint in self:
+            return source
+        self._buffer.add(fingerprint)
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+        return None
+
+    def _flush(self) -> None:
+        # 別のスレッドから判定しても取りこぼさないように, 新しい配列を登録してから set を空にする
+        levels = self._levels + [np.sort(np.array(list(self._buffer), dtype=FINGERPRINT_DTYPE))]
+        while len(levels) >= 2 and len(levels[-2]) <= 2 * len(levels[-1]):
+            levels[-2:] = [np.sort(np.concatenate(levels[-2:]))]
+        self._levels = levels
+        self._buffer = set()
+
+        if self.spill_dir is not None and sum(array.nbytes for array in levels) > self.max_memory_MB * 1000**2:
+            self._spill()
+
+    def _spill(self) -> None:
+        if self._run_dir is None:
+            self._run_dir = tempfile.mkdtemp(prefix="fingerprints-", dir=self.spill_dir)
+        path = os.path.join(self._run_dir, f"run-{len(self._runs):05d}.bin")
+        np.sort(np.concatenate(self._levels)).tofile(path)
+        self._runs = self._runs + [np.memmap(path, dtype=FINGERPRINT_DTYPE, mode="r")]
+        self._levels = []
+
+    def close(self) -> None:
+        """書き出したファイルを削除します."""
+        self._runs = []
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+
+
+class ExactDeduplicator(Filter):
+    """
+    空白を除いて完全に一致する文書を破棄します.
+    `Document.dedup_fingerprint` に事前に計算したフィンガープリントがあればそれを用います.
+    破棄した文書の `dedup_exact` 属性を True に, `dedup_within_file` 属性には同じソースの文書と重複したかどうか
+    (ストアがソースを記録しない場合は None)を記録します.
+    """
+
+    def __init__(self, store: FingerprintStore, source: int = 0, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.store = store
+        self.source = source
+
+    def apply(self, doc: Document) -> Document:
+        value = getattr(doc, "dedup_fingerprint", None) or fingerprint(doc.text)
+        found = self.store.add_fingerprint(value, self.source)
+        if found is not None:
+            doc.is_rejected = True
+            doc.dedup_exact = True
+            doc.dedup_within_file = None if found == UNKNOWN_SOURCE else found == self.source
+        return doc
@@ -0,0 +1,105 @@
+"""
+ファイルや実行をまたいで重複除去を行うための, LSH のハッシュ値の永続的なインデックスです.
+
+ハッシュ値は SQLite のデータベースファイルに保存するため, メモリ使用量はコーパスの大きさによらず
+ページキャッシュ(`cache_size_MB`)程度に収まります.
+ハッシュ値ごとに最初にそのハッシュ値を登録した入力ファイル(ソース)を記録し,
+重複がファイル内で見つかったのか, 他のファイル(以前の実行を含む)との間で見つかったのかを区別します.
+完全一致の判定に用いる文書のフィンガープリントも同じように保存します.
+
+インデックスへの書き込みは `commit` を呼ぶまで確定しません.
+ソースごとに確定済みの入力のバイト位置を記録するため, 中断した場合もその位置から再開できます.
+"""
+import sqlite3
+from typing import Any, Optional, Union
+
+from hojichar import Document, Filter
+
+from preprocessing.dedup.minhash import key_to_bytes
+
+DEFAULT_CACHE_SIZE_MB = 256
+
+
+class LSHIndex:
+    def __init__(self, path: str, cache_size_MB: int = DEFAULT_CACHE_SIZE_MB) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute(f"PRAGMA cache_size = {-cache_size_MB * 1024}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS lsh (key BLOB PRIMARY KEY, source INTEGER NOT NULL) WITHOUT ROWID")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints (key BLOB PRIMARY KEY, source INTEGER NOT NULL) WITHOUT ROWID")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sources "
+            "(id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, offset INTEGER NOT NULL DEFAULT 0)")
+        self.connection.execute("BEGIN")
+
+    def get_source(self, name: str) -> tuple[int, int]:
+        """ソースの ID と, 確定済みの入力のバイト位置を返します. 存在しない場合は登録します."""
+        self.connection.execute("INSERT OR IGNORE INTO sources (name) VALUES (?)", (name,))
+        source, offset = self.connection.execute("SELECT id, offset FROM sources WHERE name = ?", (name,)).fetchone()
+        return source, offset
+
+    def add(self, keys: list[Union[str, bytes]], source: int) -> set[int]:
+        """
+        ハッシュ値を登録し, 既に登録されていたハッシュ値のソースの集合を返します.
+        既に登録されていたハッシュ値のソースは更新しません.
+        hojichar の文字列形式のハッシュ値はバイナリ形式に変換して登録するため, どちらの形式でも同じように判定できます.
+        """
+        keys = [key_to_bytes(key) if isinstance(key, str) else key for key in keys]
+        placeholders = ",".join("?" * len(keys))
+        sources = {row[0] for row in self.connection.execute(
+            f"SELECT source FROM lsh WHERE key IN ({placeholders})", keys)}
+        self.connection.executemany("INSERT OR IGNORE INTO lsh (key, source) VALUES (?, ?)",
+                                    [(key, source) for key in keys])
+        return sources
+
+    def add_fingerprint(self, fingerprint: bytes, source: int) -> Optional[int]:
+        """フィンガープリントを登録し, 既に登録されていた場合は最初に登録したソースを返します."""
+        row = self.connection.execute("SELECT source FROM fingerprints WHERE key = ?", (fingerprint,)).fetchone()
+        if row is not None:
+            return row[0]
+        self.connection.execute("INSERT INTO fingerprints (key, source) VALUES (?, ?)", (fingerprint, source))
+        return None
+
+    def commit(self, source: int, offset: int) -> None:
+        """ソースの入力を `offset` まで登録し終えたことを記録し, それまでの書き込みを確定します."""
+        self.connection.execute("UPDATE sources SET offset = ? WHERE id = ?", (offset, source))
+        self.connection.execute("COMMIT")
+        self.connection.execute("BEGIN")
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM lsh").fetchone()[0]
+
+    def close(self) -> None:
+        """確定していない書き込みは破棄します."""
+        self.connection.execute("ROLLBACK")
+        self.connection.close()
+
+    def __enter__(self) -> "LSHIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # type: ignore
+        self.close()
+
+
+class IndexedLSHDeduplicator(Filter):
+    """
+    `hojichar.deduplication.LSHDeduplicator` の代わりに `LSHIndex` を用いて重複判定をします.
+    `online_dedup=True` の場合と同様に, 重複と判定した文書のハッシュ値も登録します.
+    重複と判定した文書の `dedup_within_file` 属性には, 同じソースの文書と重複したかどうかを記録します.
+    """
+
+    def __init__(self, index: LSHIndex, source: int, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.index = index
+        self.source = source
+
+    def apply(self, doc: Document) -> Document:
+        sources = self.index.add(doc.dedup_lsh, self.source)
+        if sources:
+            doc.is_rejected = True
+            doc.dedup_within_file = self.source in sources
+        return doc
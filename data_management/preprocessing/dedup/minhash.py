@@ -0,0 +1,213 @@
+"""
+NumPy による MinHash の計算です.
+
+`hojichar.deduplication.GenerateDedupLSH` と同じ MinHash (文字 n-gram の MurmurHash3 (x86, 32bit, signed) の最小値)
+を, 複数の文書の n-gram と全てのシードについてまとめて計算します.
+n-gram ごとのブロックの撹拌はシードによらないため一度だけ計算し, シードに依存する部分だけを
+(n-gram 数, シード数) の配列で計算します.
+
+LSH のハッシュ値は hojichar と同じ文字列のほか, 同じ文字列のときに限り一致するバイナリ形式(`band_keys`)で出力できます.
+"""
+from typing import Any
+
+import numpy as np
+from hojichar import Document, deduplication
+
+C1 = np.uint32(0xcc9e2d51)
+C2 = np.uint32(0x1b873593)
+# 一度にハッシュ値を計算する n-gram の数. (n-gram 数, シード数) の配列が CPU のキャッシュに収まる程度にする
+BLOCK_ROWS = 2048
+
+
+def _rotl(x: np.ndarray, r: int) -> np.ndarray:
+    """`x` を書き換えて左に循環シフトします."""
+    carry = x >> np.uint32(32 - r)
+    x <<= np.uint32(r)
+    x |= carry
+    return x
+
+
+def _mix_block(k: np.ndarray) -> np.ndarray:
+    k = k * C1
+    return _rotl(k, 15) * C2
+
+
+def _fmix(h: np.ndarray) -> np.ndarray:
+    h ^= h >> np.uint32(16)
+    h *= np.uint32(0x85ebca6b)
+    h ^= h >> np.uint32(13)
+    h *= np.uint32(0xc2b2ae35)
+    h ^= h >> np.uint32(16)
+    return h
+
+
+def murmurhash3_32(data: np.ndarray, seeds: np.ndarray) -> np.ndarray:
+    """
+    同じ長さのバイト列 (`data` の各行) の MurmurHash3 (x86, 32bit) を全てのシードについて計算し,
+    (行数, シード数) の uint32 の配列を返します. `mmh3.hash(row, seed, signed=False)` と一致します.
+    """
+    num_rows, length = data.shape
+    num_blocks = length // 4
+    blocks = np.ascontiguousarray(data[:, :num_blocks * 4]).view("<u4").astype(np.uint32)
+    mixed = _mix_block(blocks)
+
+    h = np.broadcast_to(seeds.astype(np.uint32), (num_rows, len(seeds))).copy()
+    for idx in range(num_blocks):
+        h ^= mixed[:, idx, None]
+        _rotl(h, 13)
+        h *= np.uint32(5)
+        h += np.uint32(0xe6546b64)
+
+    if length % 4:
+        tail = np.zeros(num_rows, dtype=np.uint32)
+        for idx in range(length % 4):
+            tail |= data[:, num_blocks * 4 + idx].astype(np.uint32) << np.uint32(8 * idx)
+        h ^= _mix_block(tail)[:, None]
+
+    h ^= np.uint32(length)
+    return _fmix(h)
+
+
+def _unique_rows(rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    重複を除いた行の位置と, 各行が何番目の重複のない行に当たるかを返します.
+    行を 8 バイトずつの整数の組とみなして並べ替えるため, `np.unique(rows, axis=0)` よりも高速です.
+    """
+    num_rows, length = rows.shape
+    padded = np.zeros((num_rows, max(8, -(-length // 8) * 8)), dtype=np.uint8)
+    padded[:, :length] = rows
+    words = padded.view("<u8")
+    order = np.lexsort(words.T[::-1])
+    ordered = words[order]
+    is_first = np.r_[True, (ordered[1:] != ordered[:-1]).any(axis=1)]
+    inverse = np.empty(num_rows, dtype=np.int64)
+    inverse[order] = np.cumsum(is_first) - 1
+    return order[is_first], inverse
+
+
+class MinHashLSH:
+    """
+    `hojichar.deduplication.GenerateDedupLSH` と同じパラメータで MinHash と LSH のハッシュ値を計算します.
+    """
+
+    def __init__(self, n_minhash: int = 200, n_gram: int = 5, n_buckets: int = 20, bucket_size: int = 10) -> None:
+        assert n_minhash == n_buckets * bucket_size
+        self.n_minhash = n_minhash
+        self.n_gram = n_gram
+        self.n_buckets = n_buckets
+        self.bucket_size = bucket_size
+        self.seeds = np.arange(n_minhash, dtype=np.uint32)
+
+    def _shingles(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """全ての文書を連結した UTF-8 のバイト列と, n-gram ごとの開始位置, 終了位置, 文書番号を返します."""
+        joined = "".join(texts)
+        code_points = np.frombuffer(joined.encode("utf-32-le"), dtype="<u4")
+        char_bytes = 1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000)
+        byte_offsets = np.zeros(len(code_points) + 1, dtype=np.int64)
+        np.cumsum(char_bytes, out=byte_offsets[1:])
+
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        doc_starts = np.zeros(len(texts), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=doc_starts[1:])
+        # n 文字に満たない文書は文書全体を1つの n-gram とする
+        num_tokens = np.maximum(lengths - self.n_gram + 1, 1)
+        doc_ids = np.repeat(np.arange(len(texts)), num_tokens)
+        token_offsets = np.zeros(len(texts), dtype=np.int64)
+        np.cumsum(num_tokens[:-1], out=token_offsets[1:])
+        char_starts = doc_starts[doc_ids] + np.arange(len(doc_ids)) - token_offsets[doc_ids]
+        char_ends = np.minimum(char_starts + self.n_gram, (doc_starts + lengths)[doc_ids])
+
+        data = np.frombuffer(joined.encode("utf-8"), dtype=np.uint8)
+        return data, byte_offsets[char_starts], byte_offsets[char_ends], doc_ids
+
+    def signatures(self, texts: list[str]) -> np.ndarray:
+        """文書ごとの MinHash を (文書数, n_minhash) の int32 の配列で返します."""
+        result = np.full((len(texts), self.n_minhash), np.iinfo(np.int32).max, dtype=np.int32)
+        if not texts:
+            return result
+        data, starts, ends, doc_ids = self._shingles(texts)
+        lengths = ends - starts
+        for length in np.unique(lengths):
+            selected = np.flatnonzero(lengths == length)
+            rows = data[starts[selected, None] + np.arange(length)]
+            # 同じ n-gram のハッシュ値は一度だけ計算する
+            unique_indices, inverse = _unique_rows(rows)
+            unique_rows = rows[unique_indices]
+            hashes = np.empty((len(unique_rows), self.n_minhash), dtype=np.uint32)
+            for start in range(0, len(unique_rows), BLOCK_ROWS):
+                hashes[start:start + BLOCK_ROWS] = murmurhash3_32(unique_rows[start:start + BLOCK_ROWS], self.seeds)
+            # selected は文書番号の順に並んでいるため, 文書ごとの区間で最小値を取る
+            group_docs = doc_ids[selected]
+            boundaries = np.flatnonzero(np.r_[True, group_docs[1:] != group_docs[:-1]])
+            docs = group_docs[boundaries]
+            minimums = np.minimum.reduceat(hashes.view(np.int32)[inverse], boundaries, axis=0)
+            result[docs] = np.minimum(result[docs], minimums)
+        return result
+
+    def band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        LSH のハッシュ値を (文書数, n_buckets, bucket_size + 2) の uint16 の配列で返します.
+        各行は [バケット番号, 各 MinHash の下位16ビット..., 符号のフラグ] で,
+        hojichar の文字列形式のハッシュ値が一致するときに限り一致します.
+        """
+        values = signatures.astype(np.int64)
+        absolute = np.abs(values)
+        # hojichar は format(v, "04x")[-4:] を用いるため, -0xfff 以上の負の値は "-" で始まる別の文字列になる
+        flags = ((values < 0) & (absolute < 0x1000)).reshape(-1, self.n_buckets, self.bucket_size)
+        keys = np.empty((len(signatures), self.n_buckets, self.bucket_size + 2), dtype=np.uint16)
+        keys[:, :, 0] = np.arange(self.n_buckets, dtype=np.uint16)
+        keys[:, :, 1:-1] = (absolute & 0xffff).reshape(-1, self.n_buckets, self.bucket_size)
+        keys[:, :, -1] = (flags << np.arange(self.bucket_size)).sum(axis=2)
+        return keys
+
+    def format_keys(self, signatures: np.ndarray) -> list[list[str]]:
+        """`hojichar.deduplication.GenerateDedupLSH.calc_lsh` と同じ文字列形式のハッシュ値を返します."""
+        result = []
+        for signature in signatures.tolist():
+            chunks = [format(value, "04x")[-4:] for value in signature]
+            result.append([str(bucket) + "+" + "".join(chunks[bucket * self.bucket_size:(bucket + 1) * self.bucket_size])
+                           for bucket in range(self.n_buckets)])
+        return result
+
+    def calc_band_keys(self, texts: list[str]) -> list[list[bytes]]:
+        """文書ごとに, `band_keys` の各行をバイト列にしたハッシュ値のリストを返します."""
+        keys = self.band_keys(self.signatures(texts))
+        return [[key.tobytes() for key in doc_keys] for doc_keys in keys]
+
+
+def key_to_bytes(key: str) -> bytes:
+    """
+    hojichar の文字列形式のハッシュ値を `MinHashLSH.band_keys` と同じバイナリ形式に変換します.
+
+    >>> minhash = MinHashLSH()
+    >>> texts = ["吾輩は猫である。名前はまだ無い。"]
+    >>> key_to_bytes(minhash.format_keys(minhash.signatures(texts))[0][3]) == minhash.calc_band_keys(texts)[0][3]
+    True
+    """
+    bucket, digits = key.split("+")
+    values, flags = [int(bucket)], 0
+    for idx in range(0, len(digits), 4):
+        chunk = digits[idx:idx + 4]
+        if chunk[0] == "-":
+            flags |= 1 << (idx // 4)
+            chunk = chunk[1:]
+        values.append(int(chunk, 16))
+    values.append(flags)
+    return np.array(values, dtype=np.uint16).tobytes()
+
+
+class GenerateDedupLSH(deduplication.GenerateDedupLSH):
+    """
+    `hojichar.deduplication.GenerateDedupLSH` を NumPy で計算するフィルタです.
+    `Document.dedup_lsh` には `MinHashLSH.band_keys` のバイナリ形式のハッシュ値を格納します.
+    `MinHashLSH.calc_band_keys` などで事前に計算したハッシュ値が格納されている文書はそのまま通します.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._minhash = MinHashLSH(self.N_MINHASH, self.N_GRAM, self.N_BUCKETS, self.BUCKET_SIZE)
+
+    def apply(self, doc: Document) -> Document:
+        if not doc.dedup_lsh:
+            doc.dedup_lsh = self._minhash.calc_band_keys([doc.text])[0]
+        return doc
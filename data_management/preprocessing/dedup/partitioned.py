@@ -0,0 +1,285 @@
+"""
+LSH のバケット(バンド)のハッシュ値で分割した, 複数のプロセスやノードで実行できる重複除去です.
+
+次の3つのフェーズをファイルを介して実行するため, 共有ファイルシステムを用いれば複数のノードで分担できます.
+
+1. map: 入力ファイルごとに, 文書の (バケット番号, バンドのハッシュ値, 文書 ID) のレコードを
+   ハッシュ値で `num_partitions` 個のパーティションに振り分けて書き出します.
+2. reduce: パーティションごとに同じ (バケット番号, ハッシュ値) のレコードをまとめ,
+   最も前の文書以外を破棄する文書として書き出します.
+3. apply: 入力ファイルごとに破棄する文書を読み込み, 入力を先頭から読み直して残す文書だけを出力します.
+
+ある文書は, それより前の文書とハッシュ値が1つでも一致すると破棄されるため, 結果は全ての入力ファイルを
+1つの `LSHDeduplicator(online_dedup=True)` で順に処理した場合と同じになります.
+完全一致の判定に用いるフィンガープリントは, バケット番号が `EXACT_BAND` のレコードとして同じように扱います.
+ただし, 空白だけが異なる文書のハッシュ値も登録するため, 完全一致で破棄された文書と近い文書が
+逐次処理の場合より多く破棄されることがあります.
+
+各フェーズの出力は一時ファイルに書いてから置き換えるため, 中断した場合は同じフェーズを実行し直すと
+完了していない入力ファイルやパーティションだけを処理します.
+"""
+import json
+import os
+import shutil
+from multiprocessing.pool import Pool
+from typing import Any, Iterator, Optional
+
+import numpy as np
+from hojichar import Compose, Document, Filter
+
+from preprocessing.compression import LineWriter, with_extension
+from preprocessing.chunking import Chunk, ChunkReader
+from preprocessing import json_codec
+from preprocessing.dedup.exact import fingerprint
+from preprocessing.dedup.minhash import MinHashLSH
+from preprocessing.filtering import custom_document_filters
+
+DEFAULT_NUM_PARTITIONS = 64
+DEFAULT_MAP_BATCH_SIZE = 1024
+RECORD_DTYPE = np.dtype([("band", "<u2"), ("hash", "<u8"), ("doc", "<u8")])
+# 文書 ID は (入力ファイルの番号 << LINE_BITS) | 行番号
+LINE_BITS = 40
+MAX_FILES = 1 << (64 - LINE_BITS)
+# フィンガープリントのレコードのバケット番号
+EXACT_BAND = 0xffff
+# 破棄する文書のフラグ
+EXACT = 1
+WITHIN_FILE = 2
+
+_minhash: Optional[MinHashLSH] = None
+
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    x = x + np.uint64(0x9e3779b97f4a7c15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def hash_rows(rows: np.ndarray) -> np.ndarray:
+    """(行数, 単語数) の uint64 の配列の各行を 64 ビットのハッシュ値にします."""
+    with np.errstate(over="ignore"):
+        result = np.zeros(len(rows), dtype=np.uint64)
+        for column in range(rows.shape[1]):
+            result = _splitmix64(result ^ rows[:, column])
+    return result
+
+
+def _map_batch(args: tuple[list[str], int, bool]) -> np.ndarray:
+    """行ごとの文書 ID が `first_doc` から始まるバッチのレコードを返します."""
+    global _minhash
+    if _minhash is None:
+        _minhash = MinHashLSH()
+    lines, first_doc, exact_dedup = args
+    docs, texts, fingerprints = [], [], []
+    for idx, line in enumerate(lines):
+        try:
+            text = str(json_codec.split_text(line)[0])
+        except (ValueError, KeyError):
+            continue
+        docs.append(first_doc + idx)
+        texts.append(text)
+        if exact_dedup:
+            fingerprints.append(fingerprint(text))
+    if not docs:
+        return np.empty(0, dtype=RECORD_DTYPE)
+
+    # バンドのハッシュ値 (文書数, n_buckets, bucket_size + 2) の uint16 を, バンドごとに uint64 の単語にまとめる
+    keys = _minhash.band_keys(_minhash.signatures(texts))
+    width = -keys.shape[2] % 4
+    words = np.pad(keys, ((0, 0), (0, 0), (0, width))).reshape(-1, (keys.shape[2] + width) // 4 * 4)
+    records = np.empty(keys.shape[0] * keys.shape[1], dtype=RECORD_DTYPE)
+    records["band"] = keys[:, :, 0].ravel()
+    records["hash"] = hash_rows(np.ascontiguousarray(words).view("<u8"))
+    records["doc"] = np.repeat(np.array(docs, dtype=np.uint64), keys.shape[1])
+    if exact_dedup:
+        exact = np.empty(len(docs), dtype=RECORD_DTYPE)
+        exact["band"] = EXACT_BAND
+        exact["hash"] = np.frombuffer(b"".join(fingerprints), dtype="<u8").reshape(-1, 2)[:, 0]
+        exact["doc"] = docs
+        records = np.concatenate([records, exact])
+    return records
+
+
+def __read_batches(path: str, file_index: int, batch_size: int, exact_dedup: bool
+                   ) -> Iterator[tuple[list[str], int, bool]]:
+    batch: list[str] = []
+    first_doc = file_index << LINE_BITS
+    for line in ChunkReader(Chunk(path, 0, None)):
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield batch, first_doc, exact_dedup
+            first_doc += len(batch)
+            batch = []
+    if batch:
+        yield batch, first_doc, exact_dedup
+
+
+def _replace_dir(tmp_dir: str, path: str) -> None:
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_dir, path)
+
+
+def map_dir(partition_dir: str, file_index: int) -> str:
+    return os.path.join(partition_dir, "map", f"{file_index:05d}")
+
+
+def reduce_dir(partition_dir: str, partition: int) -> str:
+    return os.path.join(partition_dir, "reduce", f"{partition:05d}")
+
+
+def map_file(path: str, file_index: int, partition_dir: str, num_partitions: int = DEFAULT_NUM_PARTITIONS,
+             exact_dedup: bool = True, pool: Optional[Pool] = None,
+             batch_size: int = DEFAULT_MAP_BATCH_SIZE) -> int:
+    """
+    入力ファイルのレコードをパーティションごとのファイルに書き出し, 書き出したレコード数を返します.
+    `pool` を指定すると, 複数のバッチの MinHash を並列に計算します.
+    """
+    if file_index >= MAX_FILES:
+        raise ValueError(f"The number of input files must be less than {MAX_FILES}.")
+    output_dir = map_dir(partition_dir, file_index)
+    tmp_dir = f"{output_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    files = [open(os.path.join(tmp_dir, f"part-{partition:05d}.bin"), "wb") for partition in range(num_partitions)]
+    num_records = 0
+    try:
+        batches = __read_batches(path, file_index, batch_size, exact_dedup)
+        for records in (map(_map_batch, batches) if pool is None else pool.imap(_map_batch, batches)):
+            partitions = records["hash"] % np.uint64(num_partitions)
+            order = np.argsort(partitions, kind="stable")
+            bounds = np.searchsorted(partitions[order], np.arange(num_partitions + 1))
+            for partition in np.flatnonzero(np.diff(bounds)):
+                records[order[bounds[partition]:bounds[partition + 1]]].tofile(files[partition])
+            num_records += len(records)
+    finally:
+        for fp in files:
+            fp.close()
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as fp:
+        json.dump({"path": os.path.abspath(path), "records": num_records}, fp)
+    _replace_dir(tmp_dir, output_dir)
+    return num_records
+
+
+def reduce_partition(partition_dir: str, partition: int, num_files: int) -> int:
+    """
+    パーティションの全てのレコードから破棄する文書を求めて書き出し, その数を返します.
+    破棄する文書は文書 ID で整列した `drop.doc` と, 同じ順序のフラグ(`EXACT`, `WITHIN_FILE`)の `drop.flag` に保存します.
+    """
+    arrays = []
+    for file_index in range(num_files):
+        path = os.path.join(map_dir(partition_dir, file_index), f"part-{partition:05d}.bin")
+        if not os.path.exists(os.path.dirname(path)):
+            raise ValueError(f"The map phase has not finished for input file #{file_index}.")
+        arrays.append(np.fromfile(path, dtype=RECORD_DTYPE))
+    records = np.concatenate(arrays) if arrays else np.empty(0, dtype=RECORD_DTYPE)
+    records = records[np.lexsort((records["doc"], records["hash"], records["band"]))]
+
+    # 同じ (バケット番号, ハッシュ値) のうち最初のレコード以外の文書を破棄する
+    starts = np.ones(len(records), dtype=bool)
+    starts[1:] = (records["band"][1:] != records["band"][:-1]) | (records["hash"][1:] != records["hash"][:-1])
+    first = records["doc"][np.maximum.accumulate(np.where(starts, np.arange(len(records)), 0))]
+    dropped = ~starts & (records["doc"] != first)
+    docs = records["doc"][dropped]
+    flags = np.where(records["band"][dropped] == EXACT_BAND, EXACT, 0).astype(np.uint8)
+    flags |= np.where(first[dropped] >> np.uint64(LINE_BITS) == docs >> np.uint64(LINE_BITS), WITHIN_FILE, 0
+                      ).astype(np.uint8)
+    order = np.argsort(docs, kind="stable")
+
+    output_dir = reduce_dir(partition_dir, partition)
+    tmp_dir = f"{output_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    docs[order].tofile(os.path.join(tmp_dir, "drop.doc"))
+    flags[order].tofile(os.path.join(tmp_dir, "drop.flag"))
+    _replace_dir(tmp_dir, output_dir)
+    return len(docs)
+
+
+def load_drops(partition_dir: str, num_partitions: int, file_index: int) -> dict[int, int]:
+    """入力ファイルの破棄する文書の, 行番号からフラグへの辞書を返します."""
+    low, high = file_index << LINE_BITS, (file_index + 1) << LINE_BITS
+    docs, flags = [], []
+    for partition in range(num_partitions):
+        output_dir = reduce_dir(partition_dir, partition)
+        if not os.path.exists(output_dir):
+            raise ValueError(f"The reduce phase has not finished for partition #{partition}.")
+        if os.path.getsize(os.path.join(output_dir, "drop.doc")) == 0:
+            continue
+        # 文書 ID で整列しているため, この入力ファイルの範囲だけを読み込む
+        partition_docs = np.memmap(os.path.join(output_dir, "drop.doc"), dtype="<u8", mode="r")
+        partition_flags = np.memmap(os.path.join(output_dir, "drop.flag"), dtype=np.uint8, mode="r")
+        start, end = np.searchsorted(partition_docs, [low, high])
+        if end == start:
+            continue
+        docs.append(np.array(partition_docs[start:end]))
+        flags.append(np.array(partition_flags[start:end]))
+    if not docs:
+        return {}
+    all_docs, all_flags = np.concatenate(docs), np.concatenate(flags)
+    order = np.argsort(all_docs, kind="stable")
+    all_docs, all_flags = all_docs[order], all_flags[order]
+    boundaries = np.flatnonzero(np.r_[True, all_docs[1:] != all_docs[:-1]])
+    # 逐次処理と同様に, 完全一致で破棄した文書はその判定で, それ以外はいずれかのバンドの判定でファイル内かどうかを決める
+    exact = np.maximum.reduceat(all_flags & EXACT, boundaries)
+    within_exact = np.maximum.reduceat((all_flags == EXACT | WITHIN_FILE).astype(np.uint8), boundaries)
+    within_near = np.maximum.reduceat((all_flags == WITHIN_FILE).astype(np.uint8), boundaries)
+    merged = exact | np.where(exact != 0, within_exact, within_near) * WITHIN_FILE
+    lines = all_docs[boundaries] - np.uint64(low)
+    return dict(zip(lines.tolist(), merged.tolist()))
+
+
+class DropListDeduplicator(Filter):
+    """
+    reduce フェーズで求めた破棄する文書を破棄します. 文書の `dedup_line` 属性には入力ファイルの行番号を格納してください.
+    破棄した文書の `dedup_exact`, `dedup_within_file` 属性は `ExactDeduplicator` などと同様に記録します.
+    """
+
+    def __init__(self, drops: dict[int, int], *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.drops = drops
+
+    def apply(self, doc: Document) -> Document:
+        flags = self.drops.get(doc.dedup_line)
+        if flags is not None:
+            doc.is_rejected = True
+            doc.dedup_exact = bool(flags & EXACT)
+            doc.dedup_within_file = bool(flags & WITHIN_FILE)
+        return doc
+
+
+def apply_file(path: str, file_index: int, partition_dir: str, num_partitions: int, output_base: str,
+               compression: str = "none") -> dict:
+    """
+    入力ファイルの破棄する文書を除いて `output_base` に出力し, 統計情報を返します.
+    統計情報は `stat.dedup.jsonl` に最後に書き出すため, このファイルがあれば完了しています.
+    """
+    cleaner = Compose([
+        custom_document_filters.JSONLoader(ignore=True),
+        DropListDeduplicator(load_drops(partition_dir, num_partitions, file_index)),
+        custom_document_filters.JSONDumper(),
+    ])
+    duplicates = {"exact": 0, "near": 0, "within_file": 0, "across_files": 0}
+    os.makedirs(output_base, exist_ok=True)
+    with LineWriter(with_extension(os.path.join(output_base, "result.dedup.jsonl"), compression), "w",
+                    compression) as writer:
+        with LineWriter(with_extension(os.path.join(output_base, "rejected.dedup.jsonl"), compression), "w",
+                        compression) as rejected:
+            for line_index, line in enumerate(ChunkReader(Chunk(path, 0, None))):
+                document = Document(line)
+                document.dedup_line = line_index
+                result = cleaner.apply(document)
+                if result.is_rejected:
+                    rejected.write(result.text + "\n")
+                    if result.reject_reason.get("name") != "JSONLoader":
+                        duplicates["exact" if result.dedup_exact else "near"] += 1
+                        duplicates["within_file" if result.dedup_within_file else "across_files"] += 1
+                else:
+                    writer.write(result.text + "\n")
+
+    stat = cleaner.statistics_obj.get_human_readable_values()
+    stat["duplicates"] = duplicates
+    tmp_path = os.path.join(output_base, "stat.dedup.jsonl.tmp")
+    with open(tmp_path, "w") as fp:
+        fp.write(json.dumps(stat, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, os.path.join(output_base, "stat.dedup.jsonl"))
+    return stat
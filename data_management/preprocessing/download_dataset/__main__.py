@@ -6,6 +6,7 @@ import pathlib
 import preprocessing
 
 from preprocessing.download_dataset import c4, wikipedia, redpajama, redpajama_v2
+from preprocessing.download_dataset.downloader import DEFAULT_NUM_CONNECTIONS
 
 ROOT_PATH = pathlib.Path(preprocessing.__path__[0]).resolve().parent
 SCRIPT_PATH = os.path.join(ROOT_PATH, "scripts")
@@ -22,6 +23,10 @@ def parse_args():
     parser.add_argument("--snapshot", type=str, help="CC snapshot to download")
     parser.add_argument("--language", type=str, help="Language to download")
     parser.add_argument("--partition", type=str, help="Partition to download")
+    parser.add_argument("--num_workers", type=int, default=1,
+                        help="Number of processes to convert C4 shards and parse Wikipedia dumps")
+    parser.add_argument("--num_connections", type=int, default=DEFAULT_NUM_CONNECTIONS,
+                        help="Number of concurrent connections to download RedPajama files")
 
     return parser.parse_args()
 
@@ -30,13 +35,15 @@ def main():
     args = parse_args()
     if args.dataset == "c4":
         c4.download_dataset(split=args.split or "train", index_from=args.index_from,
-                            index_to=args.index_to, output_base=args.output_base)
+                            index_to=args.index_to, output_base=args.output_base, num_workers=args.num_workers)
     elif args.dataset == "wikipedia":
-        wikipedia.download_dataset(date=args.split, output_base=args.output_base)
+        wikipedia.download_dataset(date=args.split, output_base=args.output_base, num_workers=args.num_workers)
     elif args.dataset == "redpajama":
-        redpajama.download_dataset(split=args.split, output_base=args.output_base)
+        redpajama.download_dataset(split=args.split, output_base=args.output_base,
+                                   num_connections=args.num_connections)
     elif args.dataset == "redpajama_v2":
-        redpajama_v2.download_dataset(snapshot=args.snapshot, language=args.language, partition=args.partition, output_base=args.output_base)
+        redpajama_v2.download_dataset(snapshot=args.snapshot, language=args.language, partition=args.partition,
+                                      output_base=args.output_base, num_connections=args.num_connections)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,17 @@
 import os
+import shutil
 import subprocess
 import gzip
 import logging
 import json
+from concurrent.futures import ProcessPoolExecutor
+
+from preprocessing import json_codec
+from preprocessing.download_dataset.cache import ArtifactCache, open_cache
+
+CHUNK_SIZE = 16 * 1024 * 1024
+# 出力が変わる変更をした場合は上げて, キャッシュされた変換結果を作り直させる
+CONVERTER_VERSION = "1"
 
 
 def __download_config(split: str, index_from: int, index_to: int) -> dict[str, str]:
@@ -21,31 +30,76 @@ def __download_config(split: str, index_from: int, index_to: int) -> dict[str, s
     return {"filebase": filebase, "output_file": output_file}
 
 
-def __execute_download(download_file: str, output_file_path: str, dataset_root: str) -> None:
+def __pull(download_file: str, dataset_root: str) -> None:
     logging.info(f"Downloading {dataset_root}/{download_file}")
-
-    current_dir = os.getcwd()
-
-    # Change directory in order to use git lfs
-    os.chdir(dataset_root)
-    subprocess.run(["git", "lfs", "pull", "--include", f"multilingual/{download_file}"], check=True)
-    os.chdir(current_dir)
-
-    logging.info(f"Saving to {output_file_path}")
-    with gzip.open(f"{dataset_root}/multilingual/{download_file}", 'rb') as input_file:
-        content = input_file.read().decode("utf-8")
-
-    with open(output_file_path, 'a', encoding="utf-8") as output_file:
-        for i, line in enumerate(content.split("\n")):
+    # git lfs を用いるため, リポジトリのディレクトリで実行する
+    subprocess.run(["git", "lfs", "pull", "--include", f"multilingual/{download_file}"], check=True,
+                   cwd=dataset_root)
+
+
+def convert_shard(input_path: str, output_path: str) -> int:
+    """
+    gzip 圧縮されたシャードを1行ずつ展開して JSONL に変換し, 書き出した行数を返します.
+    書き込み途中のファイルが残らないように, 一時ファイルに書いてから置き換えます.
+    """
+    logging.info(f"Saving to {output_path}")
+    num_lines = 0
+    tmp_path = output_path + ".tmp"
+    with gzip.open(input_path, "rt", encoding="utf-8") as input_file, \
+            open(tmp_path, "w", encoding="utf-8") as output_file:
+        for i, line in enumerate(input_file):
             try:
-                line = json.loads(line)
-                output_file.write(json.dumps(line, ensure_ascii=False) + "\n")
-            except (json.JSONDecodeError) as e:
+                # text 以外のフィールド(timestamp, url)は再シリアライズせずにそのまま書き出す
+                output_file.write(json_codec.rewrite_text(line) + "\n")
+                num_lines += 1
+            except (json.JSONDecodeError, KeyError) as e:
                 logging.info(f"Failed to decode line {i}: {e}")
-
-
-
-def download_dataset(split: str, output_base: str = "output", index_from: int = 0, index_to: int = 0) -> None:
+    os.replace(tmp_path, output_path)
+    return num_lines
+
+
+def __execute_download(download_files: list[str], output_file_path: str, dataset_root: str,
+                       num_workers: int, cache: ArtifactCache) -> None:
+    """
+    シャードを1つずつ git lfs pull し, ダウンロードし終えたシャードから `num_workers` のプロセスで変換します.
+    変換中に次のシャードをダウンロードするため, ダウンロードと変換が並行して進みます.
+    シャードごとの変換結果は `dataset_root/converted` に残し, 最後に元の順序で `output_file_path` に連結します.
+    シャードは git lfs のポインタに記録された SHA-256 で識別し, 前回と同じシャードはダウンロードも変換もしません.
+    """
+    shard_dir = os.path.join(dataset_root, "converted")
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_paths = [os.path.join(shard_dir, download_file.removesuffix(".json.gz") + ".jsonl")
+                   for download_file in download_files]
+    inputs = {download_file: cache.lfs_digest(f"{dataset_root}/multilingual/{download_file}")
+              for download_file in download_files}
+    cache.save()
+    with ProcessPoolExecutor(num_workers) as executor:
+        futures = {}
+        for download_file, shard_path in zip(download_files, shard_paths):
+            shard_inputs = {download_file: inputs[download_file]}
+            if cache.is_fresh(shard_path, "c4", CONVERTER_VERSION, shard_inputs):
+                logging.info(f"{shard_path} is up to date")
+                continue
+            __pull(download_file, dataset_root)
+            futures[shard_path] = (shard_inputs, executor.submit(
+                convert_shard, f"{dataset_root}/multilingual/{download_file}", shard_path))
+        for shard_path, (shard_inputs, future) in futures.items():
+            future.result()
+            cache.record(shard_path, "c4", CONVERTER_VERSION, shard_inputs, [shard_path])
+
+    if cache.is_fresh(output_file_path, "c4", CONVERTER_VERSION, inputs):
+        logging.info(f"{output_file_path} is up to date")
+        return
+    logging.info(f"Concatenating {len(shard_paths)} shards to {output_file_path}")
+    with open(output_file_path, "wb") as output_file:
+        for shard_path in shard_paths:
+            with open(shard_path, "rb") as input_file:
+                shutil.copyfileobj(input_file, output_file, CHUNK_SIZE)
+    cache.record(output_file_path, "c4", CONVERTER_VERSION, inputs, [output_file_path])
+
+
+def download_dataset(split: str, output_base: str = "output", index_from: int = 0, index_to: int = 0,
+                     num_workers: int = 1) -> None:
     """Download the specified C4 dataset from Hugging Face."""
     if index_from < 0:
         raise ValueError("index_from must be greater than or equal to 0")
@@ -78,9 +132,6 @@ def download_dataset(split: str, output_base: str = "output", index_from: int =
     config = __download_config(split=split, index_from=index_from, index_to=index_to)
 
     output_file_path = os.path.join(output_path, config["output_file"])
-    if os.path.exists(output_file_path):
-        os.remove(output_file_path)
-    for i in range(index_from, index_to+1):
-        filename = config["filebase"].format(index=str(i).zfill(5))
-        __execute_download(download_file=filename,
-                           output_file_path=output_file_path, dataset_root=dataset_root)
+    download_files = [config["filebase"].format(index=str(i).zfill(5)) for i in range(index_from, index_to+1)]
+    __execute_download(download_files=download_files, output_file_path=output_file_path, dataset_root=dataset_root,
+                       num_workers=num_workers, cache=open_cache(output_base))
@@ -0,0 +1,149 @@
+"""
+ダウンロードしたファイルと変換結果のキャッシュです.
+
+ファイルは内容の SHA-256 で識別します. ハッシュ値はファイルのサイズと更新時刻とともに記録するため,
+変更されていないファイルを読み直すことはありません.
+`store` したファイルは `objects/` にハッシュ値の名前でハードリンク(できない場合はコピー)して保持し,
+元のファイルを消しても `restore` で取り出せます.
+SHA-256 が公開されていないファイルは, URL とサーバーが返したサイズ, ETag とともにハッシュ値を記録し,
+それらが変わっていなければ同じファイルとして取り出せます.
+
+変換結果は, 変換の名前とバージョン, パラメータ, 入力ファイルのハッシュ値とともに記録します.
+`is_fresh` はそれらが前回と同じで, 出力ファイルが記録した時のまま残っている場合に True を返すため,
+入力が変わっていない変換を飛ばすことができます.
+"""
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Optional
+
+from preprocessing.atomic_file import atomic_write
+
+CACHE_FILE = "cache.json"
+CHUNK_SIZE = 16 * 1024 * 1024
+LFS_POINTER_PREFIX = b"version https://git-lfs.github.com/spec/v1"
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.path = os.path.join(root, CACHE_FILE)
+        self.digests: dict[str, dict[str, Any]] = {}
+        self.conversions: dict[str, dict[str, Any]] = {}
+        self.urls: dict[str, dict[str, Any]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf8") as fp:
+                data = json.load(fp)
+            self.digests = data["digests"]
+            self.conversions = data["conversions"]
+            self.urls = data.get("urls", {})
+
+    @staticmethod
+    def __stat(path: str) -> dict[str, int]:
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    @staticmethod
+    def __link(source: str, destination: str) -> None:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        tmp_path = f"{destination}.tmp-{os.getpid()}"
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+
+    def save(self) -> None:
+        """記録を書き出します. `digest` と `record_url` の記録は, 多数のファイルをまとめて書き出すために保存しません."""
+        os.makedirs(self.root, exist_ok=True)
+        with atomic_write(self.path) as writer:
+            json.dump({"digests": self.digests, "conversions": self.conversions, "urls": self.urls}, writer,
+                      ensure_ascii=False)
+
+    def digest(self, path: str) -> str:
+        """ファイルの SHA-256 を返します. サイズと更新時刻が前回と同じ場合は記録した値を返します."""
+        key = os.path.abspath(path)
+        stat = self.__stat(path)
+        state = self.digests.get(key)
+        if state is not None and state["stat"] == stat:
+            return state["sha256"]
+        sha256 = sha256_file(path)
+        self.digests[key] = {"stat": stat, "sha256": sha256}
+        return sha256
+
+    def lfs_digest(self, path: str) -> str:
+        """
+        git lfs で管理されたファイルの SHA-256 を返します.
+        `git lfs pull` する前のポインタファイルの場合は, ポインタに記録された(ダウンロード後のファイルと同じ)値を返します.
+        """
+        with open(path, "rb") as fp:
+            head = fp.read(len(LFS_POINTER_PREFIX))
+            if head == LFS_POINTER_PREFIX:
+                for line in (head + fp.read(1024)).decode("utf-8").splitlines():
+                    if line.startswith("oid sha256:"):
+                        return line.removeprefix("oid sha256:")
+        return self.digest(path)
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def store(self, path: str) -> str:
+        """ファイルをハッシュ値の名前で保持し, ハッシュ値を返します."""
+        sha256 = self.digest(path)
+        object_path = self.object_path(sha256)
+        if not os.path.exists(object_path):
+            self.__link(path, object_path)
+        return sha256
+
+    def restore(self, sha256: str, path: str) -> bool:
+        """保持しているファイルを `path` に取り出します. 保持していない場合は False を返します."""
+        object_path = self.object_path(sha256)
+        if not os.path.exists(object_path):
+            return False
+        if os.path.exists(path):
+            os.remove(path)
+        self.__link(object_path, path)
+        return True
+
+    def url_record(self, url: str) -> Optional[dict[str, Any]]:
+        """`url` からダウンロードしたファイルの `size`, `etag`, `sha256` を返します. 記録がない場合は None を返します."""
+        return self.urls.get(url)
+
+    def record_url(self, url: str, sha256: str, size: int, etag: Optional[str]) -> None:
+        """`url` からダウンロードしたファイルのハッシュ値を, サーバーが返したサイズと ETag とともに記録します."""
+        self.urls[url] = {"size": size, "etag": etag, "sha256": sha256}
+
+    def is_fresh(self, key: str, converter: str, version: str, inputs: dict[str, str],
+                 parameters: Optional[dict[str, Any]] = None) -> bool:
+        """`key` の変換結果が同じ変換と入力から作られ, 出力ファイルが変更されていないかどうかを返します."""
+        record = self.conversions.get(key)
+        if record is None or (record["converter"], record["version"], record["inputs"], record["parameters"]) != (
+                converter, version, inputs, parameters or {}):
+            return False
+        return all(os.path.exists(path) and self.__stat(path) == stat for path, stat in record["outputs"].items())
+
+    def record(self, key: str, converter: str, version: str, inputs: dict[str, str], outputs: list[str],
+               parameters: Optional[dict[str, Any]] = None) -> None:
+        """`outputs` を `inputs` から変換したことを記録します."""
+        self.conversions[key] = {
+            "converter": converter,
+            "version": version,
+            "parameters": parameters or {},
+            "inputs": inputs,
+            "outputs": {path: self.__stat(path) for path in outputs},
+        }
+        self.save()
+
+
+def open_cache(output_base: str) -> ArtifactCache:
+    """`output_base` のダウンロード先で共有するキャッシュを返します."""
+    return ArtifactCache(os.path.join(output_base, "tmp/cache"))
@@ -0,0 +1,264 @@
+"""
+複数のファイルを並列にダウンロードするためのユーティリティです.
+
+`num_connections` 個のスレッドが1つの `requests.Session` の接続を keep-alive で使い回してダウンロードします.
+ダウンロード中のファイルは `.part` を付けた名前で書き込み, 中断や接続の切断があった場合は Range リクエストで続きから
+ダウンロードし直します. その際はダウンロードを始めた時の ETag(なければ Last-Modified)を If-Range で送り,
+サーバー上のファイルが変わっていれば最初からダウンロードし直します. 失敗したファイルは指数的に間隔を空けて `max_retries` 回まで再試行します.
+ダウンロードしたファイルはサイズ(と指定した場合は SHA-256)を確認してから本来の名前に変更し,
+出力先の manifest.json に記録します. 再実行すると記録済みのファイルは飛ばします.
+`cache` を指定した場合, ダウンロードしたファイルはキャッシュに保持します. SHA-256 が分かっているファイルは
+キャッシュにあればダウンロードせずに取り出します. それ以外のファイルは, HEAD リクエストで確かめたサイズと ETag が
+前回ダウンロードした時と同じ場合に取り出します.
+"""
+import dataclasses
+import logging
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from preprocessing.checkpoint import Manifest
+from preprocessing.download_dataset.cache import ArtifactCache, sha256_file
+
+DEFAULT_NUM_CONNECTIONS = 8
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 1.0
+DEFAULT_TIMEOUT = 60
+CHUNK_SIZE = 1024 * 1024
+# 再試行しても結果が変わらないステータスコード
+FATAL_STATUS_CODES = {400, 401, 403, 404, 405, 410}
+
+
+@dataclasses.dataclass
+class DownloadTask:
+    url: str
+    # 出力先からの相対パス
+    path: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+
+
+class DownloadError(Exception):
+    pass
+
+
+def __content_length(response: requests.Response, offset: int) -> Optional[int]:
+    """レスポンスからファイル全体のサイズを求めます."""
+    content_range = response.headers.get("Content-Range")
+    if content_range is not None:
+        match = re.match(r"bytes \d+-\d+/(\d+)", content_range)
+        if match:
+            return int(match.group(1))
+    content_length = response.headers.get("Content-Length")
+    if content_length is None:
+        return None
+    return int(content_length) + (offset if response.status_code == 206 else 0)
+
+
+def __validator(response: requests.Response) -> Optional[str]:
+    """If-Range に指定できる, ファイルの版を表す値を返します. 弱い ETag は If-Range に使えません."""
+    etag = response.headers.get("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def __fetch(session: requests.Session, task: DownloadTask, path: str, timeout: float
+            ) -> tuple[int, int, Optional[str]]:
+    """
+    `path` の `.part` ファイルの続きをダウンロードし, (ファイル全体のサイズ, 今回ダウンロードしたバイト数, ETag) を
+    返します.
+    """
+    part_path = path + ".part"
+    validator_path = part_path + ".validator"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = None
+    if offset > 0 and os.path.exists(validator_path):
+        with open(validator_path, encoding="utf-8") as fp:
+            validator = fp.read()
+    # 同じ版のファイルの続きか確かめられない場合は, 最初からダウンロードし直す
+    headers = {"Range": f"bytes={offset}-", "If-Range": validator} if validator else {}
+    if not validator:
+        offset = 0
+    with session.get(task.url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416 and offset > 0:
+            match = re.match(r"bytes \*/(\d+)", response.headers.get("Content-Range", ""))
+            if offset == task.size or (match and int(match.group(1)) == offset):
+                # 前回の実行でダウンロードし終えていた
+                return offset, 0, response.headers.get("ETag")
+            # ファイルより大きい .part ファイルは壊れているため, 最初からダウンロードし直す
+            os.remove(part_path)
+            raise requests.ConnectionError(f"{task.url}: the partial file is larger than the remote file")
+        if response.status_code in FATAL_STATUS_CODES:
+            raise DownloadError(f"{task.url}: HTTP {response.status_code}")
+        response.raise_for_status()
+        if response.status_code != 206:
+            # サーバーが Range に対応していないか, ファイルが変わっていた場合は最初からダウンロードし直す
+            offset = 0
+        elif __validator(response) not in (None, validator):
+            # If-Range を無視して別の版の続きを返した
+            os.remove(part_path)
+            raise requests.ConnectionError(f"{task.url}: the remote file changed during the download")
+        size = __content_length(response, offset)
+        etag = response.headers.get("ETag")
+        downloaded = 0
+        with open(part_path, "r+b" if offset > 0 else "wb") as fp:
+            fp.seek(offset)
+            fp.truncate()
+            if offset == 0:
+                # .part ファイルを空にしてから記録するため, 古い版の内容に新しい版の値が付くことはない
+                new_validator = __validator(response)
+                if new_validator is None:
+                    if os.path.exists(validator_path):
+                        os.remove(validator_path)
+                else:
+                    with open(validator_path, "w", encoding="utf-8") as validator_fp:
+                        validator_fp.write(new_validator)
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                fp.write(chunk)
+                downloaded += len(chunk)
+    total = offset + downloaded
+    if size is not None and total != size:
+        raise requests.ConnectionError(f"{task.url}: received {total} of {size} bytes")
+    return total, downloaded, etag
+
+
+def __is_unchanged(session: requests.Session, url: str, record: dict, timeout: float) -> bool:
+    """キャッシュに記録した `url` のファイルと, サーバー上のファイルのサイズと ETag が同じかどうかを返します."""
+    try:
+        response = session.head(url, allow_redirects=True, timeout=timeout)
+    except requests.RequestException:
+        return False
+    if not response.ok:
+        return False
+    etag = response.headers.get("ETag")
+    content_length = response.headers.get("Content-Length")
+    if etag is None and content_length is None:
+        # 同じファイルか確かめられない
+        return False
+    return (etag is None or etag == record["etag"]) and \
+        (content_length is None or int(content_length) == record["size"])
+
+
+def __download(session: requests.Session, task: DownloadTask, output_base: str, max_retries: int,
+               backoff: float, timeout: float, cache: Optional[ArtifactCache]) -> dict:
+    """1つのファイルをダウンロードし, マニフェストに記録する状態を返します."""
+    path = os.path.join(output_base, task.path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = cache.url_record(task.url) if cache is not None and task.sha256 is None else None
+    if record is not None and (task.size is None or task.size == record["size"]) and \
+            __is_unchanged(session, task.url, record, timeout) and cache.restore(record["sha256"], path):
+        return {"done": True, "url": task.url, "size": record["size"], "sha256": record["sha256"],
+                "etag": record["etag"], "downloaded": 0, "restored": True}
+    part_path = path + ".part"
+    # 前回の実行までにダウンロードした部分はスループットに含めない. 最後の試行で最初からダウンロードし直した場合は,
+    # それより前の試行の分もファイルに残らないため含めない
+    resumed = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    for attempt in range(max_retries + 1):
+        try:
+            size, downloaded, etag = __fetch(session, task, path, timeout)
+            break
+        except requests.RequestException as e:
+            if attempt == max_retries:
+                raise DownloadError(f"{task.url}: {e}") from e
+            wait = backoff * 2 ** attempt * (1 + random.random())
+            logging.warning(f"Retrying {task.url} in {wait:.1f} seconds: {e}")
+            time.sleep(wait)
+
+    if task.size is not None and size != task.size:
+        os.remove(part_path)
+        raise DownloadError(f"{task.url}: expected {task.size} bytes but got {size}")
+    sha256 = sha256_file(part_path) if task.sha256 is not None else None
+    if sha256 is not None and sha256 != task.sha256:
+        os.remove(part_path)
+        raise DownloadError(f"{task.url}: checksum mismatch")
+    os.replace(part_path, path)
+    if os.path.exists(part_path + ".validator"):
+        os.remove(part_path + ".validator")
+    return {"done": True, "url": task.url, "size": size, "sha256": sha256, "etag": etag,
+            "downloaded": downloaded + max(0, size - downloaded - resumed), "restored": False}
+
+
+def __is_done(manifest: Manifest, task: DownloadTask, output_base: str) -> bool:
+    state = manifest.get(task.path)
+    if state is None or not state["done"] or state["url"] != task.url:
+        return False
+    path = os.path.join(output_base, task.path)
+    return os.path.exists(path) and os.path.getsize(path) == state["size"]
+
+
+def create_session(num_connections: int = DEFAULT_NUM_CONNECTIONS) -> requests.Session:
+    """スレッドごとに接続を使い回せるように, 接続プールの大きさを `num_connections` にした `Session` を返します."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=num_connections, pool_maxsize=num_connections)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download_files(tasks: Iterable[DownloadTask], output_base: str,
+                   num_connections: int = DEFAULT_NUM_CONNECTIONS, max_retries: int = DEFAULT_MAX_RETRIES,
+                   backoff: float = DEFAULT_BACKOFF, timeout: float = DEFAULT_TIMEOUT,
+                   cache: Optional[ArtifactCache] = None) -> dict:
+    """
+    `tasks` のファイルを `output_base` にダウンロードし, 件数とスループットを返します.
+    manifest.json に記録済みのファイルは飛ばします. 失敗したファイルがあった場合は, 全てのファイルを処理した後に
+    `DownloadError` を送出するため, 再実行するとそれらのファイルだけをダウンロードします.
+    """
+    os.makedirs(output_base, exist_ok=True)
+    manifest = Manifest(output_base)
+    pending = []
+    for task in tasks:
+        if __is_done(manifest, task, output_base):
+            continue
+        path = os.path.join(output_base, task.path)
+        if cache is not None and task.sha256 is not None and cache.restore(task.sha256, path):
+            logging.info(f"Restored {task.path} from the cache")
+            manifest.update(task.path, {"done": True, "url": task.url, "size": os.path.getsize(path),
+                                        "sha256": task.sha256, "etag": None, "downloaded": 0})
+            continue
+        pending.append(task)
+    result = {"files": len(pending), "downloaded_bytes": 0, "restored": 0, "failed": 0}
+    start = time.perf_counter()
+    try:
+        with create_session(num_connections) as session, ThreadPoolExecutor(num_connections) as executor:
+            futures = {executor.submit(__download, session, task, output_base, max_retries, backoff, timeout,
+                                       cache): task
+                       for task in pending}
+            for num_finished, future in enumerate(as_completed(futures), 1):
+                task = futures[future]
+                try:
+                    state = future.result()
+                except (DownloadError, OSError) as e:
+                    logging.error(f"Failed to download {task.url}: {e}")
+                    result["failed"] += 1
+                    continue
+                # マニフェストとキャッシュは別のスレッドから更新しない
+                restored = state.pop("restored")
+                if cache is not None and not restored:
+                    state["sha256"] = cache.store(os.path.join(output_base, task.path))
+                    cache.record_url(task.url, state["sha256"], state["size"], state["etag"])
+                manifest.update(task.path, state)
+                result["restored"] += restored
+                result["downloaded_bytes"] += state["downloaded"]
+                elapsed = time.perf_counter() - start
+                logging.info(f"{'Restored' if restored else 'Downloaded'} {task.path} ({num_finished}/{len(pending)}, "
+                             f"{result['downloaded_bytes'] / 1000**2 / elapsed:.1f} MB/sec)")
+    finally:
+        # キャッシュの記録は, ファイルごとではなく最後(中断した場合も)にまとめて書き出す
+        if cache is not None:
+            cache.save()
+    result["seconds"] = time.perf_counter() - start
+    result["MB_per_sec"] = result["downloaded_bytes"] / 1000**2 / result["seconds"] if result["seconds"] > 0 else 0.0
+    logging.info(f"Downloaded {result['files'] - result['failed'] - result['restored']} files "
+                 f"(and restored {result['restored']} from the cache), "
+                 f"{result['downloaded_bytes'] / 1000**2:.1f} MB at {result['MB_per_sec']:.1f} MB/sec")
+    if result["failed"]:
+        raise DownloadError(f"Failed to download {result['failed']} files. Run again to retry them.")
+    return result
@@ -1,31 +1,34 @@
-
 import logging
 import os
-import subprocess
-import preprocessing
-import pathlib
 
-ROOT_PATH = pathlib.Path(preprocessing.__path__[0]).resolve().parent
-SCRIPT_PATH = os.path.join(ROOT_PATH, "scripts")
+from preprocessing.download_dataset.cache import open_cache
+from preprocessing.download_dataset.downloader import DEFAULT_NUM_CONNECTIONS, DownloadTask, download_files
+
+BASE_URL = "https://data.together.xyz/redpajama-data-1T/v1.0.0/"
 
 
-def download_dataset(split: str = "", output_base: str = "tmp/output") -> None:
+def download_dataset(split: str = "", output_base: str = "tmp/output",
+                     num_connections: int = DEFAULT_NUM_CONNECTIONS) -> None:
     # Set the filename and save path based on the dataset name
-    dataset = "https://data.together.xyz/redpajama-data-1T/v1.0.0/urls.txt"
+    dataset = BASE_URL + "urls.txt"
     dataset_root = os.path.join(output_base, "tmp/togethercomputer/redpajama")
-    os.makedirs(dataset_root, exist_ok=True)
 
     # Download file index
     if os.path.exists(os.path.join(dataset_root, "urls.txt")):
         logging.info("File index already exists")
         logging.info("Skipping download")
     else:
-        current_dir = os.getcwd()
-        os.chdir(dataset_root)
-        subprocess.call([f"wget {dataset}"], shell=True)
-        os.chdir(current_dir)
+        download_files([DownloadTask(dataset, "urls.txt")], dataset_root)
 
     # Download the dataset
     output_path = os.path.join(output_base, "datasets/togethercomputer/redpajama")
-    os.makedirs(output_path, exist_ok=True)
-    subprocess.run([os.path.join(SCRIPT_PATH,  "download_redpajama.sh"), output_path, os.path.join(dataset_root, "urls.txt"), split])
+    tasks = []
+    with open(os.path.join(dataset_root, "urls.txt")) as fp:
+        for line in fp:
+            url = line.strip()
+            if not url:
+                continue
+            dload_loc = url.removeprefix(BASE_URL)
+            if not split or dload_loc.startswith(f"{split}/"):
+                tasks.append(DownloadTask(url, dload_loc))
+    download_files(tasks, output_path, num_connections=num_connections, cache=open_cache(output_base))
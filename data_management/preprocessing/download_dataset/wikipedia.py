@@ -1,68 +1,140 @@
 import logging
 import os
 import bz2
-import json
+import io
 import shutil
 import mwxml
 import hashlib
-import requests
+from multiprocessing import Pool
 
+from preprocessing import json_codec
+from preprocessing.download_dataset.cache import open_cache
+from preprocessing.download_dataset.downloader import DownloadTask, download_files
 
-NUM_FILES = os.environ.get('NUM_FILES', 100)
 
+NUM_FILES = int(os.environ.get('NUM_FILES', 100))
+# 1つのタスクで展開する bz2 ストリームの数. multistream のダンプは1つのストリームに100記事ずつ格納されている
+STREAMS_PER_TASK = 16
+# 出力ファイルごとの書き込みバッファのサイズ
+BUFFER_SIZE = 256 * 1024
+# 出力が変わる変更をした場合は上げて, キャッシュされた変換結果を作り直させる
+CONVERTER_VERSION = "2"
 
-def process_dump(page, path, file_index):
-    with open(os.path.join(path, f"{file_index}.jsonl"), 'a', encoding='utf-8') as output_file:
-        id = page.id
-        title = page.title
-        for revision in page:
-            text = revision.text
-            if text:
-                break
 
-        # 記事のタイトルとテキストをJSON形式に変換する
-        article_json = json.dumps({
-            'id': id,
-            'title': title,
-            'text': text,
-        }, ensure_ascii=False)
+def get_file_index(title: str) -> int:
+    return int(hashlib.sha256(title.encode()).hexdigest(), 16) % NUM_FILES
 
-        # JSONをファイルに書き込む
-        output_file.write(article_json + '\n')
 
+def process_dump(page) -> str:
+    id = page.id
+    title = page.title
+    text = None
+    for revision in page:
+        text = revision.text
+        if text:
+            break
 
-def download_dataset(date: str, output_base: str = "output", lang: str = "ja") -> None:
+    # 記事のタイトルとテキストをJSON形式に変換する
+    return json_codec.encode({
+        'id': id,
+        'title': title,
+        'text': text,
+    })
+
+
+def read_stream_offsets(index_path: str) -> list[int]:
+    """multistream のインデックス(`オフセット:ID:タイトル` の行)から, 記事を含む bz2 ストリームの開始位置を返します."""
+    offsets = set()
+    with bz2.open(index_path, 'rt', encoding='utf-8') as index_file:
+        for line in index_file:
+            offsets.add(int(line.split(':', 1)[0]))
+    return sorted(offsets)
+
+
+def parse_streams(args: tuple[str, int, int, str]) -> list[tuple[int, str]]:
+    """
+    ダンプの `start` から `end` バイト目までの bz2 ストリームを展開し, (出力ファイルの番号, 記事の JSON) のリストを返します.
+    ストリームには `<page>` 要素だけが含まれるため, 先頭のストリームの `<siteinfo>` までを `header` として補って読み込みます.
+    """
+    dump_path, start, end, header = args
+    with open(dump_path, 'rb') as dump_file:
+        dump_file.seek(start)
+        xml = bz2.decompress(dump_file.read(end - start)).decode('utf-8')
+    # 最後のストリームの後には閉じタグだけのストリームがある
+    xml = xml.replace('</mediawiki>', '')
+    dump = mwxml.Dump.from_file(io.StringIO(header + xml + '</mediawiki>'))
+    articles = []
+    for page in dump:
+        if page.namespace == 0 and page.redirect is None:
+            articles.append((get_file_index(page.title), process_dump(page)))
+    return articles
+
+
+def parse_dump(dump_path: str, index_path: str, output_path: str, num_workers: int = 1) -> None:
+    """
+    multistream のダンプを `STREAMS_PER_TASK` 個の bz2 ストリームずつ `num_workers` のプロセスで並列にパースし,
+    記事をタイトルのハッシュ値で `NUM_FILES` 個のファイルに振り分けます.
+    出力ファイルは開いたまま書き込み, 記事はダンプの順序で書き込むため, 出力は1つずつパースした場合と同一です.
+    """
+    offsets = read_stream_offsets(index_path)
+    with open(dump_path, 'rb') as dump_file:
+        header = bz2.decompress(dump_file.read(offsets[0])).decode('utf-8')
+    bounds = offsets + [os.path.getsize(dump_path)]
+    tasks = [(dump_path, bounds[i], bounds[min(i + STREAMS_PER_TASK, len(offsets))], header)
+             for i in range(0, len(offsets), STREAMS_PER_TASK)]
+
+    writers: dict[int, io.TextIOWrapper] = {}
+    num_articles = 0
+    try:
+        with Pool(num_workers) as pool:
+            for articles in pool.imap(parse_streams, tasks):
+                for file_index, article_json in articles:
+                    output_file = writers.get(file_index)
+                    if output_file is None:
+                        output_file = open(os.path.join(output_path, f"{file_index}.jsonl"), 'w', encoding='utf-8',
+                                           buffering=BUFFER_SIZE)
+                        writers[file_index] = output_file
+                    output_file.write(article_json + '\n')
+                if num_articles // 1000 != (num_articles + len(articles)) // 1000:
+                    logging.info(f"Processed {num_articles + len(articles)} articles")
+                num_articles += len(articles)
+    finally:
+        for output_file in writers.values():
+            output_file.close()
+
+
+def download_dataset(date: str, output_base: str = "output", lang: str = "ja", num_workers: int = 1) -> None:
     filename = f"{lang}wiki-{date}-pages-articles-multistream.xml.bz2"
+    index_filename = f"{lang}wiki-{date}-pages-articles-multistream-index.txt.bz2"
 
     dump_path = os.path.join(output_base, f"tmp/wikipedia/{date}/{lang}")
     os.makedirs(dump_path, exist_ok=True)
 
-    url = f"https://dumps.wikimedia.org/{lang}wiki/{date}/{filename}"
-    if not os.path.exists(os.path.join(dump_path, filename)):
-        logging.info(f"Downloading {url}")
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            logging.info(f"Saving to {os.path.join(dump_path, filename)}")
-            with open(os.path.join(dump_path, filename), 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-    else:
-        logging.info(f"File {os.path.join(dump_path, filename)} already exists")
-        logging.info(f"Skipping download\n")
-
-    # ダンプデータをパースする
+    tasks = []
+    for name in [filename, index_filename]:
+        if os.path.exists(os.path.join(dump_path, name)):
+            logging.info(f"File {os.path.join(dump_path, name)} already exists")
+            logging.info(f"Skipping download\n")
+        else:
+            tasks.append(DownloadTask(f"https://dumps.wikimedia.org/{lang}wiki/{date}/{name}", name))
+    cache = open_cache(output_base)
+    download_files(tasks, dump_path, cache=cache)
+
+    # ダンプと変換方法が前回と同じ場合はパースし直さない
     output_path = os.path.join(output_base, f"datasets/wikipedia/{date}/{lang}")
+    inputs = {name: cache.store(os.path.join(dump_path, name)) for name in [filename, index_filename]}
+    cache.save()
+    parameters = {"num_files": NUM_FILES}
+    if cache.is_fresh(output_path, "wikipedia", CONVERTER_VERSION, inputs, parameters):
+        logging.info(f"{output_path} is up to date")
+        logging.info(f"Skipping parse\n")
+        return
+
     if os.path.exists(output_path):
         shutil.rmtree(output_path)
     os.makedirs(output_path)
 
     logging.info(f"Parse and process {os.path.join(dump_path, filename)}")
-    with bz2.open(os.path.join(dump_path, filename), 'rt') as compressed_file:
-        dump = mwxml.Dump.from_file(compressed_file)
-        for index, page in enumerate(dump):
-            if index > 0 and index % 1000 == 0:
-                logging.info(f"Processed {index} articles")
-
-            if page.namespace == 0 and page.redirect is None:
-                file_index = int(hashlib.sha256(page.title.encode()).hexdigest(), 16) % NUM_FILES
-                process_dump(page, output_path, file_index)
+    parse_dump(os.path.join(dump_path, filename), os.path.join(dump_path, index_filename), output_path, num_workers)
+    outputs = [os.path.join(output_path, name) for name in sorted(os.listdir(output_path))]
+    cache.record(output_path, "wikipedia", CONVERTER_VERSION, inputs, outputs, parameters)
@@ -1,20 +1,77 @@
 import argparse
+import collections
+import contextlib
+import copy
+import dataclasses
 from datetime import datetime
+import functools
 import json
-from hojichar import document_filters, tokenization, Compose, Document
+import multiprocessing
+import shutil
+from typing import Iterable, Optional, TextIO
+from hojichar import document_filters, tokenization, Compose, Document, StatsContainer
 import os
 
+from preprocessing.checkpoint import DEFAULT_CHECKPOINT_INTERVAL, FileCheckpoint, Manifest, subtract_stats
+from preprocessing.chunking import DEFAULT_CHUNK_SIZE, Chunk, ChunkReader, iter_chunk_lines, split_file
+from preprocessing.compression import COMPRESSIONS, LineWriter, is_jsonl, strip_extension, with_extension
 from preprocessing.filtering import custom_token_filters, custom_tokenization, custom_document_filters
+from preprocessing.filtering.adaptive import DEFAULT_WARMUP_SIZE, AdaptiveCompose, ProfilingAdaptiveCompose
+from preprocessing.filtering.line_cache import LineDecisionCache, merge_cache_info
+from preprocessing.profiling import PipelineProfile, ProfilingCompose, SamplingProfiler, dump_folded_stacks
 
+DEFAULT_BUFFER_SIZE = 1024 * 1024
 
-def process_json_lines(lines: list[str], output_base: str, stats: list[dict]):
-    remained_lines = []
-    cleaner = Compose([
-        document_filters.JSONLoader(),
+WORKER_CLEANER: Compose
+
+
+@dataclasses.dataclass
+class FilteringResult:
+    """1つのファイル(またはチャンク)をフィルタリングした際の統計情報です."""
+    stats_obj: StatsContainer
+    cache_info: dict[str, dict]
+    profile: Optional[PipelineProfile] = None
+    stacks: Optional[collections.Counter] = None
+    # AdaptiveCompose で計測したフィルタの順序. 並列実行時は最初のチャンクのワーカーのもの
+    filter_order: Optional[list] = None
+
+    def __add__(self, other: "FilteringResult") -> "FilteringResult":
+        return FilteringResult(
+            self.stats_obj + other.stats_obj,
+            merge_cache_info([self.cache_info, other.cache_info]),
+            None if self.profile is None else self.profile + other.profile,
+            None if self.stacks is None else self.stacks + other.stacks,
+            self.filter_order or other.filter_order,
+        )
+
+    def get_statistics(self) -> dict:
+        stat = self.stats_obj.get_human_readable_values()
+        if self.cache_info:
+            stat["cache_info"] = self.cache_info
+        if self.profile is not None:
+            stat["profile"] = self.profile.get_human_readable_values()
+        if self.filter_order:
+            stat["filter_order"] = self.filter_order
+        return stat
+
+
+def create_cleaner(profile: bool = False, adaptive: bool = False, warmup_size: int = DEFAULT_WARMUP_SIZE) -> Compose:
+    """
+    `adaptive` を指定すると, 破棄のみを行うフィルタを最初の `warmup_size` 件で計測したコストと破棄率に応じて
+    並べ替える `AdaptiveCompose` を用います. 出力は変わりません.
+    """
+    kwargs = {}
+    if adaptive:
+        compose = ProfilingAdaptiveCompose if profile else AdaptiveCompose
+        kwargs["warmup_size"] = warmup_size
+    else:
+        compose = ProfilingCompose if profile else Compose
+    return compose([
+        custom_document_filters.JSONLoader(),
         document_filters.DocumentNormalizer(),
         document_filters.DiscardBBSComments(),
         document_filters.DiscardAds(),
-        document_filters.DiscardDiscriminationContentJa(),
+        custom_document_filters.DiscardDiscriminationContentJa(),
         custom_document_filters.DiscardAdultContentJa(),
         custom_tokenization.NewLineSentenceTokenizer(),
         custom_token_filters.RemoveOneword(),
@@ -23,54 +80,230 @@ def process_json_lines(lines: list[str], output_base: str, stats: list[dict]):
         custom_token_filters.RemoveDate(),
         tokenization.MergeTokens(),
         document_filters.MaskPersonalInformation(),
-        document_filters.JSONDumper(dump_reason=True),
-    ])
+        custom_document_filters.JSONDumper(dump_reason=True),
+    ], **kwargs)
+
+
+def get_cache_info(cleaner: Compose) -> dict[str, dict]:
+    """行単位のキャッシュを持つフィルタのヒット数, ミス数を返します."""
+    return {f"{idx}-{filt.name}": filt.cache.get_info() for idx, filt in enumerate(cleaner.filters)
+            if isinstance(getattr(filt, "cache", None), LineDecisionCache)}
+
+
+def __write_statistics(result: FilteringResult, output_base: str, stats: list[dict]):
+    stat = result.get_statistics()
+    with open(os.path.join(output_base, "stat.filtering.jsonl"), "w", encoding="utf8") as writer:
+        writer.write(json.dumps(stat, ensure_ascii=False) + "\n")
+    if result.stacks is not None:
+        dump_folded_stacks(result.stacks, os.path.join(output_base, "profile.filtering.folded"))
+
+    stats.append(stat)
+
+
+def process_json_lines(lines: Iterable[str], output_base: str, stats: list[dict],
+                       merged_writer: Optional[TextIO] = None, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                       cleaner: Optional[Compose] = None, sampling_profile: bool = False,
+                       checkpoint: Optional[FileCheckpoint] = None, compression: str = "none") -> FilteringResult:
+    """
+    linesを1行ずつフィルタリングし, 処理した順に結果を書き出します.
+    残った文書は `merged_writer` にも書き込むため, 処理結果をメモリに保持しません.
+    `sampling_profile` を指定すると, 処理中のコールスタックを folded 形式で書き出します.
+    `checkpoint` を指定すると, 前回のチェックポイントの続きから出力を追記し, 定期的に進捗を記録します.
+    その場合 `lines` には `ChunkReader` を渡してください.
+    `compression` には結果と除外した文書のファイルの圧縮形式を指定します.
+    """
+    if cleaner is None:
+        cleaner = create_cleaner()
 
-    with open(os.path.join(output_base, "rejected.filtering.jsonl"), "w") as rejected:
-        with open(os.path.join(output_base, "result.filtering.jsonl"), "w") as writer:
-            for line in lines:
-                result = cleaner.apply(Document(line))
-                if result.is_rejected:
-                    rejected.write(result.text + "\n")
-                else:
-                    writer.write(result.text + "\n")
-                    remained_lines.append(result.text)
+    mode = "w"
+    restored_cache_info: dict[str, dict] = {}
+    if checkpoint is not None:
+        checkpoint.prepare()
+        mode = "a"
+        restored_cache_info = checkpoint.restored_extra.get("cache_info", {})
 
-    with open(os.path.join(output_base, "stat.filtering.jsonl"), "w") as writer:
-        writer.write(json.dumps(cleaner.statistics, ensure_ascii=False) + "\n")
+    profiler = SamplingProfiler() if sampling_profile else None
+    with LineWriter(with_extension(os.path.join(output_base, "rejected.filtering.jsonl"), compression), mode,
+                    compression, buffer_size) as rejected:
+        with LineWriter(with_extension(os.path.join(output_base, "result.filtering.jsonl"), compression), mode,
+                        compression, buffer_size) as writer:
+            with profiler or contextlib.nullcontext():
+                for num_processed, line in enumerate(lines, 1):
+                    result = cleaner.apply(Document(line))
+                    if result.is_rejected:
+                        rejected.write(result.text + "\n")
+                    else:
+                        writer.write(result.text + "\n")
+                        if merged_writer is not None:
+                            merged_writer.write(result.text + "\n")
 
-    stats.append(cleaner.statistics)
+                    if checkpoint is not None and num_processed % checkpoint.interval == 0:
+                        writer.checkpoint()
+                        rejected.checkpoint()
+                        checkpoint.save(lines.position, checkpoint.add_restored_stats(cleaner.statistics_obj),
+                                        extra={"cache_info": merge_cache_info([restored_cache_info,
+                                                                               get_cache_info(cleaner)])})
 
-    return remained_lines
+    result = FilteringResult(
+        cleaner.statistics_obj,
+        get_cache_info(cleaner),
+        cleaner.profile if isinstance(cleaner, ProfilingCompose) else None,
+        None if profiler is None else profiler.stacks,
+        cleaner.get_order_info() if isinstance(cleaner, AdaptiveCompose) else None,
+    )
+    if checkpoint is not None:
+        result.stats_obj = checkpoint.add_restored_stats(result.stats_obj)
+        result.cache_info = merge_cache_info([restored_cache_info, result.cache_info])
+    __write_statistics(result, output_base, stats)
+    if checkpoint is not None:
+        checkpoint.save(lines.position, result.stats_obj, done=True, extra={"cache_info": result.cache_info})
 
+    return result
 
-def __readlines(input_file: str):
-    with open(input_file) as fp:
-        return fp.readlines()
 
+def __init_worker(profile: bool, adaptive: bool, warmup_size: int):
+    global WORKER_CLEANER
+    WORKER_CLEANER = create_cleaner(profile=profile, adaptive=adaptive, warmup_size=warmup_size)
 
-def filtering(input_dir: str, output_base: str):
+
+def __process_chunk(task: tuple[Chunk, str, int, bool, str]) -> FilteringResult:
+    chunk, chunk_output_base, buffer_size, sampling_profile, compression = task
+    os.makedirs(chunk_output_base, exist_ok=True)
+
+    # ワーカー内の Compose とキャッシュは使い回し, 統計情報はチャンクの処理前からの差分を返す
+    stats_before = copy.deepcopy(WORKER_CLEANER.statistics_obj)
+    if isinstance(WORKER_CLEANER, ProfilingCompose):
+        WORKER_CLEANER.reset_profile()
+    for filt in WORKER_CLEANER.filters:
+        if isinstance(getattr(filt, "cache", None), LineDecisionCache):
+            filt.cache.reset_info()
+
+    result = process_json_lines(iter_chunk_lines(chunk, buffer_size), chunk_output_base, [],
+                                buffer_size=buffer_size, cleaner=WORKER_CLEANER, sampling_profile=sampling_profile,
+                                compression=compression)
+    result.stats_obj = subtract_stats(result.stats_obj, stats_before)
+    return result
+
+
+def __append_file(src: str, dst, buffer_size: int):
+    with open(src, "rb") as fp:
+        shutil.copyfileobj(fp, dst, buffer_size)
+
+
+def __filtering_parallel(input_paths: list[str], output_bases: list[str], checkpoints: list[FileCheckpoint],
+                         merged_writer, num_workers: int, chunk_size: int, buffer_size: int, profile: bool = False,
+                         sampling_profile_path: Optional[str] = None, compression: str = "none",
+                         adaptive: bool = False, warmup_size: int = DEFAULT_WARMUP_SIZE):
+    """
+    入力ファイルをバイト範囲のチャンクに分割してプロセスプールで処理し,
+    チャンクごとの出力を元の順序で連結することで逐次実行と同一の出力を得ます.
+    チャンクを連結するたびにチェックポイントを記録します.
+    圧縮された出力も gzip のメンバー(zstd のフレーム)単位でそのまま連結できます.
+    """
+    result_file = with_extension("result.filtering.jsonl", compression)
+    rejected_file = with_extension("rejected.filtering.jsonl", compression)
+    tasks = []
+    for input_path, output_base_for_input, checkpoint in zip(input_paths, output_bases, checkpoints):
+        checkpoint.prepare()
+        for chunk in split_file(input_path, chunk_size, start=checkpoint.offset):
+            chunk_output_base = os.path.join(output_base_for_input, "chunks", str(chunk.index).zfill(5))
+            tasks.append((chunk, chunk_output_base, buffer_size, input_path == sampling_profile_path, compression))
+
+    file_results: list[FilteringResult] = []
+    with multiprocessing.Pool(processes=num_workers, initializer=__init_worker,
+                              initargs=(profile, adaptive, warmup_size)) as pool:
+        for task, chunk_result in zip(tasks, pool.imap(__process_chunk, tasks)):
+            chunk, chunk_output_base = task[0], task[1]
+            file_index = input_paths.index(chunk.path)
+            output_base_for_input, checkpoint = output_bases[file_index], checkpoints[file_index]
+
+            with open(os.path.join(output_base_for_input, result_file), "ab") as writer:
+                __append_file(os.path.join(chunk_output_base, result_file), writer, buffer_size)
+            with open(os.path.join(output_base_for_input, rejected_file), "ab") as rejected:
+                __append_file(os.path.join(chunk_output_base, rejected_file), rejected, buffer_size)
+            if merged_writer is not None:
+                __append_file(os.path.join(chunk_output_base, result_file), merged_writer, buffer_size)
+            shutil.rmtree(chunk_output_base)
+
+            file_results.append(chunk_result)
+            file_result = functools.reduce(lambda x, y: x + y, file_results)
+            stats_obj = checkpoint.add_restored_stats(file_result.stats_obj)
+            cache_info = merge_cache_info([checkpoint.restored_extra.get("cache_info", {}), file_result.cache_info])
+            if chunk.is_last:
+                file_result.stats_obj, file_result.cache_info = stats_obj, cache_info
+                __write_statistics(file_result, output_base_for_input, [])
+                # 圧縮されたファイルのチャンクは終端のバイト位置を持たないが, 処理済みのファイルの位置は参照されない
+                offset = checkpoint.offset if chunk.end is None else chunk.end
+                checkpoint.save(offset, stats_obj, done=True, extra={"cache_info": cache_info})
+                file_results = []
+                shutil.rmtree(os.path.join(output_base_for_input, "chunks"), ignore_errors=True)
+            else:
+                checkpoint.save(chunk.end, stats_obj, extra={"cache_info": cache_info})
+
+
+def filtering(input_dir: str, output_base: str, buffer_size: int = DEFAULT_BUFFER_SIZE, num_workers: int = 1,
+              chunk_size: int = DEFAULT_CHUNK_SIZE, profile: bool = False, sampling_profile_file: Optional[str] = None,
+              resume: bool = False, checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL, compression: str = "none",
+              adaptive: bool = False, warmup_size: int = DEFAULT_WARMUP_SIZE):
+    """
+    `input_dir` のファイル(.jsonl, .jsonl.gz, .jsonl.zst)をフィルタリングし, `output_base` に出力します.
+    出力は `compression` で指定した形式で圧縮します.
+    進捗は `output_base` のマニフェストに記録され, `resume` を指定すると処理済みのファイルを飛ばし,
+    途中のファイルはチェックポイントから再開します. その場合, 全体の結果は各ファイルの出力から作り直します.
+    """
     os.makedirs(output_base, exist_ok=True)
+    manifest = Manifest(output_base)
 
-    file_lines = {input_file: __readlines(os.path.join(input_dir, input_file))
-                  for input_file in os.listdir(input_dir) if input_file.endswith(".jsonl")}
+    input_files = sorted(input_file for input_file in os.listdir(input_dir) if is_jsonl(input_file))
+    sampling_profile_path = None if sampling_profile_file is None else os.path.join(input_dir, sampling_profile_file)
 
-    stats = []
-    for input_file, json_lines in file_lines.items():
-        input_file_prefix = os.path.splitext(os.path.basename(input_file))[0]
+    input_paths, output_bases, checkpoints, all_output_bases = [], [], [], []
+    for input_file in input_files:
+        input_file_prefix = strip_extension(os.path.basename(input_file))
         output_base_for_input: str = os.path.join(output_base, input_file_prefix)
         os.makedirs(output_base_for_input, exist_ok=True)
+        all_output_bases.append(output_base_for_input)
+
+        if resume and manifest.is_done(input_file):
+            continue
+        input_paths.append(os.path.join(input_dir, input_file))
+        output_bases.append(output_base_for_input)
+        checkpoints.append(FileCheckpoint(
+            manifest, input_file,
+            [os.path.join(output_base_for_input, with_extension("result.filtering.jsonl", compression)),
+             os.path.join(output_base_for_input, with_extension("rejected.filtering.jsonl", compression))],
+            interval=checkpoint_interval,
+        ))
 
-        lines = process_json_lines(json_lines, output_base_for_input, stats)
-        file_lines[input_file] = lines
+    # 再開時は結果の一部が既に書き込まれているため, 全体の結果は最後に各ファイルの出力から作り直す
+    merged_path = with_extension(os.path.join(output_base, "results.filtering.jsonl"), compression)
+    if num_workers > 1:
+        with (contextlib.nullcontext() if resume else open(merged_path, "wb", buffering=buffer_size)) as merged_writer:
+            __filtering_parallel(input_paths, output_bases, checkpoints, merged_writer,
+                                 num_workers=num_workers, chunk_size=chunk_size, buffer_size=buffer_size,
+                                 profile=profile, sampling_profile_path=sampling_profile_path,
+                                 compression=compression, adaptive=adaptive, warmup_size=warmup_size)
+    else:
+        with (contextlib.nullcontext() if resume
+              else LineWriter(merged_path, "w", compression, buffer_size)) as merged_writer:
+            for input_path, output_base_for_input, checkpoint in zip(input_paths, output_bases, checkpoints):
+                reader = ChunkReader(Chunk(input_path, checkpoint.offset, None), buffer_size)
+                process_json_lines(reader, output_base_for_input, [], merged_writer, buffer_size=buffer_size,
+                                   cleaner=create_cleaner(profile=profile, adaptive=adaptive, warmup_size=warmup_size),
+                                   sampling_profile=input_path == sampling_profile_path, checkpoint=checkpoint,
+                                   compression=compression)
 
-    with open(os.path.join(output_base, "results.filtering.jsonl"), "w", encoding="utf8") as writer:
-        for _, lines in file_lines.items():
-            for line in lines:
-                writer.write(line + "\n")
+    if resume:
+        # 圧縮された出力もメンバー(フレーム)単位で連結できるため, バイト列のまま連結する
+        with open(merged_path, "wb", buffering=buffer_size) as merged_writer:
+            for output_base_for_input in all_output_bases:
+                result_path = os.path.join(output_base_for_input, with_extension("result.filtering.jsonl", compression))
+                __append_file(result_path, merged_writer, buffer_size)
 
     with open(os.path.join(output_base, "stats.filtering.jsonl"), "w", encoding="utf8") as writer:
-        for stat in stats:
+        for output_base_for_input in all_output_bases:
+            with open(os.path.join(output_base_for_input, "stat.filtering.jsonl"), encoding="utf8") as fp:
+                stat = json.loads(fp.readline())
             json.dump(stat, writer, ensure_ascii=False)
             writer.write("\n")
 
@@ -81,12 +314,46 @@ def main():
                         help='The input directory containing documents to process', required=True)
     parser.add_argument('--output_dir', type=str,
                         help='The input file containing documents to process', required=False, default="./tmp/output")
+    parser.add_argument('--buffer_size', type=int,
+                        help='The I/O buffer size in bytes used for reading and writing documents',
+                        required=False, default=DEFAULT_BUFFER_SIZE)
+    parser.add_argument('--num_workers', type=int,
+                        help='The number of worker processes. Input files are split into chunks when greater than 1',
+                        required=False, default=1)
+    parser.add_argument('--chunk_size', type=int,
+                        help='The approximate size in bytes of a chunk processed by one worker task',
+                        required=False, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--profile', action='store_true',
+                        help='Record per-filter time, throughput and latency in the stats files')
+    parser.add_argument('--sampling_profile_file', type=str,
+                        help='The input file name to profile with the sampling profiler (folded stacks)',
+                        required=False, default=None)
+    parser.add_argument('--resume', type=str,
+                        help='The output base of an interrupted run to resume', required=False, default=None)
+    parser.add_argument('--checkpoint_interval', type=int,
+                        help='The number of documents between checkpoints', required=False,
+                        default=DEFAULT_CHECKPOINT_INTERVAL)
+    parser.add_argument('--compression', type=str, choices=COMPRESSIONS,
+                        help='The compression format of the result, rejected and merged files',
+                        required=False, default="none")
+    parser.add_argument('--adaptive_order', action='store_true',
+                        help='Reorder reject-only filters by the cost and rejection rate measured on a warm-up sample')
+    parser.add_argument('--warmup_size', type=int,
+                        help='The number of documents used to measure the filters for --adaptive_order',
+                        required=False, default=DEFAULT_WARMUP_SIZE)
     args = parser.parse_args()
 
-    start = datetime.now()
-    output_base = os.path.join(args.output_dir, start.strftime("%Y%m%d%H%M%S"))
+    if args.resume:
+        output_base = args.resume
+    else:
+        start = datetime.now()
+        output_base = os.path.join(args.output_dir, start.strftime("%Y%m%d%H%M%S"))
 
-    filtering(input_dir=args.input_dir, output_base=output_base)
+    filtering(input_dir=args.input_dir, output_base=output_base, buffer_size=args.buffer_size,
+              num_workers=args.num_workers, chunk_size=args.chunk_size, profile=args.profile,
+              sampling_profile_file=args.sampling_profile_file, resume=args.resume is not None,
+              checkpoint_interval=args.checkpoint_interval, compression=args.compression,
+              adaptive=args.adaptive_order, warmup_size=args.warmup_size)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+"""
+文書を破棄するだけのフィルタの順序を, 処理コストと破棄率に応じて入れ替える Compose です.
+
+連続して並んだ破棄のみを行うフィルタ(グループ)について, 最初の `warmup_size` 件の文書で
+フィルタごとの処理時間と破棄率を計測し, 以降は文書1件あたりの期待コストが最小になる順序で適用します.
+text を書き換えるフィルタの位置は変えません.
+
+どのフィルタで破棄されたか(`reject_reason` と統計情報)が元の順序で処理した場合と一致するように,
+あるフィルタで破棄された場合は, 元の順序でそれより前にあるまだ適用していないフィルタも適用します.
+そのため出力は元の順序で処理した場合と同一になります.
+"""
+import dataclasses
+import time
+from typing import Any, List, Optional, Union
+
+from hojichar import Compose, Document, Filter, StatsContainer, TokenFilter, document_filters
+
+from preprocessing.filtering import custom_document_filters
+from preprocessing.profiling import ProfilingCompose
+
+DEFAULT_WARMUP_SIZE = 1000
+
+# text を書き換えず, 文書の破棄のみを行うフィルタ. 互いに独立しているため, 適用する順序を入れ替えても判定は変わらない
+REJECT_ONLY_FILTERS = (
+    document_filters.AcceptJapanese,
+    document_filters.DiscardAds,
+    document_filters.DiscardBBSComments,
+    document_filters.DiscardRareKuten,
+    document_filters.DocumentLengthFilter,
+    document_filters.NgWordsFilterEn,
+    document_filters.NgWordsFilterJa,
+    custom_document_filters.AhoCorasickNgWordsFilterJa,
+)
+
+
+@dataclasses.dataclass
+class FilterCost:
+    index: int
+    name: str
+    evaluated_num: int = 0
+    rejected_num: int = 0
+    time_ns: int = 0
+
+    def sort_key(self) -> tuple:
+        """
+        独立なフィルタの期待コストは, 平均処理時間 / 破棄率 の昇順に並べると最小になります.
+        1件も破棄しなかったフィルタは最後に, 処理時間の短い順に並べます.
+        """
+        if self.rejected_num == 0:
+            return (1, self.time_ns / max(self.evaluated_num, 1), self.index)
+        return (0, self.time_ns / self.rejected_num, self.index)
+
+    def get_human_readable_values(self) -> dict:
+        return {
+            "name": self.name,
+            "mean_time_ms": self.time_ns / max(self.evaluated_num, 1) / 10**6,
+            "reject_rate": self.rejected_num / max(self.evaluated_num, 1),
+        }
+
+
+@dataclasses.dataclass
+class FilterGroup:
+    """`start` から `end` の手前までの, 順序を入れ替えられるフィルタの並びです."""
+    start: int
+    end: int
+    costs: list[FilterCost]
+    warmup_num: int = 0
+    # 計測が終わるまでは None
+    order: Optional[list[int]] = None
+
+
+@dataclasses.dataclass
+class LayerState:
+    """フィルタを適用した後の文書の状態です. hojichar の `Compose` が統計情報を集計する際に用いる値と同じものです."""
+    is_rejected: bool
+    bytes: int
+    time_ns: int
+
+    @classmethod
+    def of(cls, document: Document) -> "LayerState":
+        return cls(document.is_rejected, len(document.text.encode("utf-8")), time.perf_counter_ns())
+
+
+def record_statistics(stats_obj: StatsContainer, document: Document, before: LayerState,
+                      states: list[LayerState]) -> None:
+    """
+    `Compose.apply` と同じ規則で, 文書の処理結果を `stats_obj` に加算します.
+    `states` には各フィルタを適用した後の文書の状態を, `stats_obj` のフィルタと同じ順序で渡してください.
+    """
+    previous = before
+    for layer, state in zip(stats_obj.layers_info.values(), states):
+        if (not previous.is_rejected) and state.is_rejected:
+            layer.discard_num += 1
+            layer.diff_bytes -= state.bytes
+        elif not (previous.is_rejected and state.is_rejected):
+            layer.diff_bytes += state.bytes - previous.bytes
+        layer.cumulative_time_ns += state.time_ns - previous.time_ns
+        previous = state
+
+    total = stats_obj.total_info
+    total.processed_num += 1
+    total.discard_num += 1 if any(state.is_rejected for state in states) else 0
+    total.input_bytes += len(document.original.encode("utf-8"))
+    total.output_bytes += 0 if document.is_rejected else len(document.text.encode("utf-8"))
+    # hojichar と同様に, 最初のフィルタを適用した後からの時間を加算する
+    total.cumulative_time_ns += states[-1].time_ns - states[0].time_ns
+    total.total_token_num += len(document.tokens)
+
+
+class AdaptiveCompose(Compose):
+    """
+    破棄のみを行うフィルタの順序を, 計測した処理コストと破棄率に応じて入れ替える Compose です.
+    また, 破棄された文書には `skip_rejected` のフィルタを適用せず, 文書の計測も省略します.
+    """
+
+    def __init__(self, filters: List[Union[Filter, TokenFilter]], *args: Any,
+                 warmup_size: int = DEFAULT_WARMUP_SIZE, **kwargs: Any) -> None:
+        super().__init__(filters, *args, **kwargs)
+        self.warmup_size = warmup_size
+        self.groups: dict[int, FilterGroup] = {}
+
+        start = 0
+        while start < len(self.filters):
+            end = start
+            while end < len(self.filters) and self.is_reorderable(self.filters[end]):
+                end += 1
+            if end - start >= 2:
+                self.groups[start] = FilterGroup(
+                    start, end, [FilterCost(idx, f"{idx}-{self.filters[idx].name}") for idx in range(start, end)])
+            start = end + 1
+
+    @staticmethod
+    def is_reorderable(filt: Union[Filter, TokenFilter]) -> bool:
+        return isinstance(filt, REJECT_ONLY_FILTERS) and filt.p == 1 and filt.skip_rejected
+
+    def get_order_info(self) -> list[list[dict]]:
+        """グループごとに, 現在の適用順でフィルタの計測結果を返します."""
+        info = []
+        for group in self.groups.values():
+            order = group.order or list(range(group.start, group.end))
+            info.append([group.costs[idx - group.start].get_human_readable_values() for idx in order])
+        return info
+
+    def _apply_and_measure(self, idx: int, document: Document, elapsed: dict[int, int]) -> bool:
+        """フィルタを適用して処理時間を記録し, 文書を破棄したかどうかを返します."""
+        document.is_rejected = False
+        start = time.perf_counter_ns()
+        document = self._apply_filter(self.filters[idx], document)
+        elapsed[idx] = time.perf_counter_ns() - start
+        return document.is_rejected
+
+    def _apply_group(self, group: FilterGroup, document: Document, previous: LayerState
+                     ) -> tuple[Document, list[LayerState]]:
+        elapsed = {idx: 0 for idx in range(group.start, group.end)}
+        rejected_at: Optional[int] = None
+
+        if group.order is None:
+            # 計測中は全てのフィルタを元の順序で適用する
+            for cost in group.costs:
+                is_rejected = self._apply_and_measure(cost.index, document, elapsed)
+                cost.evaluated_num += 1
+                cost.time_ns += elapsed[cost.index]
+                if is_rejected:
+                    cost.rejected_num += 1
+                    if rejected_at is None:
+                        rejected_at = cost.index
+            group.warmup_num += 1
+            if group.warmup_num >= self.warmup_size:
+                group.order = [cost.index for cost in sorted(group.costs, key=FilterCost.sort_key)]
+        else:
+            applied = set()
+            for idx in group.order:
+                applied.add(idx)
+                if self._apply_and_measure(idx, document, elapsed):
+                    # 元の順序で前にあるフィルタのうち, 最初に破棄したものを破棄の理由とする
+                    rejected_at = idx
+                    for previous_idx in range(group.start, idx):
+                        if previous_idx not in applied and self._apply_and_measure(previous_idx, document, elapsed):
+                            rejected_at = previous_idx
+                            break
+                    break
+
+        document.is_rejected = rejected_at is not None
+        if rejected_at is not None:
+            document.reject_reason = self.filters[rejected_at].get_jsonalbe_vars(exclude_keys={"skip_rejected"})
+
+        # 統計情報が元の順序で処理した場合と同じになるように, 元の順序で各フィルタの後の状態を並べる
+        states = []
+        time_ns = previous.time_ns
+        for idx in range(group.start, group.end):
+            time_ns += elapsed[idx]
+            states.append(LayerState(rejected_at is not None and idx >= rejected_at, previous.bytes, time_ns))
+        return document, states
+
+    def apply(self, document: Document) -> Document:
+        before = LayerState.of(document)
+        previous = before
+        states: list[LayerState] = []
+        idx = 0
+        while idx < len(self.filters):
+            group = self.groups.get(idx)
+            if group is not None and not document.is_rejected:
+                document, group_states = self._apply_group(group, document, previous)
+                states.extend(group_states)
+                previous = states[-1]
+                idx = group.end
+                continue
+
+            filt = self.filters[idx]
+            if document.is_rejected and filt.skip_rejected:
+                # 破棄された文書はこれ以上変化しないため, 計測を省略する
+                state = LayerState(True, previous.bytes, previous.time_ns)
+            else:
+                document = self._apply_filter(filt, document)
+                state = LayerState.of(document)
+                if (not previous.is_rejected) and state.is_rejected:
+                    document.reject_reason = filt.get_jsonalbe_vars(exclude_keys={"skip_rejected"})
+            states.append(state)
+            previous = state
+            idx += 1
+
+        record_statistics(self.statistics_obj, document, before, states)
+        return document
+
+
+class ProfilingAdaptiveCompose(ProfilingCompose, AdaptiveCompose):
+    """フィルタごとの処理時間などを記録する `AdaptiveCompose` です."""
@@ -1,14 +1,95 @@
-from hojichar import document_filters, Document
-from fugashi import Tagger
+from hojichar import Filter, document_filters, Document
 
 from os import PathLike
 from typing import Any, Union
-import re
 
-tagger = Tagger('-Owakati')
+from preprocessing import json_codec
+from preprocessing.filtering import morphology
+from preprocessing.filtering.keyword_matcher import KeywordMatcher
 
 
-class DiscardAdultContentJa(document_filters.NgWordsFilterJa):
+class JSONLoader(document_filters.JSONLoader):
+    """
+    `hojichar.document_filters.JSONLoader` と同様に `key` の要素を document に格納します.
+    それ以外の要素は元の JSON の文字列のまま `document.json_prefix`, `document.json_suffix` に保持し,
+    `JSONDumper` で書き戻します.
+    """
+
+    def apply(self, document: Document) -> Document:
+        try:
+            text, document.json_prefix, document.json_suffix = json_codec.split_text(document.text, self.key)
+            document.text = str(text)
+        except Exception as e:
+            if self.ignore:
+                document.is_rejected = True
+                return document
+            else:
+                raise e
+
+        return document
+
+
+class JSONDumper(document_filters.JSONDumper):
+    """
+    `hojichar.document_filters.JSONDumper` と同様に Document.text を json に変換します.
+    `JSONLoader` で読み込んだ文書は, `text` 以外の要素(`url`, `timestamp` など)を元の文字列のまま出力します.
+    """
+
+    def apply(self, document: Document) -> Document:
+        extra = None
+        if self.dump_reason:
+            extra = [
+                ("is_rejected", "true" if document.is_rejected else "false"),
+                ("reason", json_codec.encode(document.reject_reason) if document.reject_reason else "{}"),
+            ]
+        document.text = json_codec.join_text(document.text, getattr(document, "json_prefix", '{"text": '),
+                                             getattr(document, "json_suffix", "}"), extra=extra)
+        return document
+
+
+class AhoCorasickNgWordsFilterJa(Filter):
+    """
+    `hojichar.document_filters.NgWordsFilterJa` と同じ判定を, Aho-Corasick 法の
+    `KeywordMatcher` で行います. 辞書が大きくなっても文書を1回走査するだけで判定できます.
+    `ignore_confused` には対応していません.
+    """
+
+    def __init__(
+        self,
+        dict_path: Union[str, PathLike],
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.matcher = KeywordMatcher.from_file(dict_path)
+
+    def apply(self, doc: Document) -> Document:
+        match = self.matcher.search(doc.text)
+        if match:
+            start, end = match
+            doc.is_rejected = True
+            self.matched_text = doc.text[start:end]
+            self.matched_text_neighbor = doc.text[start - 20:end + 20]
+
+        return doc
+
+
+class DiscardDiscriminationContentJa(AhoCorasickNgWordsFilterJa):
+    """
+    `hojichar.document_filters.DiscardDiscriminationContentJa` の KeywordMatcher 版です.
+    日本語の差別キーワード(および不適切語)を含む文書を破棄します.
+    """
+
+    def __init__(
+        self,
+        dict_path: Union[str, PathLike] = document_filters.BASE_PATH / "dict/discrimination_keywords_ja.txt",
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(dict_path, *args, **kwargs)
+
+
+class DiscardAdultContentJa(AhoCorasickNgWordsFilterJa):
     """
     TokenFilter の実装例です.
     日本語の成人向けコンテンツを閾値に応じて排除します.
@@ -25,10 +106,11 @@ class DiscardAdultContentJa(document_filters.NgWordsFilterJa):
         self.threshold = threshold
 
     def apply(self, doc: Document) -> Document:
-        adult_keywords_pattern = self.keyword_pat
-        matches = re.findall(adult_keywords_pattern, doc.text)
-        adult_content_count = len(matches)
-        total_words_count = len(tagger.parse(doc.text).split())
+        adult_content_count = self.matcher.count(doc.text)
+        if adult_content_count == 0:
+            return doc
+
+        total_words_count = len(morphology.wakati_document(doc))
 
         if total_words_count > 0 and adult_content_count / total_words_count > self.threshold:
             doc.is_rejected = True
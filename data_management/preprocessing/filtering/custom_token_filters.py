@@ -1,26 +1,37 @@
 from hojichar import TokenFilter, Token
-from fugashi import Tagger
+from typing import Optional
 import re
 
-tagger = Tagger('-Owakati')
+from preprocessing.filtering import morphology
+from preprocessing.filtering.line_cache import DEFAULT_CACHE_SIZE, LineDecisionCache
 
 
 class RemoveDate(TokenFilter):
     """
     TokenFilter の実装例です.
     日付のみのパターンを削除
+    `cache_size` を指定すると, 判定結果を文書をまたいでキャッシュします. None の場合はキャッシュしません.
     """
 
-    def __init__(self, date_pattern: re.Pattern = None, *args, **kwargs):
+    def __init__(self, date_pattern: re.Pattern = None, cache_size: Optional[int] = DEFAULT_CACHE_SIZE,
+                 *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.date_pattern = self._date_pattern() if date_pattern is None else date_pattern
+        self.cache_size = cache_size
+        self.cache = None if cache_size is None else LineDecisionCache(cache_size)
 
     def _date_pattern(self) -> str:
         return re.compile(r'^(\d{2,4}([-年/])\d{1,2}([-月/])\d{1,2}日?)|(\d{2,4}([-年/])\d{1,2}([-月])?)|(\d{1,2}([-月/])\d{1,2}日?)$')
 
     def apply(self, token: Token) -> Token:
         text = token.text
-        if self.date_pattern.match(text):
+        is_date = self.cache.get(text) if self.cache is not None else None
+        if is_date is None:
+            is_date = self.date_pattern.match(text) is not None
+            if self.cache is not None:
+                self.cache.put(text, is_date)
+
+        if is_date:
             token.is_rejected = True
 
         return token
@@ -30,12 +41,44 @@ class RemoveOneword(TokenFilter):
     """
     TokenFilter の実装例です.
     1単語のみのパターンを削除
+    `cache_size` を指定すると, 判定結果を文書をまたいでキャッシュします. None の場合はキャッシュしません.
+    空白を除いて1文字以下の行や, 空白で区切られた行は形態素解析をせずに判定します.
+    `min_length_to_keep` を指定すると, その文字数以上の行も形態素解析をせずに残します.
     """
 
+    def __init__(self, cache_size: Optional[int] = DEFAULT_CACHE_SIZE, min_length_to_keep: Optional[int] = None,
+                 *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_size = cache_size
+        self.min_length_to_keep = min_length_to_keep
+        self.cache = None if cache_size is None else LineDecisionCache(cache_size)
+
+    def _precheck(self, text: str) -> Optional[bool]:
+        """形態素解析をせずに判定できる場合は破棄するかどうかを返します."""
+        stripped = text.strip()
+        if len(stripped) <= 1:
+            return True
+        # MeCab は空白をまたいで単語を作らないため, 空白で区切られた行は2単語以上になる
+        if len(stripped.split(maxsplit=1)) > 1:
+            return False
+        if self.min_length_to_keep is not None and len(stripped) >= self.min_length_to_keep:
+            return False
+        return None
+
+    def _is_oneword(self, text: str) -> bool:
+        is_oneword = self._precheck(text)
+        if is_oneword is not None:
+            return is_oneword
+
+        is_oneword = self.cache.get(text) if self.cache is not None else None
+        if is_oneword is None:
+            is_oneword = len(morphology.wakati(text)) <= 1
+            if self.cache is not None:
+                self.cache.put(text, is_oneword)
+        return is_oneword
+
     def apply(self, token: Token) -> Token:
-        text = token.text
-        word_count = len(tagger.parse(text).split())
-        if word_count <= 1:
+        if self._is_oneword(token.text):
             token.is_rejected = True
 
         return token
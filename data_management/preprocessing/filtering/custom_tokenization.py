@@ -1,7 +1,6 @@
 from hojichar import Filter, Document
-from fugashi import Tagger
 
-tagger = Tagger('-Owakati')
+from preprocessing.filtering import morphology
 
 
 class WakatiTokenizer(Filter):
@@ -11,7 +10,7 @@ class WakatiTokenizer(Filter):
     """
 
     def apply(self, document: Document) -> Document:
-        tokens = self.tokenize(document.text)
+        tokens = morphology.wakati_document(document)
         document.set_tokens(tokens)
         return document
 
@@ -20,7 +19,7 @@ class WakatiTokenizer(Filter):
         >>> WakatiTokenizer().tokenize("おはよう。おやすみ。ありがとう。さよなら。")
         ['おはよう。', 'おやすみ。', 'ありがとう。', 'さよなら。']
         """
-        return tagger.parse(text).split()
+        return morphology.wakati(text)
 
 
 class NewLineSentenceTokenizer(Filter):
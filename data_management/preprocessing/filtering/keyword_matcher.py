@@ -0,0 +1,117 @@
+"""
+Aho-Corasick 法によるキーワード照合エンジンです.
+
+辞書からオートマトンを一度だけ構築し, 文書を1回走査するだけで全キーワードの出現を検出します.
+照合結果は, キーワードを辞書順に `|` で連結した正規表現と同じになるように調整しています.
+(同じ開始位置で複数のキーワードが一致する場合は辞書で先に現れるものを採用し, 一致箇所は重ならない)
+そのため `re.findall(keyword_pat, text)` や `keyword_pat.search(text)` の置き換えとして利用できます.
+"""
+from collections import deque
+from os import PathLike
+from typing import Iterable, Iterator, Optional, Union
+
+
+class KeywordMatcher:
+    """
+    >>> matcher = KeywordMatcher(["he", "she", "his", "hers"])
+    >>> matcher.findall("ushers")
+    ['she']
+    >>> matcher.count("he said his hers")
+    3
+    >>> matcher.search("ushers")
+    (1, 4)
+    """
+
+    def __init__(self, keywords: Iterable[str]) -> None:
+        # 辞書順の優先度. 重複したキーワードは先に現れたものを優先する
+        self.keywords: list[str] = []
+        priorities: dict[str, int] = {}
+        for keyword in keywords:
+            if keyword and keyword not in priorities:
+                priorities[keyword] = len(self.keywords)
+                self.keywords.append(keyword)
+        self._max_length = max((len(keyword) for keyword in self.keywords), default=0)
+
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # 各ノードで一致するキーワードの (優先度, 長さ). 失敗遷移先の出力も含める
+        self._outputs: list[tuple[tuple[int, int], ...]] = [()]
+
+        for keyword, priority in priorities.items():
+            node = 0
+            for ch in keyword:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][ch] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._outputs.append(())
+                node = next_node
+            self._outputs[node] = ((priority, len(keyword)),)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[next_node] = fail
+                self._outputs[next_node] = self._outputs[next_node] + self._outputs[fail]
+
+    @classmethod
+    def from_file(cls, dict_path: Union[str, PathLike]) -> "KeywordMatcher":
+        """
+        単語が改行で羅列された辞書ファイルから構築します.
+        読み込み方は `hojichar.document_filters.NgWordsFilterJa` と同じです.
+        """
+        with open(dict_path, encoding="utf-8") as fp:
+            keywords = fp.read().split("\n")
+        return cls(w.strip() for w in keywords if not len(w) == 0)
+
+    def _iter_all(self, text: str) -> Iterator[tuple[int, int, int]]:
+        """重なりを含むすべての一致を (終了位置, 優先度, 長さ) として返します."""
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for priority, length in outputs[node]:
+                yield i + 1, priority, length
+
+    def finditer(self, text: str) -> Iterator[tuple[int, int]]:
+        """正規表現と同じく左から重ならないように一致箇所を選び, (開始位置, 終了位置) を返します."""
+        best: dict[int, tuple[int, int]] = {}
+        for end, priority, length in self._iter_all(text):
+            start = end - length
+            current = best.get(start)
+            if current is None or priority < current[0]:
+                best[start] = (priority, length)
+
+        position = 0
+        for start in sorted(best):
+            if start >= position:
+                position = start + best[start][1]
+                yield start, position
+
+    def findall(self, text: str) -> list[str]:
+        return [text[start:end] for start, end in self.finditer(text)]
+
+    def count(self, text: str) -> int:
+        return sum(1 for _ in self.finditer(text))
+
+    def search(self, text: str) -> Optional[tuple[int, int]]:
+        """最も左の一致箇所を (開始位置, 終了位置) で返します. 一致しない場合は None を返します."""
+        best: Optional[tuple[int, int, int]] = None
+        for end, priority, length in self._iter_all(text):
+            start = end - length
+            if best is None or (start, priority) < best[:2]:
+                best = (start, priority, end)
+            elif end - self._max_length > best[0]:
+                # これ以降に見つかる一致は必ず best より右から始まる
+                break
+        return None if best is None else (best[0], best[2])
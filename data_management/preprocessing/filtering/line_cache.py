@@ -0,0 +1,71 @@
+"""
+行単位の判定結果を文書をまたいで再利用するためのキャッシュです.
+
+Web テキストにはメニューやフッター, 日付などの同じ行が繰り返し現れるため,
+トークンフィルタの破棄/保持の判定を行のハッシュ値をキーとして LRU 方式で保持します.
+"""
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_CACHE_SIZE = 1024 * 1024
+
+
+class LineDecisionCache:
+    """
+    >>> cache = LineDecisionCache(maxsize=2)
+    >>> cache.get("ホーム") is None
+    True
+    >>> cache.put("ホーム", True)
+    >>> cache.get("ホーム")
+    True
+    >>> cache.get_info()
+    {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 2}
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE) -> None:
+        if maxsize <= 0:
+            raise ValueError("maxsize must be greater than 0")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._decisions: OrderedDict[int, bool] = OrderedDict()
+
+    def get(self, text: str) -> Optional[bool]:
+        """キャッシュ済みであれば破棄するかどうかを返し, 未登録であれば None を返します."""
+        key = hash(text)
+        decision = self._decisions.get(key)
+        if decision is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._decisions.move_to_end(key)
+        return decision
+
+    def put(self, text: str, is_rejected: bool) -> None:
+        key = hash(text)
+        self._decisions[key] = is_rejected
+        self._decisions.move_to_end(key)
+        if len(self._decisions) > self.maxsize:
+            self._decisions.popitem(last=False)
+
+    def get_info(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._decisions), "maxsize": self.maxsize}
+
+    def reset_info(self) -> None:
+        """ヒット数とミス数のみを初期化します. キャッシュの内容は保持されます."""
+        self.hits = 0
+        self.misses = 0
+
+
+def merge_cache_info(infos: list[dict[str, dict]]) -> dict[str, dict]:
+    """フィルタごとのキャッシュ情報を, ヒット数とミス数を合計して1つにまとめます."""
+    merged: dict[str, dict] = {}
+    for info in infos:
+        for name, values in info.items():
+            if name not in merged:
+                merged[name] = dict(values)
+            else:
+                merged[name]["hits"] += values["hits"]
+                merged[name]["misses"] += values["misses"]
+                merged[name]["size"] = max(merged[name]["size"], values["size"])
+    return merged
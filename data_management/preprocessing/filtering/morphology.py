@@ -0,0 +1,53 @@
+"""
+fugashi による形態素解析をフィルタ間で共有するためのモジュールです.
+
+タガーはプロセスごとに1つだけ, 最初に使われた時点で生成されます.
+Document に対する解析結果は `Document.wakati_cache` にテキストをキーとして保持され,
+後段のフィルタでテキストが変わっていなければ再利用されます.
+"""
+import os
+from typing import Optional
+
+from fugashi import Tagger
+from hojichar import Document
+
+_tagger: Optional[Tagger] = None
+_tagger_pid: Optional[int] = None
+
+
+def get_tagger() -> Tagger:
+    """プロセスごとに1つのタガーを返します. fork された子プロセスでは新たに生成します."""
+    global _tagger, _tagger_pid
+    if _tagger is None or _tagger_pid != os.getpid():
+        _tagger = Tagger('-Owakati')
+        _tagger_pid = os.getpid()
+    return _tagger
+
+
+def wakati(text: str) -> list[str]:
+    """
+    >>> wakati("東京に行く。")
+    ['東京', 'に', '行く', '。']
+    """
+    return get_tagger().parse(text).split()
+
+
+def wakati_document(doc: Document, text: Optional[str] = None) -> list[str]:
+    """
+    Document に保持した解析結果を再利用して `text` を分かち書きします.
+    `text` を省略した場合は `doc.text` を解析します.
+    返り値のリストは共有されるため, 変更しないでください.
+    """
+    if text is None:
+        text = doc.text
+
+    cache: Optional[dict[str, list[str]]] = getattr(doc, "wakati_cache", None)
+    if cache is None:
+        cache = {}
+        doc.wakati_cache = cache
+
+    words = cache.get(text)
+    if words is None:
+        words = wakati(text)
+        cache[text] = words
+    return words
@@ -0,0 +1,196 @@
+"""
+JSONL の1行を読み書きするためのユーティリティです.
+
+`loads`, `dumps` は orjson がインストールされていればそれを用い, なければ標準ライブラリの json を用います.
+orjson が扱えない入力(NaN や 64 ビットを超える整数, サロゲート文字など)は標準ライブラリで処理するため,
+どちらを用いても結果は変わりません.
+
+`split_text` は `text` の値と, その前後の元の文字列を返します.
+`join_text` と組み合わせることで, `url` や `timestamp` などを再シリアライズせずに `text` だけを書き換えられます.
+"""
+import json
+import re
+from json.decoder import JSONDecodeError, scanstring
+from json.encoder import encode_basestring
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_DECODER = json.JSONDecoder()
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_WHITESPACE_CHARS = " \t\n\r"
+
+
+def loads(text: str) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def dumps(obj: Any) -> str:
+    """
+    区切り文字の後に空白を入れない形式で出力します.
+
+    >>> dumps({"title": "東京", "id": 1})
+    '{"title":"東京","id":1}'
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode(obj: Any) -> str:
+    """
+    `json.dumps(obj, ensure_ascii=False)` と同じ形式で出力します. エンコーダーを呼び出しごとに作り直しません.
+
+    >>> encode({"name": "RemoveDate", "p": 1})
+    '{"name": "RemoveDate", "p": 1}'
+    """
+    return _ENCODER.encode(obj)
+
+
+def dumps_string(text: str) -> str:
+    """
+    文字列を JSON の文字列として出力します. `json.dumps(text, ensure_ascii=False)` と同じ結果になります.
+    str のまま出力できるため, bytes を返す orjson よりも速く変換できます.
+
+    >>> dumps_string('改行\\nと"引用符"')
+    '"改行\\\\nと\\\\"引用符\\\\""'
+    """
+    return encode_basestring(text)
+
+
+def _skip_whitespace(line: str, idx: int) -> int:
+    if line[idx:idx + 1] in _WHITESPACE_CHARS:
+        return _WHITESPACE.match(line, idx).end()
+    return idx
+
+
+def _scan_members(line: str) -> list[tuple[str, Any, int, int, int]]:
+    """
+    JSON オブジェクトの各フィールドの (名前, 値, フィールドの開始位置, 値の開始位置, 値の終了位置) を返します.
+    JSON オブジェクトとして不正な場合は `json.JSONDecodeError` を送出します.
+    """
+    members = []
+    idx = _skip_whitespace(line, 0)
+    if line[idx:idx + 1] != "{":
+        raise JSONDecodeError("Expecting '{'", line, idx)
+    idx = _skip_whitespace(line, idx + 1)
+    if line[idx:idx + 1] == "}":
+        idx += 1
+    else:
+        while True:
+            if line[idx:idx + 1] != '"':
+                raise JSONDecodeError("Expecting property name enclosed in double quotes", line, idx)
+            member_start = idx
+            name, idx = scanstring(line, idx + 1)
+            idx = _skip_whitespace(line, idx)
+            if line[idx:idx + 1] != ":":
+                raise JSONDecodeError("Expecting ':' delimiter", line, idx)
+            value_start = _skip_whitespace(line, idx + 1)
+            value, idx = _DECODER.raw_decode(line, value_start)
+            members.append((name, value, member_start, value_start, idx))
+
+            idx = _skip_whitespace(line, idx)
+            delimiter = line[idx:idx + 1]
+            if delimiter == "}":
+                idx += 1
+                break
+            if delimiter != ",":
+                raise JSONDecodeError("Expecting ',' delimiter", line, idx)
+            idx = _skip_whitespace(line, idx + 1)
+
+    if _skip_whitespace(line, idx) != len(line):
+        raise JSONDecodeError("Extra data", line, idx)
+    return members
+
+
+def split_text(line: str, key: str = "text") -> tuple[Any, str, str]:
+    """
+    JSON オブジェクトの `key` の値と, その値の前後の元の文字列を返します.
+    JSON として不正な場合は `json.JSONDecodeError` を, `key` が存在しない場合は `KeyError` を送出します.
+    行の前後の空白や改行は取り除きます.
+
+    >>> split_text('{"text": "本文", "url": "https://example.com/"}\\n')
+    ('本文', '{"text": ', ', "url": "https://example.com/"}')
+    """
+    if line[:1] in _WHITESPACE_CHARS:
+        line = line.lstrip(_WHITESPACE_CHARS)
+    # よくある `key` が先頭にある形式は, 値を C 実装の scanstring で読み, 残りのフィールドだけを検証する
+    quoted_key = '"' + key + '"'
+    if line.startswith(quoted_key, 1) and line[:1] == "{":
+        head = len(quoted_key) + 1
+        if line.startswith(': "', head):
+            head += 3
+        elif line.startswith(':"', head):
+            head += 2
+        else:
+            head = 0
+        if head:
+            value, end = scanstring(line, head)
+            rest = line[end:].rstrip(_WHITESPACE_CHARS)
+            if rest == "}":
+                return value, line[:head - 1], rest
+            if rest[:1] == "," and quoted_key not in rest:
+                try:
+                    if loads("{" + rest[1:]):
+                        return value, line[:head - 1], rest
+                except JSONDecodeError:
+                    pass
+
+    line = line.rstrip(_WHITESPACE_CHARS)
+    members = _scan_members(line)
+    for name, value, _, value_start, value_end in reversed(members):
+        if name == key:
+            return value, line[:value_start], line[value_end:]
+    raise KeyError(key)
+
+
+def join_text(text: str, prefix: str = '{"text": ', suffix: str = "}",
+              extra: Optional[list[tuple[str, str]]] = None) -> str:
+    """
+    `split_text` で分割した前後の文字列の間に `text` を書き込みます.
+    `extra` には末尾に追加するフィールドを (名前, JSON の値) の組で指定します.
+    `extra` と同じ名前のフィールドが既にある場合は取り除きます.
+
+    >>> join_text("新しい本文", '{"text": ', ', "url": "https://example.com/"}', extra=[("is_rejected", "false")])
+    '{"text": "新しい本文", "url": "https://example.com/", "is_rejected": false}'
+    """
+    if not extra:
+        return prefix + dumps_string(text) + suffix
+
+    added = []
+    duplicated = False
+    for name, value in extra:
+        quoted_name = dumps_string(name)
+        duplicated = duplicated or quoted_name in suffix or quoted_name in prefix
+        added.append(quoted_name + ": " + value)
+    if not duplicated:
+        return "".join((prefix, dumps_string(text), suffix[:-1], ", ", ", ".join(added), "}"))
+
+    line = prefix + dumps_string(text) + suffix
+    excluded = {name for name, _ in extra}
+    kept = [line[member_start:value_end]
+            for name, _, member_start, _, value_end in _scan_members(line) if name not in excluded]
+    return "{" + ", ".join(kept + added) + "}"
+
+
+def rewrite_text(line: str, key: str = "text") -> str:
+    """
+    `key` の値だけを再シリアライズし, 他のフィールドは元の文字列のまま残します.
+
+    >>> rewrite_text('{"text":"\\\\u6771\\\\u4eac","url":"https://example.com/"}')
+    '{"text":"東京","url":"https://example.com/"}'
+    """
+    text, prefix, suffix = split_text(line, key)
+    return join_text(text, prefix, suffix)
@@ -0,0 +1,106 @@
+"""
+filtering, dedup の出力などの複数の JSONL を, 一定の文書数またはバイト数のシャードにまとめます.
+シャードは個別に読み込めるため, 後段のトークナイズを並列に実行できます.
+`--shuffle` を指定すると全体をシードから再現できる順序でシャッフルします.
+
+$ python -m preprocessing.merge --inputs dataset/wikipedia tmp/output/20240301000000/results.dedup.jsonl \
+    --output_dir dataset/merged --max_bytes 1073741824 --shuffle --seed 1234
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from preprocessing.compression import COMPRESSIONS
+from preprocessing.merge.shards import (DEFAULT_BUCKET_SIZE, DEFAULT_MAX_BYTES, DEFAULT_SCATTER_BUFFER_SIZE,
+                                        ShardWriter, iter_lines, list_input_files, remove_shards, scatter,
+                                        shuffle_bucket)
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+def merge(inputs: list[str], output_dir: str, max_documents: int = 0, max_bytes: int = DEFAULT_MAX_BYTES,
+          shuffle: bool = False, seed: int = 0, bucket_size: int = DEFAULT_BUCKET_SIZE,
+          scatter_buffer_size: int = DEFAULT_SCATTER_BUFFER_SIZE, compression: str = "none",
+          buffer_size: int = DEFAULT_BUFFER_SIZE, tmp_dir: Optional[str] = None) -> list[dict]:
+    """
+    `inputs` のファイル(ディレクトリの場合は直下の JSONL ファイル)の行を `output_dir` のシャードに書き出し,
+    シャードごとの文書数とバイト数を `stats.merge.jsonl` に記録します.
+    シャッフルする場合は, 入力の合計サイズを `bucket_size` で割った数のバケツを `tmp_dir` に作ります.
+    """
+    paths = list_input_files(inputs)
+    os.makedirs(output_dir, exist_ok=True)
+    remove_shards(output_dir)
+
+    with ShardWriter(output_dir, max_documents, max_bytes, compression, buffer_size) as writer:
+        if shuffle:
+            rng = np.random.default_rng(seed)
+            num_buckets = max(1, math.ceil(sum(os.path.getsize(path) for path in paths) / bucket_size))
+            bucket_dir = tempfile.mkdtemp(prefix="merge-", dir=tmp_dir or output_dir)
+            try:
+                logging.info(f"Scattering {len(paths)} files to {num_buckets} buckets")
+                buckets = scatter(iter_lines(paths, buffer_size), bucket_dir, num_buckets, rng, scatter_buffer_size)
+                for i, (bucket_path, num_lines) in enumerate(buckets):
+                    logging.info(f"Shuffling bucket {i + 1}/{num_buckets}")
+                    for line in shuffle_bucket(bucket_path, num_lines, rng, bucket_size, scatter_buffer_size):
+                        writer.write(line)
+            finally:
+                shutil.rmtree(bucket_dir, ignore_errors=True)
+        else:
+            for line in iter_lines(paths, buffer_size):
+                writer.write(line)
+
+    with open(os.path.join(output_dir, "stats.merge.jsonl"), "w", encoding="utf8") as stats_writer:
+        for shard in writer.shards:
+            stats_writer.write(json.dumps(shard, ensure_ascii=False) + "\n")
+    logging.info(f"Wrote {sum(shard['documents'] for shard in writer.shards)} documents "
+                 f"to {len(writer.shards)} shards in {output_dir}")
+    return writer.shards
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Merge JSONL files into fixed-size shards.')
+    parser.add_argument('--inputs', type=str, nargs='+',
+                        help='The input JSONL files, or directories whose JSONL files are merged', required=True)
+    parser.add_argument('--output_dir', type=str,
+                        help='The directory to write the shards to', required=True)
+    parser.add_argument('--max_documents', type=int,
+                        help='The maximum number of documents in a shard (0 for no limit)', required=False, default=0)
+    parser.add_argument('--max_bytes', type=int,
+                        help='The maximum uncompressed size in bytes of a shard (0 for no limit)',
+                        required=False, default=DEFAULT_MAX_BYTES)
+    parser.add_argument('--shuffle', action='store_true',
+                        help='Shuffle all documents with an external-memory bucket shuffle')
+    parser.add_argument('--seed', type=int,
+                        help='The random seed of the shuffle', required=False, default=0)
+    parser.add_argument('--bucket_size', type=int,
+                        help='The size in bytes of a bucket loaded into memory while shuffling',
+                        required=False, default=DEFAULT_BUCKET_SIZE)
+    parser.add_argument('--scatter_buffer_size', type=int,
+                        help='The size in bytes of the buffer used to write documents to the buckets',
+                        required=False, default=DEFAULT_SCATTER_BUFFER_SIZE)
+    parser.add_argument('--tmp_dir', type=str,
+                        help='The directory for the shuffle buckets (defaults to the output directory)',
+                        required=False, default=None)
+    parser.add_argument('--compression', type=str, choices=COMPRESSIONS,
+                        help='The compression format of the shards', required=False, default="none")
+    parser.add_argument('--buffer_size', type=int,
+                        help='The I/O buffer size in bytes used for reading and writing documents',
+                        required=False, default=DEFAULT_BUFFER_SIZE)
+    args = parser.parse_args()
+
+    merge(inputs=args.inputs, output_dir=args.output_dir, max_documents=args.max_documents,
+          max_bytes=args.max_bytes, shuffle=args.shuffle, seed=args.seed, bucket_size=args.bucket_size,
+          scatter_buffer_size=args.scatter_buffer_size, compression=args.compression,
+          buffer_size=args.buffer_size, tmp_dir=args.tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
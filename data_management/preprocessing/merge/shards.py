@@ -0,0 +1,172 @@
+"""
+複数の JSONL を固定サイズのシャードにまとめて書き出すためのユーティリティです.
+
+シャッフルする場合は, 1行ずつランダムに選んだバケツのファイルに振り分けてから, バケツごとにメモリに読み込んで
+シャッフルします(外部メモリでのシャッフル). 各行のバケツは一様に選ぶため, 結果は全体の一様なランダムな並べ替えになります.
+メモリに載るのは1つのバケツと振り分け用のバッファだけで, コーパスの大きさによりません.
+乱数は1つの `numpy.random.Generator` から決まった順序で生成するため, 入力とシードが同じであれば出力も同じです.
+"""
+import math
+import os
+import re
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+import numpy as np
+
+from preprocessing.compression import EXTENSIONS, is_jsonl, open_reader, open_writer
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# シャッフル時にメモリに読み込むバケツの大きさ
+DEFAULT_BUCKET_SIZE = 256 * 1024 * 1024
+# バケツに振り分ける行をまとめて書き込むためのバッファの大きさ
+DEFAULT_SCATTER_BUFFER_SIZE = 64 * 1024 * 1024
+# バケツの番号をまとめて生成する行数
+BATCH_SIZE = 64 * 1024
+SHARD_PATTERN = re.compile(r"part-\d{5}\.jsonl(\.gz|\.zst)?")
+
+
+def list_input_files(inputs: list[str]) -> list[str]:
+    """ファイルはそのまま, ディレクトリは直下の JSONL ファイル(.jsonl, .jsonl.gz, .jsonl.zst)を名前順に返します."""
+    paths = []
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            paths.extend(os.path.join(input_path, name) for name in sorted(os.listdir(input_path)) if is_jsonl(name))
+        else:
+            paths.append(input_path)
+    return paths
+
+
+def iter_lines(paths: list[str], buffer_size: int = -1) -> Iterator[bytes]:
+    """ファイルの空でない行を改行付きのバイト列で順に返します."""
+    for path in paths:
+        with open_reader(path, buffer_size) as reader:
+            for line in reader:
+                if not line.strip():
+                    continue
+                yield line if line.endswith(b"\n") else line + b"\n"
+
+
+class ShardWriter:
+    """
+    行を `part-00000.jsonl` から順に書き込み, `max_documents` 行か `max_bytes` バイト(展開後)に達したら次のシャードに移ります.
+    1行が `max_bytes` を超える場合も, その行だけを含むシャードを作ります. 0 を指定した上限は用いません.
+    """
+
+    def __init__(self, output_dir: str, max_documents: int = 0, max_bytes: int = DEFAULT_MAX_BYTES,
+                 compression: str = "none", buffer_size: int = -1) -> None:
+        self.output_dir = output_dir
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.shards: list[dict] = []
+        self._writer: Optional[BinaryIO] = None
+
+    def __is_full(self, line: bytes) -> bool:
+        shard = self.shards[-1]
+        return (self.max_documents > 0 and shard["documents"] >= self.max_documents) or \
+            (self.max_bytes > 0 and shard["documents"] > 0 and shard["bytes"] + len(line) > self.max_bytes)
+
+    def write(self, line: bytes) -> None:
+        if self._writer is None or self.__is_full(line):
+            self.__rotate()
+        self._writer.write(line)
+        self.shards[-1]["documents"] += 1
+        self.shards[-1]["bytes"] += len(line)
+
+    def __rotate(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        name = f"part-{len(self.shards):05d}.jsonl{EXTENSIONS[self.compression]}"
+        self._writer = open_writer(os.path.join(self.output_dir, name), "wb", self.compression, self.buffer_size)
+        self.shards.append({"path": name, "documents": 0, "bytes": 0})
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # type: ignore
+        self.close()
+
+
+def remove_shards(output_dir: str) -> None:
+    """前回の実行で書き出したシャードが残らないように削除します."""
+    for name in os.listdir(output_dir):
+        if SHARD_PATTERN.fullmatch(name):
+            os.remove(os.path.join(output_dir, name))
+
+
+def scatter(lines: Iterable[bytes], bucket_dir: str, num_buckets: int, rng: np.random.Generator,
+            buffer_size: int = DEFAULT_SCATTER_BUFFER_SIZE) -> list[tuple[str, int]]:
+    """
+    行を一様にランダムに選んだ `num_buckets` 個のバケツのファイルに振り分け, (パス, 行数) のリストを返します.
+    バケツのファイルは開いたままにせず, バッファが `buffer_size` バイトを超えるたびに追記するため,
+    バケツの数によらずファイルディスクリプタを使い切りません.
+    """
+    paths = [os.path.join(bucket_dir, f"bucket-{i:05d}.jsonl") for i in range(num_buckets)]
+    for path in paths:
+        open(path, "wb").close()
+    counts = [0] * num_buckets
+    buffers: list[list[bytes]] = [[] for _ in range(num_buckets)]
+    buffered = 0
+
+    def flush() -> None:
+        for path, buffer in zip(paths, buffers):
+            if buffer:
+                with open(path, "ab") as writer:
+                    writer.writelines(buffer)
+                buffer.clear()
+
+    batch: list[bytes] = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) < BATCH_SIZE:
+            continue
+        buffered += __assign(batch, buffers, counts, rng)
+        batch = []
+        if buffered >= buffer_size:
+            flush()
+            buffered = 0
+    __assign(batch, buffers, counts, rng)
+    flush()
+    return list(zip(paths, counts))
+
+
+def __assign(batch: list[bytes], buffers: list[list[bytes]], counts: list[int], rng: np.random.Generator) -> int:
+    if not batch:
+        return 0
+    num_bytes = 0
+    for line, bucket in zip(batch, rng.integers(len(buffers), size=len(batch)).tolist()):
+        buffers[bucket].append(line)
+        counts[bucket] += 1
+        num_bytes += len(line)
+    return num_bytes
+
+
+def shuffle_bucket(path: str, num_lines: int, rng: np.random.Generator, bucket_size: int = DEFAULT_BUCKET_SIZE,
+                   buffer_size: int = DEFAULT_SCATTER_BUFFER_SIZE) -> Iterator[bytes]:
+    """
+    バケツの行をシャッフルして返し, 返し終えたらバケツのファイルを削除します.
+    入力が圧縮されていた場合などに `bucket_size` を超えたバケツは, さらに小さなバケツに振り分けてからシャッフルします.
+    """
+    size = os.path.getsize(path)
+    if size > bucket_size and num_lines > 1:
+        sub_dir = path.removesuffix(".jsonl")
+        os.makedirs(sub_dir)
+        with open(path, "rb") as reader:
+            buckets = scatter(reader, sub_dir, math.ceil(size / bucket_size), rng, buffer_size)
+        os.remove(path)
+        for sub_path, sub_lines in buckets:
+            yield from shuffle_bucket(sub_path, sub_lines, rng, bucket_size, buffer_size)
+        os.rmdir(sub_dir)
+        return
+
+    with open(path, "rb") as reader:
+        lines = reader.readlines()
+    os.remove(path)
+    for i in rng.permutation(len(lines)).tolist():
+        yield lines[i]
@@ -0,0 +1,200 @@
+"""
+Compose パイプラインの計測用ユーティリティです.
+
+`ProfilingCompose` はフィルタごとの経過時間, CPU 時間, 入出力文書数, 入出力バイト数,
+文書あたりのレイテンシ(p50/p99)を記録します.
+`SamplingProfiler` は一定間隔でコールスタックを採取し, flamegraph.pl や speedscope で
+読み込める folded 形式で書き出します.
+"""
+from __future__ import annotations
+
+import collections
+import dataclasses
+import math
+import os
+import signal
+import time
+from typing import Any, List, Optional, Union
+
+from hojichar import Compose, Document, Filter, TokenFilter
+
+# レイテンシのヒストグラムは 2^(1/8) 倍ごとのバケットで集計する (誤差は約 9%)
+HISTOGRAM_BUCKETS_PER_OCTAVE = 8
+
+
+@dataclasses.dataclass
+class LatencyHistogram:
+    counts: dict[int, int] = dataclasses.field(default_factory=dict)
+
+    def add(self, latency_ns: int) -> None:
+        bucket = int(math.log2(latency_ns) * HISTOGRAM_BUCKETS_PER_OCTAVE) if latency_ns > 0 else 0
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    def percentile(self, q: float) -> float:
+        """q (0-100) パーセンタイルのレイテンシをナノ秒で返します. バケットの上限値で近似します."""
+        total = sum(self.counts.values())
+        if total == 0:
+            return 0.0
+        threshold = total * q / 100
+        cumulative = 0
+        for bucket in sorted(self.counts):
+            cumulative += self.counts[bucket]
+            if cumulative >= threshold:
+                return 2 ** ((bucket + 1) / HISTOGRAM_BUCKETS_PER_OCTAVE)
+        return 2 ** ((max(self.counts) + 1) / HISTOGRAM_BUCKETS_PER_OCTAVE)
+
+    def __add__(self, other: LatencyHistogram) -> LatencyHistogram:
+        counts = dict(self.counts)
+        for bucket, count in other.counts.items():
+            counts[bucket] = counts.get(bucket, 0) + count
+        return LatencyHistogram(counts)
+
+
+@dataclasses.dataclass
+class FilterProfile:
+    name: str
+    wall_time_ns: int = 0
+    cpu_time_ns: int = 0
+    docs_in: int = 0
+    docs_out: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    latency: LatencyHistogram = dataclasses.field(default_factory=LatencyHistogram)
+
+    def get_human_readable_values(self) -> dict:
+        return {
+            "name": self.name,
+            "wall_time": self.wall_time_ns / 10**9,
+            "cpu_time": self.cpu_time_ns / 10**9,
+            "docs_in": self.docs_in,
+            "docs_out": self.docs_out,
+            "input_MB": self.bytes_in / 1000**2,
+            "output_MB": self.bytes_out / 1000**2,
+            "latency_p50_ms": self.latency.percentile(50) / 10**6,
+            "latency_p99_ms": self.latency.percentile(99) / 10**6,
+        }
+
+    def __add__(self, other: FilterProfile) -> FilterProfile:
+        assert self.name == other.name, "Layer names must match"
+        return FilterProfile(
+            self.name,
+            self.wall_time_ns + other.wall_time_ns,
+            self.cpu_time_ns + other.cpu_time_ns,
+            self.docs_in + other.docs_in,
+            self.docs_out + other.docs_out,
+            self.bytes_in + other.bytes_in,
+            self.bytes_out + other.bytes_out,
+            self.latency + other.latency,
+        )
+
+
+@dataclasses.dataclass
+class PipelineProfile:
+    layers: list[FilterProfile]
+    elapsed_ns: int = 0
+    processed_num: int = 0
+    input_bytes: int = 0
+
+    def get_human_readable_values(self) -> dict:
+        elapsed = self.elapsed_ns / 10**9
+        input_mb = self.input_bytes / 1000**2
+        return {
+            "elapsed_time": elapsed,
+            "docs_per_sec": self.processed_num / elapsed if elapsed > 0 else 0.0,
+            "MB_per_sec": input_mb / elapsed if elapsed > 0 else 0.0,
+            "layers_info": [layer.get_human_readable_values() for layer in self.layers],
+        }
+
+    def __add__(self, other: PipelineProfile) -> PipelineProfile:
+        return PipelineProfile(
+            [x + y for x, y in zip(self.layers, other.layers)],
+            self.elapsed_ns + other.elapsed_ns,
+            self.processed_num + other.processed_num,
+            self.input_bytes + other.input_bytes,
+        )
+
+
+class ProfilingCompose(Compose):
+    """
+    フィルタごとの処理時間や入出力を記録する Compose です.
+    計測のために文書ごとにバイト数を数えるため, 通常の Compose より少し遅くなります.
+    """
+
+    def __init__(self, filters: List[Union[Filter, TokenFilter]], *args: Any, **kwargs: Any) -> None:
+        super().__init__(filters, *args, **kwargs)
+        self.reset_profile()
+
+    def reset_profile(self) -> None:
+        self.profile = PipelineProfile([FilterProfile(f"{idx}-{filt.name}") for idx, filt in enumerate(self.filters)])
+        self._layer_profiles = {id(filt): layer for filt, layer in zip(self.filters, self.profile.layers)}
+
+    def _apply_filter(self, filt: Union[Filter, TokenFilter], document: Document) -> Document:
+        if document.is_rejected and filt.skip_rejected:
+            return document
+
+        layer = self._layer_profiles[id(filt)]
+        layer.docs_in += 1
+        layer.bytes_in += len(document.text.encode("utf-8"))
+
+        wall_start, cpu_start = time.perf_counter_ns(), time.thread_time_ns()
+        document = super()._apply_filter(filt, document)
+        wall_time_ns = time.perf_counter_ns() - wall_start
+        layer.cpu_time_ns += time.thread_time_ns() - cpu_start
+        layer.wall_time_ns += wall_time_ns
+        layer.latency.add(wall_time_ns)
+
+        if not document.is_rejected:
+            layer.docs_out += 1
+            layer.bytes_out += len(document.text.encode("utf-8"))
+        return document
+
+    def apply(self, document: Document) -> Document:
+        start = time.perf_counter_ns()
+        document = super().apply(document)
+        self.profile.elapsed_ns += time.perf_counter_ns() - start
+        self.profile.processed_num += 1
+        self.profile.input_bytes += len(document.original.encode("utf-8"))
+        return document
+
+
+class SamplingProfiler:
+    """
+    SIGPROF を用いたサンプリングプロファイラです. with 文の中で実行されたコードのコールスタックを
+    `interval` 秒(CPU 時間)ごとに採取します. メインスレッドでのみ利用できます.
+
+    with SamplingProfiler() as profiler:
+        ...
+    profiler.dump("profile.folded")
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self._previous_handler: Any = None
+
+    def _sample(self, signum: int, frame: Optional[Any]) -> None:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self) -> SamplingProfiler:
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # type: ignore
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler)
+
+    def dump(self, path: str) -> None:
+        """folded 形式 (`frame1;frame2;... count`) で書き出します."""
+        dump_folded_stacks(self.stacks, path)
+
+
+def dump_folded_stacks(stacks: collections.Counter[str], path: str) -> None:
+    with open(path, "w", encoding="utf8") as writer:
+        for stack, count in stacks.most_common():
+            writer.write(f"{stack} {count}\n")
@@ -0,0 +1,67 @@
+import json
+import random
+
+from hojichar import Compose, Document, document_filters
+
+from preprocessing.filtering.__main__ import create_cleaner
+from preprocessing.filtering.adaptive import AdaptiveCompose
+
+WARMUP_SIZE = 20
+
+
+def __first_keyword(name: str) -> str:
+    with open(document_filters.BASE_PATH / "dict" / name, encoding="utf-8") as fp:
+        return next(line.strip() for line in fp if line.strip())
+
+
+def __corpus(num_docs: int) -> list[str]:
+    """破棄されない文書と, グループ内の各フィルタ(複数の場合を含む)で破棄される文書を混ぜたコーパスを返します."""
+    rng = random.Random(0)
+    sentences = ["吾輩は猫である。名前はまだ無い。", "どこで生れたかとんと見当がつかぬ。", "親譲りの無鉄砲で小供の時から損ばかりしている。",
+                 "今日は良い天気です。\n散歩に出かけました。", "東京都の人口は約1400万人です。"]
+    noises = ["コメント" * 20, "送料営業時間求人情報" * 8, __first_keyword("discrimination_keywords_ja.txt"),
+              __first_keyword("adult_keywords_ja.txt") * 5]
+    lines = []
+    for _ in range(num_docs):
+        text = "".join(rng.choices(sentences, k=rng.randint(1, 6)))
+        for noise in noises:
+            if rng.random() < 0.2:
+                text += noise
+        lines.append(json.dumps({"text": text}, ensure_ascii=False))
+    return lines
+
+
+def __run(cleaner: Compose, lines: list[str]) -> list[tuple[bool, str, dict]]:
+    results = []
+    for line in lines:
+        document = cleaner.apply(Document(line))
+        results.append((document.is_rejected, document.text, getattr(document, "reject_reason", {})))
+    return results
+
+
+def __counts(cleaner: Compose) -> dict:
+    stats = cleaner.statistics_obj
+    total = stats.total_info
+    return {
+        "total": (total.processed_num, total.discard_num, total.input_bytes, total.output_bytes,
+                  total.total_token_num),
+        "layers": {name: (layer.discard_num, layer.diff_bytes) for name, layer in stats.layers_info.items()},
+    }
+
+
+def test_same_output_as_compose():
+    """計測中と並べ替えた後のどちらでも, 元の順序の Compose と出力, 破棄の理由, 統計情報が一致することを確認します."""
+    lines = __corpus(200)
+    adaptive = create_cleaner(adaptive=True, warmup_size=WARMUP_SIZE)
+    baseline = create_cleaner()
+    assert isinstance(adaptive, AdaptiveCompose) and not isinstance(baseline, AdaptiveCompose)
+
+    adaptive_results, baseline_results = __run(adaptive, lines), __run(baseline, lines)
+
+    # 計測後は元の順序と異なる順序で適用している
+    assert all(group.order is not None for group in adaptive.groups.values())
+    assert any(group.order != list(range(group.start, group.end)) for group in adaptive.groups.values())
+    assert sum(is_rejected for is_rejected, _, _ in baseline_results[WARMUP_SIZE:]) > 0
+    assert adaptive_results[:WARMUP_SIZE] == baseline_results[:WARMUP_SIZE]
+    assert adaptive_results[WARMUP_SIZE:] == baseline_results[WARMUP_SIZE:]
+    assert __counts(adaptive) == __counts(baseline)
@@ -0,0 +1,67 @@
+import json
+import random
+
+import numpy as np
+
+from preprocessing.dedup.__main__ import dedup_minhashlsh
+from preprocessing.dedup.bloom import BloomFilter
+
+
+def __write_texts(path, texts: list[str]) -> None:
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fp:
+        for text in texts:
+            fp.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+
+
+def __random_text(rng: random.Random, length: int = 200) -> str:
+    return "".join(chr(0x4E00 + rng.randrange(20000)) for _ in range(length))
+
+
+def test_add_returns_membership():
+    """登録済みのキーだけを登録済みと判定し, 新しいキーの数を数えることを確認します."""
+    bloom = BloomFilter(memory_MB=0.01)
+    keys = [f"key{i}".encode() for i in range(100)]
+
+    assert not bloom.add(keys[:50]).any()
+    assert bloom.add(keys).tolist() == [True] * 50 + [False] * 50
+    assert bloom.count == 100
+    assert keys[0] in bloom and b"other" not in bloom
+
+
+def test_save_and_load(tmp_path):
+    """保存したフィルタを読み込むと, ビット列と登録数, ソースが復元されることを確認します."""
+    bloom = BloomFilter(memory_MB=0.01, error_rate=0.01)
+    bloom.add([f"key{i}".encode() for i in range(100)])
+    bloom.sources.append("a")
+    path = str(tmp_path / "bloom.npz")
+    bloom.save(path)
+
+    loaded = BloomFilter.load(path)
+
+    assert np.array_equal(loaded.bits, bloom.bits)
+    assert (loaded.count, loaded.sources, loaded.num_hashes) == (100, ["a"], bloom.num_hashes)
+    assert loaded.add([b"key0", b"other"]).tolist() == [True, False]
+
+
+def test_dedup_across_runs(tmp_path):
+    """`bloom_path` のフィルタを再利用すると, 以前の実行で処理した文書と重複する文書を破棄することを確認します."""
+    rng = random.Random(0)
+    old_texts = [__random_text(rng) for _ in range(20)]
+    new_texts = [__random_text(rng) for _ in range(20)]
+    __write_texts(tmp_path / "old" / "a.jsonl", old_texts)
+    __write_texts(tmp_path / "new" / "a.jsonl", old_texts[:5] + [text[:-1] + "あ" for text in old_texts[5:10]]
+                  + new_texts)
+    bloom_path = str(tmp_path / "bloom.npz")
+
+    dedup_minhashlsh(str(tmp_path / "old"), str(tmp_path / "old_output"), bloom_path=bloom_path, bloom_memory_MB=1)
+    assert BloomFilter.load(bloom_path).sources == [str(tmp_path / "old_output" / "a")]
+    dedup_minhashlsh(str(tmp_path / "new"), str(tmp_path / "new_output"), bloom_path=bloom_path)
+
+    with open(tmp_path / "new_output" / "results.dedup.jsonl", encoding="utf-8") as fp:
+        assert [json.loads(line)["text"] for line in fp] == new_texts
+    with open(tmp_path / "new_output" / "a" / "stat.dedup.jsonl", encoding="utf-8") as fp:
+        duplicates = json.loads(fp.readline())["duplicates"]
+    # Bloom フィルタはソースを記録しないため, ファイル内かどうかは数えない
+    assert duplicates == {"exact": 5, "near": 5, "within_file": 0, "across_files": 0}
+    assert len(BloomFilter.load(bloom_path).sources) == 2
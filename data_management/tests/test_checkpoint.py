@@ -0,0 +1,114 @@
+import json
+import random
+
+import pytest
+
+from preprocessing.dedup import __main__ as dedup_main
+from preprocessing.filtering import __main__ as filtering_main
+
+
+class Interrupted(Exception):
+    pass
+
+
+def __interrupt_after(module, monkeypatch, num_docs: int) -> None:
+    """`module.create_cleaner` の Compose が `num_docs` 件を処理した後に例外を送出するようにします."""
+    create_cleaner = module.create_cleaner
+    num_applied = 0
+
+    def create_interrupting_cleaner(*args, **kwargs):
+        cleaner = create_cleaner(*args, **kwargs)
+        apply = cleaner.apply
+
+        def interrupting_apply(document):
+            nonlocal num_applied
+            num_applied += 1
+            if num_applied > num_docs:
+                raise Interrupted()
+            return apply(document)
+
+        cleaner.apply = interrupting_apply
+        return cleaner
+
+    monkeypatch.setattr(module, "create_cleaner", create_interrupting_cleaner)
+
+
+def __random_text(rng: random.Random, length: int = 200) -> str:
+    return "".join(chr(0x4E00 + rng.randrange(20000)) for _ in range(length))
+
+
+def __write_corpus(input_dir, rng: random.Random) -> None:
+    """ファイル内とファイル間の完全一致, 近似重複と, 破棄されない文書を含む2つのファイルを書き出します."""
+    input_dir.mkdir()
+    texts = [__random_text(rng) for _ in range(40)]
+    for name in ["a.jsonl", "b.jsonl"]:
+        with open(input_dir / name, "w", encoding="utf-8") as fp:
+            for _ in range(60):
+                text = rng.choice(texts)
+                if rng.random() < 0.3:
+                    # 近似重複
+                    text = text[:-1] + "あ"
+                elif rng.random() < 0.3:
+                    text = "短い"
+                fp.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+
+
+def __read_outputs(output_base) -> dict[str, object]:
+    """出力ファイルの内容を, 処理時間とキャッシュの利用状況を除いて返します."""
+    def strip_time(value):
+        if isinstance(value, dict):
+            return {key: strip_time(item) for key, item in value.items()
+                    if "time" not in key and key != "cache_info"}
+        if isinstance(value, list):
+            return [strip_time(item) for item in value]
+        return value
+
+    outputs = {}
+    for path in sorted(output_base.rglob("*.jsonl")):
+        name = str(path.relative_to(output_base))
+        if path.name.startswith("stat"):
+            outputs[name] = [strip_time(json.loads(line)) for line in path.read_text(encoding="utf-8").splitlines()]
+        else:
+            outputs[name] = path.read_bytes()
+    return outputs
+
+
+def test_filtering_resume(tmp_path, monkeypatch):
+    """中断したフィルタリングを再開すると, 中断しなかった場合と同じ出力と統計情報になることを確認します."""
+    __write_corpus(tmp_path / "input", random.Random(0))
+    filtering_main.filtering(str(tmp_path / "input"), str(tmp_path / "full"), checkpoint_interval=7)
+
+    with monkeypatch.context() as patch:
+        __interrupt_after(filtering_main, patch, 90)
+        with pytest.raises(Interrupted):
+            filtering_main.filtering(str(tmp_path / "input"), str(tmp_path / "resumed"), checkpoint_interval=7)
+    filtering_main.filtering(str(tmp_path / "input"), str(tmp_path / "resumed"), checkpoint_interval=7, resume=True)
+
+    assert __read_outputs(tmp_path / "resumed") == __read_outputs(tmp_path / "full")
+
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_dedup_resume(tmp_path, monkeypatch, use_index):
+    """
+    中断した重複除去を再開すると, 中断しなかった場合と同じ結果になることを確認します.
+    LSH インデックスを使わない場合は中断したファイルを先頭から読み直し, 使う場合は確定した位置から続けます.
+    """
+    __write_corpus(tmp_path / "input", random.Random(1))
+
+    def run(name: str, **kwargs) -> None:
+        index_path = str(tmp_path / f"{name}.index") if use_index else None
+        dedup_main.dedup_minhashlsh(str(tmp_path / "input"), str(tmp_path / name), checkpoint_interval=7,
+                                    index_path=index_path, **kwargs)
+
+    run("full")
+    with monkeypatch.context() as patch:
+        __interrupt_after(dedup_main, patch, 90)
+        with pytest.raises(Interrupted):
+            run("resumed")
+    manifest = json.loads((tmp_path / "resumed" / "manifest.json").read_text())
+    assert manifest["files"]["a.jsonl"]["done"] and not manifest["files"]["b.jsonl"]["done"]
+    run("resumed", resume=True)
+
+    full = __read_outputs(tmp_path / "full")
+    assert (full["stats.dedup.jsonl"][1]["duplicates"]["across_files"] > 0) == use_index
+    assert __read_outputs(tmp_path / "resumed") == full
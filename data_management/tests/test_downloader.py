@@ -0,0 +1,185 @@
+import hashlib
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from preprocessing.download_dataset.cache import ArtifactCache
+from preprocessing.download_dataset.downloader import DownloadError, DownloadTask, download_files
+
+
+class FileServer:
+    """Range と If-Range に対応したテスト用の HTTP サーバーです. 受け取ったリクエストを記録します."""
+
+    def __init__(self) -> None:
+        self.files: dict[str, bytes] = {}
+        self.support_range = True
+        # パスごとに, 次のリクエストに返すエラーのステータスコード
+        self.failures: dict[str, list[int]] = {}
+        self.requests: list[tuple[str, str, dict[str, str]]] = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_HEAD(self) -> None:
+                self.respond(send_body=False)
+
+            def do_GET(self) -> None:
+                self.respond(send_body=True)
+
+            def respond(self, send_body: bool) -> None:
+                server.requests.append((self.command, self.path, dict(self.headers)))
+                failures = server.failures.get(self.path)
+                if failures:
+                    self.send_response(failures.pop(0))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.path not in server.files:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                data = server.files[self.path]
+                etag = server.etag(self.path)
+                start = 0
+                match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+                if match and server.support_range and self.headers.get("If-Range") in (None, etag):
+                    start = int(match.group(1))
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(data)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+                else:
+                    self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(data) - start))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(data[start:])
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def etag(self, path: str) -> str:
+        return '"' + hashlib.sha256(self.files[path]).hexdigest()[:16] + '"'
+
+    def gets(self, path: str) -> list[dict[str, str]]:
+        return [headers for command, request_path, headers in self.requests
+                if command == "GET" and request_path == path]
+
+
+@pytest.fixture
+def server():
+    file_server = FileServer()
+    thread = threading.Thread(target=file_server.httpd.serve_forever, daemon=True)
+    thread.start()
+    yield file_server
+    file_server.httpd.shutdown()
+    file_server.httpd.server_close()
+
+
+def __write_part(output_base, name: str, data: bytes, validator: str) -> None:
+    (output_base / f"{name}.part").write_bytes(data)
+    (output_base / f"{name}.part.validator").write_text(validator, encoding="utf-8")
+
+
+def test_resume_partial_file(server, tmp_path):
+    """.part ファイルの続きを Range リクエストで受け取ることを確認します."""
+    data = bytes(range(256)) * 100
+    server.files["/a.bin"] = data
+    __write_part(tmp_path, "a.bin", data[:10000], server.etag("/a.bin"))
+
+    result = download_files([DownloadTask(f"{server.url}/a.bin", "a.bin")], str(tmp_path), backoff=0)
+
+    assert (tmp_path / "a.bin").read_bytes() == data
+    assert not (tmp_path / "a.bin.part").exists()
+    assert not (tmp_path / "a.bin.part.validator").exists()
+    assert server.gets("/a.bin")[0]["Range"] == "bytes=10000-"
+    assert result["downloaded_bytes"] == len(data) - 10000
+
+
+def test_full_download_without_range_support(server, tmp_path):
+    """サーバーが Range に対応せず 200 を返した場合に, 最初からダウンロードし直すことを確認します."""
+    data = b"0123456789" * 1000
+    server.files["/a.bin"] = data
+    server.support_range = False
+    __write_part(tmp_path, "a.bin", data[:3000], server.etag("/a.bin"))
+
+    result = download_files([DownloadTask(f"{server.url}/a.bin", "a.bin")], str(tmp_path), backoff=0)
+
+    assert (tmp_path / "a.bin").read_bytes() == data
+    assert result["downloaded_bytes"] == len(data)
+
+
+def test_restart_when_remote_file_changed(server, tmp_path):
+    """前回と別の版のファイルには, 古い .part ファイルの続きを連結しないことを確認します."""
+    old, new = b"a" * 5000, b"b" * 5000
+    server.files["/a.bin"] = old
+    __write_part(tmp_path, "a.bin", old[:2000], server.etag("/a.bin"))
+    server.files["/a.bin"] = new
+
+    download_files([DownloadTask(f"{server.url}/a.bin", "a.bin")], str(tmp_path), backoff=0)
+
+    assert (tmp_path / "a.bin").read_bytes() == new
+
+
+def test_retry_after_server_error(server, tmp_path):
+    """503 を返されたファイルを再試行することを確認します."""
+    data = b"retry" * 100
+    server.files["/a.bin"] = data
+    server.failures["/a.bin"] = [503]
+
+    download_files([DownloadTask(f"{server.url}/a.bin", "a.bin")], str(tmp_path), backoff=0)
+
+    assert (tmp_path / "a.bin").read_bytes() == data
+    assert len(server.gets("/a.bin")) == 2
+
+
+def test_size_mismatch(server, tmp_path):
+    """指定したサイズと異なるファイルは失敗とし, 本来の名前で残さないことを確認します."""
+    server.files["/a.bin"] = b"x" * 100
+
+    with pytest.raises(DownloadError):
+        download_files([DownloadTask(f"{server.url}/a.bin", "a.bin", size=99)], str(tmp_path), backoff=0)
+
+    assert not (tmp_path / "a.bin").exists()
+
+
+def test_rerun_skips_downloaded_files(server, tmp_path):
+    """manifest.json に記録済みのファイルは, 再実行してもダウンロードしないことを確認します."""
+    server.files["/a.bin"] = b"a" * 100
+    server.files["/b.bin"] = b"b" * 200
+    tasks = [DownloadTask(f"{server.url}/a.bin", "a.bin"), DownloadTask(f"{server.url}/b.bin", "sub/b.bin")]
+
+    download_files(tasks, str(tmp_path), backoff=0)
+    num_requests = len(server.requests)
+    result = download_files(tasks, str(tmp_path), backoff=0)
+
+    assert result["files"] == 0
+    assert len(server.requests) == num_requests
+    assert (tmp_path / "sub" / "b.bin").read_bytes() == b"b" * 200
+
+
+def test_restore_from_cache(server, tmp_path):
+    """URL とサイズ, ETag が前回と同じファイルは, 別の出力先でもキャッシュから取り出すことを確認します."""
+    server.files["/a.bin"] = b"a" * 1000
+    tasks = [DownloadTask(f"{server.url}/a.bin", "a.bin")]
+
+    download_files(tasks, str(tmp_path / "first"), backoff=0, cache=ArtifactCache(str(tmp_path / "cache")))
+    # キャッシュの記録は呼び出しの最後に書き出されている
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    assert cache.url_record(f"{server.url}/a.bin")["size"] == 1000
+    result = download_files(tasks, str(tmp_path / "second"), backoff=0, cache=cache)
+
+    assert result["restored"] == 1
+    assert len(server.gets("/a.bin")) == 1
+    assert (tmp_path / "second" / "a.bin").read_bytes() == b"a" * 1000
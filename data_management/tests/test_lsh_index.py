@@ -0,0 +1,72 @@
+import json
+import random
+
+from preprocessing.dedup.__main__ import dedup_minhashlsh
+from preprocessing.dedup.lsh_index import LSHIndex
+
+
+def __write_texts(path, texts: list[str]) -> None:
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fp:
+        for text in texts:
+            fp.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+
+
+def __random_text(rng: random.Random, length: int = 200) -> str:
+    return "".join(chr(0x4E00 + rng.randrange(20000)) for _ in range(length))
+
+
+def test_add_returns_previous_sources(tmp_path):
+    """登録済みのハッシュ値について, 最初に登録したソースを返すことを確認します."""
+    with LSHIndex(str(tmp_path / "index.db")) as index:
+        a, _ = index.get_source("a")
+        b, _ = index.get_source("b")
+        assert a != b and index.get_source("a") == (a, 0)
+
+        assert index.add([b"k1", b"k2"], a) == set()
+        assert index.add([b"k2", b"k3"], b) == {a}
+        assert index.add([b"k1", b"k3"], b) == {a, b}
+        assert len(index) == 3
+
+        assert index.add_fingerprint(b"fp", b) is None
+        assert index.add_fingerprint(b"fp", a) == b
+
+
+def test_commit_and_rollback(tmp_path):
+    """`commit` した書き込みと位置は開き直しても残り, `commit` していない書き込みは破棄されることを確認します."""
+    path = str(tmp_path / "index.db")
+    with LSHIndex(path) as index:
+        source, _ = index.get_source("a")
+        index.add([b"k1"], source)
+        index.add_fingerprint(b"fp1", source)
+        index.commit(source, 100)
+        index.add([b"k2"], source)
+        index.add_fingerprint(b"fp2", source)
+
+    with LSHIndex(path) as index:
+        assert index.get_source("a") == (source, 100)
+        assert len(index) == 1
+        assert index.add([b"k1", b"k2"], source) == {source}
+        assert index.add_fingerprint(b"fp1", source) == source
+        assert index.add_fingerprint(b"fp2", source) is None
+
+
+def test_dedup_across_runs(tmp_path):
+    """インデックスを共有すると, 以前の実行で処理した文書と重複する文書を破棄することを確認します."""
+    rng = random.Random(0)
+    old_texts = [__random_text(rng) for _ in range(20)]
+    new_texts = [__random_text(rng) for _ in range(20)]
+    __write_texts(tmp_path / "old" / "a.jsonl", old_texts)
+    # 前回の完全一致と近似重複, 新しい文書を混ぜる
+    __write_texts(tmp_path / "new" / "a.jsonl", old_texts[:5] + [text[:-1] + "あ" for text in old_texts[5:10]]
+                  + new_texts)
+    index_path = str(tmp_path / "index.db")
+
+    dedup_minhashlsh(str(tmp_path / "old"), str(tmp_path / "old_output"), index_path=index_path)
+    dedup_minhashlsh(str(tmp_path / "new"), str(tmp_path / "new_output"), index_path=index_path)
+
+    with open(tmp_path / "new_output" / "results.dedup.jsonl", encoding="utf-8") as fp:
+        assert [json.loads(line)["text"] for line in fp] == new_texts
+    with open(tmp_path / "new_output" / "a" / "stat.dedup.jsonl", encoding="utf-8") as fp:
+        duplicates = json.loads(fp.readline())["duplicates"]
+    assert duplicates == {"exact": 5, "near": 5, "within_file": 0, "across_files": 10}
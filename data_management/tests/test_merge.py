@@ -0,0 +1,64 @@
+import json
+import os
+
+from preprocessing.merge.__main__ import merge
+
+BUCKET_SIZE = 2000
+
+
+def __write_inputs(input_dir) -> list[bytes]:
+    """2つの入力ファイルを書き出し, 全ての行を入力の順に返します."""
+    input_dir.mkdir()
+    lines = []
+    for name in ["a.jsonl", "b.jsonl"]:
+        with open(input_dir / name, "wb") as fp:
+            for i in range(300):
+                line = (json.dumps({"text": f"{name} の {i} 番目の文書"}, ensure_ascii=False) + "\n").encode()
+                fp.write(line)
+                lines.append(line)
+    return lines
+
+
+def __read_shards(output_dir) -> list[bytes]:
+    lines = []
+    for shard in __read_stats(output_dir):
+        with open(os.path.join(output_dir, shard["path"]), "rb") as fp:
+            lines.extend(fp.readlines())
+    return lines
+
+
+def __read_stats(output_dir) -> list[dict]:
+    with open(os.path.join(output_dir, "stats.merge.jsonl"), encoding="utf8") as fp:
+        return [json.loads(line) for line in fp]
+
+
+def test_merge_without_shuffle(tmp_path):
+    """シャッフルしない場合は入力の順に, 上限の文書数ずつシャードに書き出すことを確認します."""
+    lines = __write_inputs(tmp_path / "input")
+
+    shards = merge([str(tmp_path / "input")], str(tmp_path / "output"), max_documents=250)
+
+    assert [shard["documents"] for shard in shards] == [250, 250, 100]
+    assert __read_stats(tmp_path / "output") == shards
+    assert __read_shards(tmp_path / "output") == lines
+
+
+def test_shuffle_is_reproducible(tmp_path):
+    """同じシードのシャッフルは同じ順序になり, 全ての行をちょうど1回ずつ書き出すことを確認します."""
+    lines = __write_inputs(tmp_path / "input")
+
+    def shuffled(name: str, seed: int) -> list[bytes]:
+        # 複数のバケツに振り分けられるように, バケツを小さくする
+        merge([str(tmp_path / "input")], str(tmp_path / name), max_documents=250, shuffle=True, seed=seed,
+              bucket_size=BUCKET_SIZE, scatter_buffer_size=BUCKET_SIZE // 4)
+        # 一時的なバケツは削除されている
+        assert sorted(os.listdir(tmp_path / name)) == ["part-00000.jsonl", "part-00001.jsonl", "part-00002.jsonl",
+                                                       "stats.merge.jsonl"]
+        return __read_shards(tmp_path / name)
+
+    first = shuffled("first", 1234)
+
+    assert sum(len(line) for line in lines) > 10 * BUCKET_SIZE
+    assert first != lines and sorted(first) == sorted(lines)
+    assert shuffled("second", 1234) == first
+    assert shuffled("other", 4321) != first
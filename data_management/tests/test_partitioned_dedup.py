@@ -0,0 +1,29 @@
+import json
+
+from preprocessing.dedup.__main__ import dedup_partitioned
+
+
+def __write_jsonl(path: str, texts: list[str]) -> None:
+    with open(path, "w", encoding="utf-8") as fp:
+        for text in texts:
+            fp.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+
+
+def test_file_without_drops(tmp_path):
+    """他のファイルに破棄する文書があっても, 重複のない入力ファイルを処理できることを確認します."""
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    # 近似重複と判定されないように, 文書ごとに異なる文字で本文を作ります
+    texts = ["".join(chr(0x4E00 + (i * 997 + j * 31) % 20000) for j in range(200)) for i in range(4)]
+    unique_texts = ["".join(chr(0x4E00 + (i * 787 + j * 53 + 10000) % 20000) for j in range(200)) for i in range(3)]
+    __write_jsonl(input_dir / "a.jsonl", texts)
+    __write_jsonl(input_dir / "b.jsonl", texts[:2])
+    __write_jsonl(input_dir / "c.jsonl", unique_texts)
+
+    output_dir = tmp_path / "output"
+    dedup_partitioned(input_dir=str(input_dir), output_base=str(output_dir), partition_dir=str(tmp_path / "partition"),
+                      num_partitions=4)
+
+    with open(output_dir / "results.dedup.jsonl", encoding="utf-8") as fp:
+        results = [json.loads(line)["text"] for line in fp]
+    assert results == texts + unique_texts
@@ -0,0 +1,131 @@
+"""Samples sentences from JSONL corpora to train a SentencePiece tokenizer without dumping them to text files.
+
+Each source (e.g. C4, Wikipedia, RedPajama) gets a share of the byte/sentence budget proportional to its weight.
+Within a source, every sentence is given a random key and the sentences with the smallest keys that fit in the budget
+are kept, which is a prefix of a uniformly random order of the source regardless of its size.
+Only the sample is held in memory.
+"""
+import dataclasses
+import glob
+import gzip
+import heapq
+import io
+import json
+import random
+import time
+from typing import Iterator, Optional
+
+
+@dataclasses.dataclass
+class Source:
+    name: str
+    paths: list[str]
+    weight: float = 1.0
+
+
+def parse_source(value: str) -> Source:
+    """Parses `NAME=GLOB` or `NAME:WEIGHT=GLOB` given on the command line.
+
+    >>> parse_source("c4:2=/data/c4/*.jsonl.gz")
+    Source(name='c4', paths=[], weight=2.0)
+    """
+    name, pattern = value.split("=", 1)
+    weight = 1.0
+    if ":" in name:
+        name, weight_str = name.split(":", 1)
+        weight = float(weight_str)
+    return Source(name=name, paths=sorted(glob.glob(pattern)), weight=weight)
+
+
+def open_jsonl(path: str) -> io.TextIOBase:
+    """Opens a JSONL file, decompressing `.gz` and `.zst` files by their extension."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        import zstandard  # Only needed for zstd-compressed inputs.
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_sentences(paths: list[str], max_sentence_length: int) -> Iterator[str]:
+    """Yields the non-empty lines of the `text` field of every document, as SentencePiece reads a text file."""
+    for path in paths:
+        with open_jsonl(path) as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                for sentence in json.loads(line)["text"].split("\n"):
+                    # SentencePiece skips sentences longer than `max_sentence_length` bytes.
+                    if sentence.strip() and len(sentence.encode("utf-8")) <= max_sentence_length:
+                        yield sentence
+
+
+class Reservoir:
+    """Keeps a random sample of at most `max_bytes` bytes and `max_sentences` sentences (0 for no limit).
+
+    The sample is the sentences with the smallest keys up to the first one that doesn't fit in the budget, i.e. a prefix
+    of a uniformly random order of all sentences. Once a sentence has been evicted, a sentence with a larger key can't be
+    in that prefix either, so the evicted key is kept as a threshold for the sentences that follow.
+    """
+
+    def __init__(self, max_bytes: int, max_sentences: int, rng: random.Random) -> None:
+        self.max_bytes = max_bytes
+        self.max_sentences = max_sentences
+        self.rng = rng
+        # A max-heap of (-key, sentence, size) so that the sentence with the largest key is evicted first.
+        self.heap: list[tuple[float, str, int]] = []
+        self.num_bytes = 0
+        # The smallest key evicted so far. `random()` returns keys smaller than 1.0.
+        self.threshold = 1.0
+
+    def _is_over(self) -> bool:
+        return (self.max_bytes > 0 and self.num_bytes > self.max_bytes) or \
+            (self.max_sentences > 0 and len(self.heap) > self.max_sentences)
+
+    def add(self, sentence: str) -> None:
+        key = self.rng.random()
+        if key >= self.threshold:
+            return
+        size = len(sentence.encode("utf-8"))
+        heapq.heappush(self.heap, (-key, sentence, size))
+        self.num_bytes += size
+        while self._is_over():
+            negative_key, _, evicted = heapq.heappop(self.heap)
+            self.num_bytes -= evicted
+            self.threshold = -negative_key
+
+    def sentences(self) -> list[str]:
+        # Sorting by the random keys also shuffles the sample reproducibly.
+        return [sentence for _, sentence, _ in sorted(self.heap, reverse=True)]
+
+
+def sample_sentences(sources: list[Source], max_bytes: int, max_sentences: int = 0, seed: int = 0,
+                     max_sentence_length: int = 4192) -> list[str]:
+    """Samples sentences from every source within its share of the budget and returns them all."""
+    total_weight = sum(source.weight for source in sources)
+    sample = []
+    for source in sources:
+        share = source.weight / total_weight
+        reservoir = Reservoir(int(max_bytes * share), int(max_sentences * share), random.Random(f"{seed}-{source.name}"))
+        num_read, bytes_read = 0, 0
+        start = time.perf_counter()
+        for sentence in iter_sentences(source.paths, max_sentence_length):
+            reservoir.add(sentence)
+            num_read += 1
+            bytes_read += len(sentence.encode("utf-8"))
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        print(f"Sampled {len(reservoir.heap):,} of {num_read:,} sentences ({reservoir.num_bytes / 1e6:,.1f} of "
+              f"{bytes_read / 1e6:,.1f} MB) from {source.name} ({len(source.paths)} files) in {elapsed:,.1f} sec: "
+              f"{num_read / elapsed:,.0f} sentences/sec, {bytes_read / 1e6 / elapsed:,.1f} MB/sec")
+        sample.extend(reservoir.sentences())
+    return sample
+
+
+def get_peak_memory_mb() -> Optional[float]:
+    """Returns the peak resident set size of this process in MB, or None where it is unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
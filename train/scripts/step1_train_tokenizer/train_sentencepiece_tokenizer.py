@@ -5,19 +5,34 @@ sys.path.append(os.path.join(os.environ["HOME"], "ucllm_nedo_dev/train/scripts/c
 
 import argparse
 import sentencepiece as spm
+from corpus_sampler import get_peak_memory_mb, parse_source, sample_sentences
 from special_token_list import BOS_TOKEN, EOS_TOKEN, PAD_TOKEN, CLS_TOKEN, SEP_TOKEN, EOD_TOKEN, MASK_TOKEN, NEWLINE_TOKEN
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", type=str, required=True)
+    parser.add_argument("--input", type=str, default=None, help="Comma-separated plain text files.")
+    parser.add_argument("--jsonl_source", type=parse_source, action="append", default=[],
+                        help="A JSONL (.jsonl, .jsonl.gz, .jsonl.zst) source to sample from, as NAME=GLOB or "
+                             "NAME:WEIGHT=GLOB. Can be given multiple times.")
+    parser.add_argument("--sample_bytes", type=int, default=1_000_000_000,
+                        help="The total size in bytes of the sentences sampled from the JSONL sources (0 for no limit).")
+    parser.add_argument("--sample_sentences", type=int, default=0,
+                        help="The total number of sentences sampled from the JSONL sources (0 for no limit).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max_sentence_length", type=int, default=4192)
     parser.add_argument("--model_prefix", type=str, required=True)
     parser.add_argument("--vocab_size", type=int, required=True)
     parser.add_argument("--character_coverage", type=float, default=0.9995)
     parser.add_argument("--model_type", type=str, default="unigram", choices=["unigram", "bpe", "word", "char"])
     parser.add_argument("--num_threads", type=int, default=16)
-    parser.add_argument("--train_extremely_large_corpus", type=bool, default=True)
+    parser.add_argument("--train_extremely_large_corpus", action=argparse.BooleanOptionalAction, default=True)
     args = parser.parse_args()
+    if (args.input is None) == (not args.jsonl_source):
+        parser.error("Specify either --input or --jsonl_source.")
+    for source in args.jsonl_source:
+        if not source.paths:
+            parser.error(f"No files match the source {source.name}.")
     print(f"{args = }")
     return args
 
@@ -25,14 +40,24 @@ def parse_arguments():
 def main():
     args = parse_arguments()
 
+    if args.jsonl_source:
+        # Passes the sample to SentencePiece in memory instead of writing it to a text file.
+        sample = sample_sentences(args.jsonl_source, max_bytes=args.sample_bytes, max_sentences=args.sample_sentences,
+                                  seed=args.seed, max_sentence_length=args.max_sentence_length)
+        print(f"Sampled {len(sample):,} sentences, peak memory: {get_peak_memory_mb():,.1f} MB")
+        corpus = {"sentence_iterator": iter(sample)}
+    else:
+        corpus = {"input": args.input}
+
     # Trains a SentencePiece tokenizer. After training, *.model and *.vocab will be saved in the current directory.
     spm.SentencePieceTrainer.train(
-        input=args.input,
+        **corpus,
         model_prefix=args.model_prefix,
         vocab_size=args.vocab_size,
         character_coverage=args.character_coverage,
         model_type=args.model_type,
         num_threads=args.num_threads,
+        max_sentence_length=args.max_sentence_length,
         train_extremely_large_corpus=args.train_extremely_large_corpus,
         user_defined_symbols=[
             BOS_TOKEN,
@@ -49,6 +74,7 @@ def main():
         allow_whitespace_only_pieces=True,
         remove_extra_whitespaces=False,
     )
+    print(f"Peak memory: {get_peak_memory_mb():,.1f} MB")
 
 
 if __name__ == "__main__":
@@ -251,14 +251,11 @@ if [ ! -f "${data_path}.bin" ] || [ ! -f "${data_path}.idx" ]; then
     wget https://data.together.xyz/redpajama-data-1T/v1.0.0/arxiv/arxiv_024de5df-1b7f-447c-8c3a-51407d8d6732.jsonl \
         --directory-prefix ${megatron_deepspeed_dir}/dataset/
     mv ${megatron_deepspeed_dir}/dataset/arxiv_024de5df-1b7f-447c-8c3a-51407d8d6732.jsonl ${megatron_deepspeed_dir}/dataset/arxiv.jsonl
-    python ${megatron_deepspeed_dir}/tools/preprocess_data.py \
-        --tokenizer-type SentencePieceTokenizer \
-        --tokenizer-model ${input_tokenizer_file} \
+    python ${ucllm_nedo_dev_train_dir}/scripts/step2_pretrain_model/tokenize_jsonl_to_megatron_dataset.py \
+        --input_tokenizer_file ${input_tokenizer_file} \
         --input ${megatron_deepspeed_dir}/dataset/arxiv.jsonl \
-        --output-prefix ${megatron_deepspeed_dir}/dataset/arxiv \
-        --dataset-impl mmap \
-        --workers $(grep -c ^processor /proc/cpuinfo) \
-        --append-eod
+        --output_prefix ${megatron_deepspeed_dir}/dataset/arxiv \
+        --num_workers $(grep -c ^processor /proc/cpuinfo)
 else
     echo "Both ${data_path}.bin and ${data_path}.idx already exist."
 fi
@@ -0,0 +1,135 @@
+"""Reads and writes Megatron-DeepSpeed's mmap indexed datasets (`--dataset-impl mmap`) without Megatron-DeepSpeed.
+
+A dataset is a pair of files:
+    *.bin: the tokens of all documents, concatenated.
+    *.idx: "MMIDIDX\\x00\\x00", version (<Q), dtype code (<B), number of sequences (<Q), length of doc_idx (<Q),
+           then sizes (int32, tokens per sequence), pointers (int64, byte offset of each sequence in *.bin)
+           and doc_idx (int64, index of the first sequence of each document, starting with 0).
+"""
+import shutil
+import struct
+from typing import BinaryIO
+
+import numpy as np
+
+HDR_MAGIC = b"MMIDIDX\x00\x00"
+VERSION = 1
+DTYPES = {
+    1: np.uint8,
+    2: np.int8,
+    3: np.int16,
+    4: np.int32,
+    5: np.int64,
+    6: np.float64,
+    7: np.double,
+    8: np.uint16,
+}
+# The number of index entries processed at once while merging.
+MERGE_CHUNK_SIZE = 1024 * 1024
+
+
+def best_fitting_dtype(vocab_size: int) -> type:
+    """Returns the same token dtype as Megatron-DeepSpeed's `preprocess_data.py`."""
+    return np.uint16 if vocab_size < 65500 else np.int32
+
+
+def dtype_code(dtype: type) -> int:
+    for code, candidate in DTYPES.items():
+        if candidate == dtype:
+            return code
+    raise ValueError(f"Unsupported dtype: {dtype}")
+
+
+def _write_header(fp: BinaryIO, dtype: type, num_sizes: int, num_docs: int) -> None:
+    fp.write(HDR_MAGIC)
+    fp.write(struct.pack("<Q", VERSION))
+    fp.write(struct.pack("<B", dtype_code(dtype)))
+    fp.write(struct.pack("<Q", num_sizes))
+    fp.write(struct.pack("<Q", num_docs))
+
+
+class IndexedDatasetBuilder:
+    """Appends documents of one sequence each to `prefix.bin` and writes `prefix.idx` on `finalize`.
+
+    The tokens are written to the file as they are added. Only the sizes of the sequences are kept in memory.
+    """
+
+    def __init__(self, prefix: str, dtype: type) -> None:
+        self.prefix = prefix
+        self.dtype = dtype
+        self.sizes: list[int] = []
+        self._bin = open(f"{prefix}.bin", "wb")
+
+    def add_document(self, tokens: list[int]) -> None:
+        self._bin.write(np.asarray(tokens, dtype=self.dtype).tobytes(order="C"))
+        self.sizes.append(len(tokens))
+
+    def finalize(self) -> None:
+        self._bin.close()
+        sizes = np.asarray(self.sizes, dtype=np.int32)
+        pointers = np.zeros(len(sizes), dtype=np.int64)
+        np.cumsum(sizes[:-1].astype(np.int64) * np.dtype(self.dtype).itemsize, out=pointers[1:])
+        with open(f"{self.prefix}.idx", "wb") as fp:
+            _write_header(fp, self.dtype, len(sizes), len(sizes) + 1)
+            fp.write(sizes.tobytes(order="C"))
+            fp.write(pointers.tobytes(order="C"))
+            fp.write(np.arange(len(sizes) + 1, dtype=np.int64).tobytes(order="C"))
+
+
+class IndexReader:
+    """Maps the arrays of an `.idx` file without reading them into memory."""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as fp:
+            if fp.read(len(HDR_MAGIC)) != HDR_MAGIC:
+                raise ValueError(f"{path} is not an mmap indexed dataset index.")
+            (version,) = struct.unpack("<Q", fp.read(8))
+            if version != VERSION:
+                raise ValueError(f"{path} has an unsupported version {version}.")
+            (code,) = struct.unpack("<B", fp.read(1))
+            self.dtype = DTYPES[code]
+            (num_sizes,) = struct.unpack("<Q", fp.read(8))
+            (num_docs,) = struct.unpack("<Q", fp.read(8))
+            offset = fp.tell()
+        self.sizes = np.memmap(path, dtype=np.int32, mode="r", offset=offset, shape=(num_sizes,))
+        offset += self.sizes.nbytes
+        self.pointers = np.memmap(path, dtype=np.int64, mode="r", offset=offset, shape=(num_sizes,))
+        offset += self.pointers.nbytes
+        self.doc_idx = np.memmap(path, dtype=np.int64, mode="r", offset=offset, shape=(num_docs,))
+
+
+def merge_datasets(prefixes: list[str], output_prefix: str, buffer_size: int = 16 * 1024 * 1024) -> None:
+    """Concatenates the datasets at `prefixes` into `output_prefix`, as Megatron-DeepSpeed's `merge_file_` does.
+
+    The `.bin` files are copied as bytes and the index arrays are rewritten in chunks through memory maps,
+    so neither the tokens nor the whole index are loaded into memory.
+    """
+    readers = [IndexReader(f"{prefix}.idx") for prefix in prefixes]
+    dtypes = {reader.dtype for reader in readers}
+    if len(dtypes) > 1:
+        raise ValueError(f"The datasets have different dtypes: {dtypes}")
+    dtype = dtypes.pop() if dtypes else np.uint16
+
+    with open(f"{output_prefix}.bin", "wb") as output_bin:
+        for prefix in prefixes:
+            with open(f"{prefix}.bin", "rb") as fp:
+                shutil.copyfileobj(fp, output_bin, buffer_size)
+
+    num_sizes = sum(len(reader.sizes) for reader in readers)
+    num_docs = 1 + sum(len(reader.doc_idx) - 1 for reader in readers)
+    with open(f"{output_prefix}.idx", "wb") as fp:
+        _write_header(fp, dtype, num_sizes, num_docs)
+        for reader in readers:
+            for start in range(0, len(reader.sizes), MERGE_CHUNK_SIZE):
+                fp.write(np.asarray(reader.sizes[start:start + MERGE_CHUNK_SIZE]).tobytes(order="C"))
+        byte_offset = 0
+        for reader in readers:
+            for start in range(0, len(reader.pointers), MERGE_CHUNK_SIZE):
+                fp.write((reader.pointers[start:start + MERGE_CHUNK_SIZE] + byte_offset).tobytes(order="C"))
+            byte_offset += int(reader.sizes.sum(dtype=np.int64)) * np.dtype(reader.dtype).itemsize
+        fp.write(np.zeros(1, dtype=np.int64).tobytes())
+        sequence_offset = 0
+        for reader in readers:
+            for start in range(1, len(reader.doc_idx), MERGE_CHUNK_SIZE):
+                fp.write((reader.doc_idx[start:start + MERGE_CHUNK_SIZE] + sequence_offset).tobytes(order="C"))
+            sequence_offset += len(reader.sizes)
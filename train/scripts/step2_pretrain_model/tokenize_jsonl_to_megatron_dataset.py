@@ -0,0 +1,186 @@
+# Appends a path to import python scripts that are in other directories.
+import os
+import sys
+sys.path.append(os.path.join(os.environ["HOME"], "ucllm_nedo_dev/train/scripts/common/"))
+
+import argparse
+import glob
+import gzip
+import io
+import json
+import multiprocessing
+import time
+from typing import Iterator, Optional
+
+import sentencepiece as spm
+from indexed_dataset import IndexedDatasetBuilder, best_fitting_dtype, merge_datasets
+from special_token_list import EOD_TOKEN
+
+# The number of documents encoded by SentencePiece at once.
+BATCH_SIZE = 1024
+
+# The SentencePiece processor of each worker process.
+processor: Optional[spm.SentencePieceProcessor] = None
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Tokenizes JSONL files (.jsonl, .jsonl.gz, .jsonl.zst) into a Megatron-DeepSpeed mmap indexed "
+                    "dataset, equivalent to `tools/preprocess_data.py --tokenizer-type SentencePieceTokenizer "
+                    "--dataset-impl mmap --append-eod`.")
+    parser.add_argument("--input", type=str, nargs="+", required=True, help="Input JSONL files or glob patterns.")
+    parser.add_argument("--input_tokenizer_file", type=str, required=True)
+    parser.add_argument("--output_prefix", type=str, required=True,
+                        help="Writes {output_prefix}_{json_key}_document.bin and .idx.")
+    parser.add_argument("--json_key", type=str, default="text")
+    parser.add_argument("--num_workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--chunk_size", type=int, default=256 * 1024 * 1024,
+                        help="Uncompressed input files are split into chunks of about this many bytes.")
+    parser.add_argument("--work_dir", type=str, default=None,
+                        help="The directory for the per-chunk datasets. Defaults to {output_prefix}_chunks.")
+    parser.add_argument("--keep_chunks", action="store_true", help="Keeps the per-chunk datasets after merging.")
+    args = parser.parse_args()
+    print(f"{args = }")
+    return args
+
+
+def split_file(path: str, chunk_size: int) -> list[tuple[int, Optional[int]]]:
+    """Splits a file into (start, end) byte ranges aligned to the starts of lines.
+
+    Compressed files can't be read from the middle, so they are a single range whose end is None.
+    """
+    if path.endswith((".gz", ".zst")):
+        return [(0, None)]
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as fp:
+        while bounds[-1] + chunk_size < size:
+            fp.seek(bounds[-1] + chunk_size)
+            fp.readline()
+            if fp.tell() >= size:
+                break
+            bounds.append(fp.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_lines(path: str, start: int, end: Optional[int]) -> Iterator[bytes]:
+    if path.endswith(".gz"):
+        fp = gzip.open(path, "rb")
+    elif path.endswith(".zst"):
+        import zstandard  # Only needed for zstd-compressed inputs.
+        fp = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                                          closefd=True))
+    else:
+        fp = open(path, "rb")
+    with fp:
+        fp.seek(start)
+        position = start
+        for line in fp:
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            yield line
+
+
+def init_worker(tokenizer_file: str) -> None:
+    global processor
+    processor = spm.SentencePieceProcessor(model_file=tokenizer_file)
+
+
+def tokenize_chunk(task: tuple[str, int, Optional[int], str, str]) -> dict:
+    """Tokenizes the documents in a byte range of a file and writes them to a dataset of their own."""
+    path, start, end, json_key, prefix = task
+    eod_id = processor.piece_to_id(EOD_TOKEN)
+    builder = IndexedDatasetBuilder(prefix + ".tmp", best_fitting_dtype(processor.get_piece_size()))
+    num_docs, num_tokens, num_bytes = 0, 0, 0
+    begin = time.perf_counter()
+
+    def flush(texts: list[str]) -> None:
+        nonlocal num_tokens
+        # Each worker already runs in its own process, so SentencePiece doesn't need threads of its own.
+        for ids in processor.encode(texts, num_threads=1):
+            # Like `preprocess_data.py`, skips documents without any tokens.
+            if ids:
+                builder.add_document(ids + [eod_id])
+                num_tokens += len(ids) + 1
+
+    texts = []
+    for line in iter_lines(path, start, end):
+        num_bytes += len(line)
+        if not line.strip():
+            continue
+        texts.append(json.loads(line)[json_key])
+        num_docs += 1
+        if len(texts) == BATCH_SIZE:
+            flush(texts)
+            texts = []
+    flush(texts)
+    builder.finalize()
+    # The index is renamed last, so a chunk whose index exists is complete.
+    os.replace(prefix + ".tmp.bin", prefix + ".bin")
+    os.replace(prefix + ".tmp.idx", prefix + ".idx")
+    return {"documents": num_docs, "tokens": num_tokens, "bytes": num_bytes, "seconds": time.perf_counter() - begin}
+
+
+def main():
+    args = parse_arguments()
+    # Checks the tokenizer in the main process, not in every worker.
+    tokenizer = spm.SentencePieceProcessor(model_file=args.input_tokenizer_file)
+    if tokenizer.piece_to_id(EOD_TOKEN) == tokenizer.unk_id():
+        raise ValueError(f"The tokenizer doesn't have {EOD_TOKEN} in its vocabulary.")
+
+    input_files = sorted({path for pattern in args.input for path in glob.glob(pattern)})
+    if not input_files:
+        raise ValueError(f"No files match {args.input}.")
+    output_prefix = f"{args.output_prefix}_{args.json_key}_document"
+    work_dir = args.work_dir or f"{args.output_prefix}_chunks"
+    os.makedirs(work_dir, exist_ok=True)
+
+    # The state of the chunks is kept in the work directory so that an interrupted run tokenizes only the rest.
+    config = {"input_files": [[path, os.path.getsize(path)] for path in input_files],
+              "input_tokenizer_file": os.path.abspath(args.input_tokenizer_file),
+              "json_key": args.json_key, "chunk_size": args.chunk_size}
+    config_path = os.path.join(work_dir, "config.json")
+    if os.path.exists(config_path):
+        with open(config_path) as fp:
+            if json.load(fp) != config:
+                raise ValueError(f"{work_dir} was created with different inputs. Remove it or use another --work_dir.")
+    else:
+        with open(config_path, "w") as fp:
+            json.dump(config, fp)
+
+    tasks, prefixes = [], []
+    for file_index, path in enumerate(input_files):
+        for chunk_index, (start, end) in enumerate(split_file(path, args.chunk_size)):
+            prefix = os.path.join(work_dir, f"{file_index:05d}-{chunk_index:05d}")
+            prefixes.append(prefix)
+            if os.path.exists(prefix + ".idx"):
+                continue
+            tasks.append((path, start, end, args.json_key, prefix))
+    print(f"Tokenizing {len(tasks)} of {len(prefixes)} chunks of {len(input_files)} files "
+          f"with {args.num_workers} workers.")
+
+    total = {"documents": 0, "tokens": 0, "bytes": 0}
+    begin = time.perf_counter()
+    with multiprocessing.Pool(args.num_workers, initializer=init_worker,
+                              initargs=(args.input_tokenizer_file,)) as pool:
+        for num_done, result in enumerate(pool.imap_unordered(tokenize_chunk, tasks), 1):
+            for key in total:
+                total[key] += result[key]
+            elapsed = time.perf_counter() - begin
+            print(f"Tokenized {num_done}/{len(tasks)} chunks: {total['documents']:,} documents, "
+                  f"{total['tokens']:,} tokens, {total['bytes'] / 1e6 / elapsed:,.1f} MB/sec")
+
+    print(f"Merging {len(prefixes)} chunks into {output_prefix}.bin and {output_prefix}.idx")
+    merge_datasets(prefixes, output_prefix)
+    if not args.keep_chunks:
+        for prefix in prefixes:
+            os.remove(prefix + ".bin")
+            os.remove(prefix + ".idx")
+        os.remove(config_path)
+        os.rmdir(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ echo ""
 input_tokenizer_file=""
 input_model_dir=""
 output_tokenizer_and_model_dir=""
+fast_tokenizer=""
 
 # Parses the arguments.
 while [[ ${#} -gt 0 ]]; do
@@ -22,6 +23,8 @@ while [[ ${#} -gt 0 ]]; do
         --input_tokenizer_file) input_tokenizer_file=${2}; shift ;;
         --input_model_dir) input_model_dir=${2}; shift ;;
         --output_tokenizer_and_model_dir) output_tokenizer_and_model_dir=${2}; shift ;;
+        # Shifts once for option that doesn't take an argument.
+        --fast_tokenizer) fast_tokenizer="--fast_tokenizer" ;;
         *) echo "Unknown parameter passed: ${1}"; exit 1 ;;
     esac
     # Shifts once per loop to move to the next key/value.
@@ -39,6 +42,7 @@ fi
 echo "input_tokenizer_file = ${input_tokenizer_file}"
 echo "input_model_dir = ${input_model_dir}"
 echo "output_tokenizer_and_model_dir = ${output_tokenizer_and_model_dir}"
+echo "fast_tokenizer = ${fast_tokenizer}"
 echo ""
 
 mkdir -p ${output_tokenizer_and_model_dir}
@@ -46,7 +50,8 @@ mkdir -p ${output_tokenizer_and_model_dir}
 # Converts the tokenizer from SentencePiece format to HuggingFace Transformers format.
 python ${ucllm_nedo_dev_train_dir}/scripts/step3_upload_pretrained_model/convert_tokenizer_from_sentencepiece_to_huggingface_transformers.py \
     --input_tokenizer_file ${input_tokenizer_file} \
-    --output_tokenizer_dir ${output_tokenizer_and_model_dir}
+    --output_tokenizer_dir ${output_tokenizer_and_model_dir} \
+    ${fast_tokenizer}
 
 # Converts the pretrained model from Megatron-DeepSpeed format to HuggingFace Transformers format.
 python ${megatron_deepspeed_dir}/tools/convert_checkpoint/deepspeed_to_transformers.py \
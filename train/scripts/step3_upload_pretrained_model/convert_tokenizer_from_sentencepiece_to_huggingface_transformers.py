@@ -5,27 +5,154 @@ sys.path.append(os.path.join(os.environ["HOME"], "ucllm_nedo_dev/train/scripts/c
 
 
 import argparse
-from transformers import T5Tokenizer
+import gzip
+import json
+import time
+from typing import Optional
+from tokenizers import Regex, Tokenizer, decoders, models, normalizers, pre_tokenizers, processors
+from transformers import T5Tokenizer, T5TokenizerFast
+import sentencepiece_model_pb2
 from special_token_list import UNK_TOKEN, BOS_TOKEN, EOS_TOKEN, PAD_TOKEN, CLS_TOKEN, SEP_TOKEN, EOD_TOKEN, MASK_TOKEN
 
+# SentencePiece's whitespace symbol.
+SPACE_SYMBOL = "▁"
+
+# Used by the equivalence check when `--check_corpus` isn't given.
+BUILTIN_CHECK_CORPUS = [
+    "吾輩は猫である。名前はまだ無い。",
+    "東京都の人口は約1400万人です。\n2023年10月1日\n",
+    "\n先頭と末尾の改行\n\n",
+    "全角英数字ＡＢＣ１２３と半角カナｱｲｳ、記号①Ⅻ½",
+    "Hello, world! This is a test of the tokenizer.",
+    "  leading spaces, trailing spaces  ",
+    "multiple   spaces\tand\ttabs",
+    "Emoji 🍣🍺 and rare characters 𠮷野家 are encoded with byte fallback.",
+    f"Special tokens {BOS_TOKEN} {CLS_TOKEN} text {SEP_TOKEN} {MASK_TOKEN} {PAD_TOKEN} {EOD_TOKEN} in the middle",
+    "https://example.com/path?query=1&x=2 user@example.com 090-1234-5678",
+    "",
+]
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_tokenizer_file", type=str, required=True)
     parser.add_argument("--output_tokenizer_dir", type=str, required=True)
+    parser.add_argument("--fast_tokenizer", action="store_true",
+                        help="Also saves a fast tokenizer (tokenizer.json) after checking it against the slow one.")
+    parser.add_argument("--check_corpus", type=str, default=None,
+                        help="A text file (one text per line) or JSONL file (.jsonl, .jsonl.gz) with a `text` field "
+                             "to check the fast tokenizer on. Defaults to a small built-in sample.")
+    parser.add_argument("--check_max_texts", type=int, default=10000)
+    parser.add_argument("--max_mismatch_rate", type=float, default=0.0,
+                        help="The fraction of texts the fast tokenizer may encode differently. Pieces with equal "
+                             "scores can be chosen in a different order (e.g. '......' + '.' and '.' + '......').")
     args = parser.parse_args()
     print(f"{args = }")
     return args
 
 
+def build_fast_tokenizer(input_tokenizer_file: str) -> Tokenizer:
+    """Builds a `tokenizers` pipeline that reproduces the SentencePiece unigram model trained in step 1.
+
+    Unlike the converter of `T5TokenizerFast`, this keeps byte fallback and SentencePiece's whitespace handling:
+    the dummy prefix is added to the whole text, and a run of whitespace starts a new piece
+    (`allow_whitespace_only_pieces`). User-defined symbols such as `NEWLINE_TOKEN` are not normalized by SentencePiece,
+    so the ones the normalizer would change are swapped with private use characters around it.
+    """
+    model_proto = sentencepiece_model_pb2.ModelProto()
+    with open(input_tokenizer_file, "rb") as f:
+        model_proto.ParseFromString(f.read())
+    trainer_spec, normalizer_spec = model_proto.trainer_spec, model_proto.normalizer_spec
+    if trainer_spec.model_type != sentencepiece_model_pb2.TrainerSpec.UNIGRAM:
+        raise ValueError("Only unigram SentencePiece models can be converted to a fast tokenizer.")
+    if normalizer_spec.remove_extra_whitespaces or trainer_spec.treat_whitespace_as_suffix:
+        raise ValueError("remove_extra_whitespaces and treat_whitespace_as_suffix are not supported.")
+
+    # User-defined symbols have a score of 0, higher than any other piece, so they are never split.
+    tokenizer = Tokenizer(models.Unigram([(piece.piece, piece.score) for piece in model_proto.pieces],
+                                         unk_id=trainer_spec.unk_id, byte_fallback=trainer_spec.byte_fallback))
+
+    precompiled = normalizers.Precompiled(normalizer_spec.precompiled_charsmap)
+    user_defined = [piece.piece for piece in model_proto.pieces
+                    if piece.type == sentencepiece_model_pb2.ModelProto.SentencePiece.USER_DEFINED]
+    protected = [(piece, chr(0xE000 + i)) for i, piece in enumerate(user_defined)
+                 if precompiled.normalize_str(piece) != piece]
+    steps = [normalizers.Replace(piece, placeholder) for piece, placeholder in protected]
+    steps.append(precompiled)
+    steps += [normalizers.Replace(placeholder, piece) for piece, placeholder in protected]
+    steps.append(normalizers.Replace(" ", SPACE_SYMBOL))
+    if normalizer_spec.add_dummy_prefix:
+        steps.append(normalizers.Prepend(SPACE_SYMBOL))
+    tokenizer.normalizer = normalizers.Sequence(steps)
+
+    whitespace = f"{SPACE_SYMBOL}+" if trainer_spec.allow_whitespace_only_pieces else SPACE_SYMBOL
+    tokenizer.pre_tokenizer = pre_tokenizers.Split(Regex(whitespace), behavior="merged_with_next")
+    tokenizer.decoder = decoders.Sequence([
+        decoders.Replace(SPACE_SYMBOL, " "),
+        decoders.ByteFallback(),
+        decoders.Fuse(),
+        decoders.Strip(" ", 1 if normalizer_spec.add_dummy_prefix else 0, 0),
+    ])
+    # Appends `EOS_TOKEN` like `T5Tokenizer` does.
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single=f"$A {EOS_TOKEN}",
+        pair=f"$A {EOS_TOKEN} $B {EOS_TOKEN}",
+        special_tokens=[(EOS_TOKEN, trainer_spec.eos_id)],
+    )
+    return tokenizer
+
+
+def read_check_corpus(check_corpus: Optional[str], max_texts: int) -> list[str]:
+    if check_corpus is None:
+        return BUILTIN_CHECK_CORPUS
+    texts = []
+    is_jsonl = check_corpus.endswith((".jsonl", ".jsonl.gz"))
+    opener = gzip.open if check_corpus.endswith(".gz") else open
+    with opener(check_corpus, "rt", encoding="utf-8") as f:
+        for line in f:
+            if len(texts) >= max_texts:
+                break
+            if is_jsonl:
+                if line.strip():
+                    texts.append(json.loads(line)["text"])
+            else:
+                texts.append(line.rstrip("\n"))
+    return texts
+
+
+def check_equivalence(slow_tokenizer: T5Tokenizer, fast_tokenizer: T5TokenizerFast, texts: list[str]) -> int:
+    """Encodes `texts` with both tokenizers, prints the throughput of each and returns the number of mismatches.
+
+    Note: `T5Tokenizer` doesn't append `EOS_TOKEN` to a text that already ends with it, but `T5TokenizerFast` does.
+    """
+    num_bytes = sum(len(text.encode("utf-8")) for text in texts)
+    results = {}
+    for name, tokenizer in [("slow", slow_tokenizer), ("fast", fast_tokenizer)]:
+        start = time.perf_counter()
+        results[name] = [tokenizer(text)["input_ids"] for text in texts]
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        print(f"{name} tokenizer: {len(texts) / elapsed:,.1f} texts/sec, {num_bytes / 1e6 / elapsed:,.3f} MB/sec")
+    start = time.perf_counter()
+    fast_tokenizer(texts)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"fast tokenizer (batched): {len(texts) / elapsed:,.1f} texts/sec, {num_bytes / 1e6 / elapsed:,.3f} MB/sec")
+
+    num_mismatches = 0
+    for text, slow_ids, fast_ids in zip(texts, results["slow"], results["fast"]):
+        if slow_ids != fast_ids:
+            num_mismatches += 1
+            if num_mismatches <= 5:
+                print(f"Mismatch: {text[:100]!r}\n"
+                      f"  slow: {slow_tokenizer.convert_ids_to_tokens(slow_ids)[:50]}\n"
+                      f"  fast: {fast_tokenizer.convert_ids_to_tokens(fast_ids)[:50]}")
+    print(f"{len(texts) - num_mismatches} / {len(texts)} texts are encoded to the same token IDs.")
+    return num_mismatches
+
+
 def main() -> None:
     args = parse_arguments()
 
-    # Converts the tokenizer from SentencePiece format to HuggingFace Transformers format by loading with `T5Tokenizer`.
-    # Note: `PreTrainedTokenizerFast` (base class) doesn't support byte fallback, but `T5Tokenizer` (derived class) supports byte fallback
-    # https://zenn.dev/selllous/articles/transformers_pretrain_to_ft#tokenizers-t5tokenizer%E5%BD%A2%E5%BC%8F%E3%81%B8%E3%81%AE%E5%A4%89%E6%8F%9B
-    output_tokenizer = T5Tokenizer(
-        vocab_file=args.input_tokenizer_file,
+    tokenizer_kwargs = dict(
         bos_token=BOS_TOKEN,
         eos_token=EOS_TOKEN,
         unk_token=UNK_TOKEN,
@@ -41,9 +168,31 @@ def main() -> None:
         split_special_tokens=True,
     )
 
+    # Converts the tokenizer from SentencePiece format to HuggingFace Transformers format by loading with `T5Tokenizer`.
+    # Note: `PreTrainedTokenizerFast` (base class) doesn't support byte fallback, but `T5Tokenizer` (derived class) supports byte fallback
+    # https://zenn.dev/selllous/articles/transformers_pretrain_to_ft#tokenizers-t5tokenizer%E5%BD%A2%E5%BC%8F%E3%81%B8%E3%81%AE%E5%A4%89%E6%8F%9B
+    output_tokenizer = T5Tokenizer(vocab_file=args.input_tokenizer_file, **tokenizer_kwargs)
+
     os.makedirs(args.output_tokenizer_dir, exist_ok=True)
     output_tokenizer.save_pretrained(args.output_tokenizer_dir)
 
+    if args.fast_tokenizer:
+        # Builds the fast tokenizer from the SentencePiece model directly, since `T5TokenizerFast`'s own converter
+        # drops byte fallback. `AutoTokenizer` loads it instead of the slow one once tokenizer.json is saved.
+        fast_tokenizer = T5TokenizerFast(vocab_file=args.input_tokenizer_file,
+                                         tokenizer_object=build_fast_tokenizer(args.input_tokenizer_file),
+                                         **tokenizer_kwargs)
+        fast_tokenizer.save_pretrained(args.output_tokenizer_dir)
+
+        # Checks the saved tokenizers as they are loaded downstream.
+        texts = read_check_corpus(args.check_corpus, args.check_max_texts)
+        num_mismatches = check_equivalence(T5Tokenizer.from_pretrained(args.output_tokenizer_dir),
+                                           T5TokenizerFast.from_pretrained(args.output_tokenizer_dir), texts)
+        if num_mismatches > args.max_mismatch_rate * len(texts):
+            # Removes tokenizer.json so that only the slow tokenizer is used.
+            os.remove(os.path.join(args.output_tokenizer_dir, "tokenizer.json"))
+            raise RuntimeError(f"The fast tokenizer encoded {num_mismatches} texts differently, so it wasn't saved.")
+
 
 if __name__ == "__main__":
     main()